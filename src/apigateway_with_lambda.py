@@ -1,165 +1,478 @@
+import hashlib
+import json
+
 from awacs import aws, sts
-from troposphere import GetAtt, Join, Parameter, Ref, Template, apigateway, awslambda, iam
-
-template = Template()
-
-template.add_description("Example API Gateway with Lambda as backend")
-
-param_lambda_source_bucket = template.add_parameter(Parameter(
-    "LambdaSourceBucket",
-    Type="String",
-    Description="Name of the bucket where lambda function sources is stored"
-))
-
-param_lambda_file_name = template.add_parameter(Parameter(
-    "LambdaFileName",
-    Type="String",
-    Description="Name of the ZIP file with lambda function sources inside S3 bucket"
-))
-
-lambda_role = template.add_resource(iam.Role(
-    "LambaRole",
-    AssumeRolePolicyDocument=aws.Policy(
-        Statement=[
-            aws.Statement(
-                Effect=aws.Allow,
-                Action=[sts.AssumeRole],
-                Principal=aws.Principal(
-                    "Service", ["lambda.amazonaws.com"]
-                )
-            )
-        ]
-    ),
-    Policies=[
-        iam.Policy(
-            PolicyName="LambdaPolicy",
-            PolicyDocument=aws.Policy(
-                Statement=[
-                    aws.Statement(
-                        Effect=aws.Allow,
-                        Action=[
-                            aws.Action("logs", "CreateLogGroup"),
-                            aws.Action("logs", "CreateLogStream"),
-                            aws.Action("logs", "PutLogEvents"),
-                        ],
-                        Resource=["arn:aws:logs:*:*:*"]
+from troposphere import GetAtt, Join, Parameter, Ref, Template
+from troposphere import apigateway, apigatewayv2, applicationautoscaling, awslambda, iam
+
+from common.apigateway import CACHE_SIZES, stage_logging
+
+if "Architectures" in awslambda.Function.props:
+    Function = awslambda.Function
+else:
+    class Function(awslambda.Function):  # troposphere 2.x predates arm64 functions
+        props = dict(awslambda.Function.props, Architectures=([str], False))
+
+API_TYPES = ("rest", "http")
+RUNTIMES = ["python3.9", "python3.10", "python3.11", "python3.12"]
+
+# request parameters the Lambda response depends on, used as cache keys
+CACHE_KEY_PARAMETERS = ["method.request.path.param1", "method.request.querystring.param2"]
+METHOD_DEFAULTS = {
+    "cache_ttl": 300,  # seconds, 0 to bypass the cache for the method
+    "rate_limit": None,  # steady-state requests per second, None for the account default
+    "burst_limit": None,  # concurrent requests, None for the account default
+}
+# methods of the API, "*" matches any method or resource
+METHODS = [("GET", "/{param1}")]
+
+
+def _methods(methods):
+    """
+    :type methods dict[str, dict] options by "<HTTP method> <resource path>", see METHOD_DEFAULTS
+    :rtype dict[str, dict] the options of every method completed with the defaults
+    """
+    result = {}
+    for key, options in methods.items():
+        http_method, _, path = key.partition(" ")
+        if not any(http_method in (method, "*") and path in (resource, "/*") for method, resource in METHODS):
+            raise ValueError("unknown method {!r}, expected one of {}".format(
+                key, ", ".join(" ".join(method) for method in METHODS)
+            ))
+        unknown = set(options) - set(METHOD_DEFAULTS)
+        if unknown:
+            raise ValueError("unknown options for {}: {}".format(key, ", ".join(sorted(unknown))))
+        options = dict(METHOD_DEFAULTS, **options)
+        if not 0 <= options["cache_ttl"] <= 3600:
+            raise ValueError("cache_ttl of {} must be between 0 and 3600, got {!r}".format(key, options["cache_ttl"]))
+        result[key] = options
+    return result
+
+
+def _method_settings(methods, caching):
+    """
+    :type methods dict[str, dict] see _methods()
+    :type caching bool whether the stage has a cache cluster
+    :rtype list[apigateway.MethodSetting]
+    """
+    settings = []
+    for key, options in sorted(_methods(methods).items()):
+        http_method, _, path = key.partition(" ")
+        setting = dict(
+            HttpMethod=http_method,
+            # every "/" of the resource path is escaped as "~1", "/*" stands for every resource
+            ResourcePath=path if path == "/*" else "/" + path.replace("/", "~1"),
+        )
+        if caching:
+            setting.update(CachingEnabled=options["cache_ttl"] > 0, CacheTtlInSeconds=options["cache_ttl"])
+        if options["rate_limit"] is not None:
+            setting["ThrottlingRateLimit"] = options["rate_limit"]
+        if options["burst_limit"] is not None:
+            setting["ThrottlingBurstLimit"] = options["burst_limit"]
+        settings.append(apigateway.MethodSetting(**setting))
+    return settings
+
+
+def build_template(api_name="MyAPI", api_description="My API", stage_name="live", cache_size=None, methods=None,
+                   provisioned_concurrency=False, api_type="rest", tracing=False, access_logs=False):
+    """
+    :type api_name str
+    :type api_description str
+    :type stage_name str
+    :type cache_size str stage cache cluster size in GB (see common.apigateway.CACHE_SIZES), None for no cache
+    :type methods dict[str, dict] cache TTL and throttling by "<HTTP method> <resource path>", e.g.
+        {"GET /{param1}": {"cache_ttl": 60, "rate_limit": 100, "burst_limit": 200}}, see METHOD_DEFAULTS;
+        with a cache and no methods every method is cached for the default TTL
+    :type provisioned_concurrency bool publish a version behind an alias named like the stage, keep
+        initialized instances of it auto scaled on their utilization and let the API call the alias
+    :type api_type str "rest" for a REST API with a mapped AWS integration, "http" for an HTTP API
+        with a Lambda proxy integration (no stage cache, methods only set throttling)
+    :type tracing bool X-Ray active tracing of the Lambda and, for the REST API, of the stage
+    :type access_logs bool JSON access logs with latency fields into a log group kept LogRetentionDays
+    :rtype Template
+    """
+    if api_type not in API_TYPES:
+        raise ValueError("unknown api_type {!r}, expected one of {}".format(api_type, ", ".join(API_TYPES)))
+    if cache_size is not None and api_type == "http":
+        raise ValueError("HTTP APIs have no cache, cache_size needs the REST API")
+    if cache_size is not None and cache_size not in CACHE_SIZES:
+        raise ValueError("cache_size must be one of {}, got {!r}".format(", ".join(CACHE_SIZES), cache_size))
+    if methods is None:
+        methods = {"* /*": {}} if cache_size is not None else {}
+
+    template = Template()
+
+    template.add_description("Example API Gateway with Lambda as backend")
+
+    param_lambda_source_bucket = template.add_parameter(Parameter(
+        "LambdaSourceBucket",
+        Type="String",
+        Description="Name of the bucket where lambda function sources is stored"
+    ))
+
+    param_lambda_file_name = template.add_parameter(Parameter(
+        "LambdaFileName",
+        Type="String",
+        Description="Name of the ZIP file with lambda function sources inside S3 bucket"
+    ))
+
+    lambda_role = template.add_resource(iam.Role(
+        "LambaRole",
+        AssumeRolePolicyDocument=aws.Policy(
+            Statement=[
+                aws.Statement(
+                    Effect=aws.Allow,
+                    Action=[sts.AssumeRole],
+                    Principal=aws.Principal(
+                        "Service", ["lambda.amazonaws.com"]
                     )
-                ]
+                )
+            ]
+        ),
+        Policies=[
+            iam.Policy(
+                PolicyName="LambdaPolicy",
+                PolicyDocument=aws.Policy(
+                    Statement=[
+                        aws.Statement(
+                            Effect=aws.Allow,
+                            Action=[
+                                aws.Action("logs", "CreateLogGroup"),
+                                aws.Action("logs", "CreateLogStream"),
+                                aws.Action("logs", "PutLogEvents"),
+                            ],
+                            Resource=["arn:aws:logs:*:*:*"]
+                        )
+                    ]
+                )
             )
+        ],
+        **({"ManagedPolicyArns": ["arn:aws:iam::aws:policy/AWSXRayDaemonWriteAccess"]} if tracing else {})
+    ))
+
+    param_lambda_memory_size = template.add_parameter(Parameter(
+        "LambdaMemorySize",
+        Type="Number",
+        Default="128",
+        MinValue=128,
+        MaxValue=10240,
+        Description="MB of memory for the lambda function, CPU is allocated in proportion (1769 MB is one vCPU)"
+    ))
+
+    param_lambda_architecture = template.add_parameter(Parameter(
+        "LambdaArchitecture",
+        Type="String",
+        AllowedValues=["x86_64", "arm64"],
+        Default="x86_64",
+        Description="Instruction set of the lambda function, arm64 (Graviton) is cheaper per GB-second"
+    ))
+
+    param_lambda_runtime = template.add_parameter(Parameter(
+        "LambdaRuntime",
+        Type="String",
+        AllowedValues=RUNTIMES,
+        Default=RUNTIMES[-1],
+        Description="Python runtime of the lambda function"
+    ))
+
+    lambda_function = template.add_resource(Function(
+        "Lambda",
+        Code=awslambda.Code(
+            S3Bucket=Ref(param_lambda_source_bucket),
+            S3Key=Ref(param_lambda_file_name)
+        ),
+        Handler="lambda.lambda_handler",
+        MemorySize=Ref(param_lambda_memory_size),
+        Architectures=[Ref(param_lambda_architecture)],
+        Role=GetAtt(lambda_role, "Arn"),
+        Runtime=Ref(param_lambda_runtime),
+        Timeout=30,
+        **({"TracingConfig": awslambda.TracingConfig(Mode="Active")} if tracing else {})
+    ))
+
+    # what the API invokes, $LATEST or the alias (whose ARN serves as name too)
+    lambda_name, lambda_arn = Ref(lambda_function), GetAtt(lambda_function, "Arn")
+    if provisioned_concurrency:
+        lambda_name = lambda_arn = Ref(
+            _provisioned_concurrency(template, lambda_function, stage_name)
         )
-    ]
-))
-
-lambda_function = template.add_resource(awslambda.Function(
-    "Lambda",
-    Code=awslambda.Code(
-        S3Bucket=Ref(param_lambda_source_bucket),
-        S3Key=Ref(param_lambda_file_name)
-    ),
-    Handler="lambda.lambda_handler",
-    MemorySize=128,
-    Role=GetAtt(lambda_role, "Arn"),
-    Runtime="python2.7",
-    Timeout=30
-))
-
-api = template.add_resource(apigateway.RestApi(
-    "API",
-    Description="My API",
-    Name="MyAPI"
-))
-
-api_lambda_permission = template.add_resource(awslambda.Permission(
-    "APILambdaPermission",
-    Action="lambda:InvokeFunction",
-    FunctionName=Ref(lambda_function),
-    Principal="apigateway.amazonaws.com",
-    SourceArn=Join("", [
-        "arn:aws:execute-api:",
-        Ref("AWS::Region"),
-        ":",
-        Ref("AWS::AccountId"),
-        ":",
-        Ref(api),
-        "/*/GET/*"
-    ])
-))
-
-api_first_resource = template.add_resource(apigateway.Resource(
-    "APIFirstResource",
-    ParentId=GetAtt(api, "RootResourceId"),
-    PathPart="{param1}",
-    RestApiId=Ref(api)
-))
-
-api_first_method = template.add_resource(apigateway.Method(
-    "APIFirstResourceMethodGET",
-    ApiKeyRequired=False,
-    AuthorizationType="NONE",
-    HttpMethod="GET",
-    ResourceId=Ref(api_first_resource),
-    RestApiId=Ref(api),
-    Integration=apigateway.Integration(
-        Type="AWS",
-        IntegrationHttpMethod="POST",
-        Uri=Join("", [
-            "arn:aws:apigateway:",
+
+    if api_type == "http":
+        api = template.add_resource(apigatewayv2.Api(
+            "API",
+            Description=api_description,
+            Name=api_name,
+            ProtocolType="HTTP"
+        ))
+    else:
+        api = template.add_resource(apigateway.RestApi(
+            "API",
+            Description=api_description,
+            Name=api_name
+        ))
+
+    api_lambda_permission = template.add_resource(awslambda.Permission(
+        "APILambdaPermission",
+        Action="lambda:InvokeFunction",
+        FunctionName=lambda_name,
+        Principal="apigateway.amazonaws.com",
+        SourceArn=Join("", [
+            "arn:aws:execute-api:",
             Ref("AWS::Region"),
-            ":lambda:path/2015-03-31/functions/",
-            GetAtt(lambda_function, "Arn"),
-            "/invocations"
-        ]),
-        RequestTemplates={
-            "application/json": Join("", [
-                "{\"param1\": \"$input.params('param1')\", \"param2\": \"$input.params('param2')\"}"
-            ])
+            ":",
+            Ref("AWS::AccountId"),
+            ":",
+            Ref(api),
+            "/*/GET/*"
+        ])
+    ))
+
+    logging_options = stage_logging(template, api_type, tracing, access_logs)
+    if api_type == "http":
+        _http_api(template, api, lambda_arn, stage_name, methods, logging_options)
+    else:
+        _rest_api(template, api, lambda_arn, stage_name, cache_size, methods, logging_options)
+
+    return template
+
+
+def _rest_api(template, api, lambda_arn, stage_name, cache_size, methods, logging_options):
+    """
+    GET /{param1} with a non-proxy AWS integration mapping the request parameters into the event.
+    """
+    method_settings = _method_settings(methods, cache_size is not None)
+
+    api_first_resource = template.add_resource(apigateway.Resource(
+        "APIFirstResource",
+        ParentId=GetAtt(api, "RootResourceId"),
+        PathPart="{param1}",
+        RestApiId=Ref(api)
+    ))
+
+    api_first_method = template.add_resource(apigateway.Method(
+        "APIFirstResourceMethodGET",
+        ApiKeyRequired=False,
+        AuthorizationType="NONE",
+        HttpMethod="GET",
+        ResourceId=Ref(api_first_resource),
+        RestApiId=Ref(api),
+        Integration=apigateway.Integration(
+            Type="AWS",
+            IntegrationHttpMethod="POST",
+            Uri=Join("", [
+                "arn:aws:apigateway:",
+                Ref("AWS::Region"),
+                ":lambda:path/2015-03-31/functions/",
+                lambda_arn,
+                "/invocations"
+            ]),
+            RequestTemplates={
+                "application/json": Join("", [
+                    "{\"param1\": \"$input.params('param1')\", \"param2\": \"$input.params('param2')\"}"
+                ])
+            },
+            IntegrationResponses=[
+                apigateway.IntegrationResponse(
+                    "IntegrationResponse",
+                    StatusCode="200",
+                    ResponseTemplates={
+                        "application/json": "$input.params('whatever')"
+                    }
+                ),
+                apigateway.IntegrationResponse(
+                    "IntegrationResponse",
+                    StatusCode="404",
+                    SelectionPattern="[a-zA-Z]+.*",  # any error
+                    ResponseTemplates={
+                        "application/json": "$input.params('whatever')"
+                    }
+                ),
+            ],
+            **({"CacheKeyParameters": CACHE_KEY_PARAMETERS} if cache_size is not None else {})
+        ),
+        RequestParameters={
+            "method.request.path.param1": True,
+            "method.request.querystring.param2": True
         },
-        IntegrationResponses=[
-            apigateway.IntegrationResponse(
-                "IntegrationResponse",
-                StatusCode="200",
-                ResponseTemplates={
-                    "application/json": "$input.params('whatever')"
-                }
-            ),
-            apigateway.IntegrationResponse(
-                "IntegrationResponse",
-                StatusCode="404",
-                SelectionPattern="[a-zA-Z]+.*",  # any error
-                ResponseTemplates={
-                    "application/json": "$input.params('whatever')"
-                }
+        MethodResponses=[
+            apigateway.MethodResponse(
+                "APIResponse",
+                StatusCode="200"
             ),
+            apigateway.MethodResponse(
+                "APIResponse",
+                StatusCode="404"
+            )
         ]
-    ),
-    RequestParameters={
-        "method.request.path.param1": True,
-        "method.request.querystring.param2": True
-    },
-    MethodResponses=[
-        apigateway.MethodResponse(
-            "APIResponse",
-            StatusCode="200"
-        ),
-        apigateway.MethodResponse(
-            "APIResponse",
-            StatusCode="404"
+    ))
+
+    api_deployment = template.add_resource(apigateway.Deployment(
+        "APIDeployment",
+        RestApiId=Ref(api),
+        DependsOn=api_first_method.title
+    ))
+
+    stage_options = dict(logging_options)
+    if cache_size is not None:
+        stage_options["CacheClusterSize"] = cache_size
+    if method_settings:
+        stage_options["MethodSettings"] = method_settings
+
+    template.add_resource(apigateway.Stage(
+        "APIStage",
+        CacheClusterEnabled=cache_size is not None,
+        DeploymentId=Ref(api_deployment),
+        RestApiId=Ref(api),
+        StageName=stage_name,
+        **stage_options
+    ))
+
+
+def _http_api(template, api, lambda_arn, stage_name, methods, logging_options):
+    """
+    A route per method with a Lambda proxy integration (payload format 2.0), the function gets
+    the whole request (pathParameters, queryStringParameters, ...) instead of a mapped event.
+    """
+    integration = template.add_resource(apigatewayv2.Integration(
+        "APIIntegration",
+        ApiId=Ref(api),
+        IntegrationType="AWS_PROXY",
+        IntegrationUri=lambda_arn,
+        PayloadFormatVersion="2.0"
+    ))
+
+    routes = []
+    for number, (http_method, path) in enumerate(METHODS, 1):
+        routes.append(template.add_resource(apigatewayv2.Route(
+            "APIRoute{}".format(number),
+            ApiId=Ref(api),
+            RouteKey="{} {}".format(http_method, path),
+            AuthorizationType="NONE",
+            Target=Join("/", ["integrations", Ref(integration)])
+        )))
+
+    stage_options = dict(logging_options)
+    for key, options in sorted(_methods(methods).items()):
+        if "cache_ttl" in methods[key]:
+            raise ValueError("HTTP APIs have no cache, cache_ttl of {} cannot be set".format(key))
+        settings = apigatewayv2.RouteSettings()
+        if options["rate_limit"] is not None:
+            settings.ThrottlingRateLimit = options["rate_limit"]
+        if options["burst_limit"] is not None:
+            settings.ThrottlingBurstLimit = options["burst_limit"]
+        if key == "* /*":
+            stage_options["DefaultRouteSettings"] = settings
+        else:
+            stage_options.setdefault("RouteSettings", {})[key] = settings
+
+    # every change to the routes is deployed right away, no Deployment resources needed; RouteSettings
+    # can only refer to routes that already exist
+    template.add_resource(apigatewayv2.Stage(
+        "APIStage",
+        ApiId=Ref(api),
+        StageName=stage_name,
+        AutoDeploy=True,
+        DependsOn=[route.title for route in routes],
+        **stage_options
+    ))
+
+
+def _parameter_refs(value):
+    if isinstance(value, dict):
+        if set(value) == {"Ref"}:
+            yield value["Ref"]
+        for item in value.values():
+            for name in _parameter_refs(item):
+                yield name
+    elif isinstance(value, list):
+        for item in value:
+            for name in _parameter_refs(item):
+                yield name
+
+
+def _provisioned_concurrency(template, lambda_function, stage_name):
+    """
+    :rtype awslambda.Alias alias of the published version, Ref gives its ARN
+    """
+    param_min = template.add_parameter(Parameter(
+        "ProvisionedConcurrencyMin",
+        Type="Number",
+        Default="1",
+        MinValue=1,
+        Description="Initialized lambda instances kept ready at all times"
+    ))
+
+    param_max = template.add_parameter(Parameter(
+        "ProvisionedConcurrencyMax",
+        Type="Number",
+        Default="10",
+        MinValue=1,
+        Description="Upper limit for auto scaling the initialized lambda instances"
+    ))
+
+    param_target = template.add_parameter(Parameter(
+        "ProvisionedConcurrencyTarget",
+        Type="Number",
+        Default="0.7",
+        MinValue=0.1,
+        MaxValue=0.9,
+        Description="Fraction of the initialized lambda instances in use that auto scaling aims for"
+    ))
+
+    # a version is immutable, its Description holds the values of every parameter the function refers to
+    # and a hash of its properties, so any code or configuration change publishes a new one
+    properties = lambda_function.to_dict()["Properties"]
+    description = ["Properties {}".format(
+        hashlib.sha256(json.dumps(properties, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    )]
+    for name in sorted(set(_parameter_refs(properties)) & set(template.parameters)):
+        description += [", {} ".format(name), Ref(name)]
+    lambda_version = template.add_resource(awslambda.Version(
+        "LambdaVersion",
+        FunctionName=Ref(lambda_function),
+        Description=Join("", description)
+    ))
+
+    lambda_alias = template.add_resource(awslambda.Alias(
+        "LambdaAlias",
+        FunctionName=Ref(lambda_function),
+        FunctionVersion=GetAtt(lambda_version, "Version"),
+        Name=stage_name,
+        ProvisionedConcurrencyConfig=awslambda.ProvisionedConcurrencyConfiguration(
+            ProvisionedConcurrentExecutions=Ref(param_min)
         )
-    ]
-))
-
-api_deployment = template.add_resource(apigateway.Deployment(
-    "APIDeployment",
-    RestApiId=Ref(api),
-    DependsOn=api_first_method.title
-))
-
-api_stage = template.add_resource(apigateway.Stage(
-    "APIStage",
-    CacheClusterEnabled=False,
-    DeploymentId=Ref(api_deployment),
-    RestApiId=Ref(api),
-    StageName="live"
-))
-
-print(template.to_json())
+    ))
+
+    scalable_target = template.add_resource(applicationautoscaling.ScalableTarget(
+        "LambdaScalableTarget",
+        ServiceNamespace="lambda",
+        ScalableDimension="lambda:function:ProvisionedConcurrency",
+        ResourceId=Join(":", ["function", Ref(lambda_function), stage_name]),
+        MinCapacity=Ref(param_min),
+        MaxCapacity=Ref(param_max),
+        RoleARN=Join("", [
+            "arn:aws:iam::", Ref("AWS::AccountId"),
+            ":role/aws-service-role/lambda.application-autoscaling.amazonaws.com/"
+            "AWSServiceRoleForApplicationAutoScaling_LambdaConcurrency",
+        ]),
+        DependsOn=lambda_alias.title
+    ))
+
+    template.add_resource(applicationautoscaling.ScalingPolicy(
+        "LambdaScalingPolicy",
+        PolicyName=Join("-", [Ref("AWS::StackName"), "provisioned-concurrency"]),
+        PolicyType="TargetTrackingScaling",
+        ScalingTargetId=Ref(scalable_target),
+        TargetTrackingScalingPolicyConfiguration=applicationautoscaling.TargetTrackingScalingPolicyConfiguration(
+            PredefinedMetricSpecification=applicationautoscaling.PredefinedMetricSpecification(
+                PredefinedMetricType="LambdaProvisionedConcurrencyUtilization"
+            ),
+            TargetValue=Ref(param_target)
+        )
+    ))
+
+    return lambda_alias
+
+
+if __name__ == "__main__":
+    print(build_template().to_json())
@@ -1,43 +1,247 @@
+import copy
+import hashlib
+import json
+import os
+
 from troposphere import Parameter, Ref, Template, apigateway
 
-template = Template()
-
-template.add_description("Example API Gateway from Swagger")
-
-param_source_bucket = template.add_parameter(Parameter(
-    "SourceBucket",
-    Type="String",
-    Description="Name of the bucket where Swagger file is stored"
-))
-
-param_ile_name = template.add_parameter(Parameter(
-    "FileName",
-    Type="String",
-    Description="Name of the Swagger file inside S3 bucket"
-))
-
-api = template.add_resource(apigateway.RestApi(
-    "API",
-    Description="My API",
-    Name="MyAPI",
-    BodyS3Location=apigateway.S3Location(
-        Bucket=Ref(param_source_bucket),
-        Key=Ref(param_ile_name)
-    )
-))
-
-api_deployment = template.add_resource(apigateway.Deployment(
-    "APIDeployment",
-    RestApiId=Ref(api),
-    DependsOn=api.title,
-))
-
-api_stage = template.add_resource(apigateway.Stage(
-    "APIStage",
-    CacheClusterEnabled=False,
-    DeploymentId=Ref(api_deployment),
-    RestApiId=Ref(api),
-    StageName="live",
-))
-
-print(template.to_json())
+from common.apigateway import CACHE_SIZES, stage_logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# responses smaller than this many bytes are not compressed
+MINIMUM_COMPRESSION_SIZE = 1024
+HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "x-amazon-apigateway-any-method")
+# extensions on a path (all its methods) or an operation that become stage MethodSettings,
+# they are removed from the inlined definition
+SETTING_EXTENSIONS = {
+    "x-cache-ttl": "CacheTtlInSeconds",
+    "x-throttling-rate-limit": "ThrottlingRateLimit",
+    "x-throttling-burst-limit": "ThrottlingBurstLimit",
+}
+
+_loaded = {}
+
+
+def load_swagger(path):
+    """
+    Reads and validates a Swagger 2.0 definition, every file only once.
+
+    :type path str relative to the repository root or absolute
+    :rtype dict
+    """
+    path = os.path.join(ROOT, path)
+    if path not in _loaded:
+        with open(path) as f:
+            try:
+                definition = json.load(f)
+            except ValueError as e:
+                raise ValueError("{} is not valid JSON: {}".format(path, e))
+        validate_swagger(definition, path)
+        _loaded[path] = definition
+    return _loaded[path]
+
+
+def _references(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "$ref" and isinstance(item, str):
+                yield item
+            else:
+                for reference in _references(item):
+                    yield reference
+    elif isinstance(value, list):
+        for item in value:
+            for reference in _references(item):
+                yield reference
+
+
+def validate_swagger(definition, name="swagger"):
+    """
+    Checks what API Gateway needs to import the definition: paths with operations that all
+    have responses and an integration, resolvable local $refs and valid setting extensions.
+    """
+    def fail(message, *args):
+        raise ValueError("{}: {}".format(name, message.format(*args)))
+
+    if definition.get("swagger") != "2.0":
+        fail("only Swagger 2.0 is supported, got {!r}", definition.get("swagger"))
+    if not definition.get("info", {}).get("title"):
+        fail("info.title is missing")
+    if not definition.get("paths"):
+        fail("no paths defined")
+
+    for path, item in definition["paths"].items():
+        if not path.startswith("/"):
+            fail("path {!r} does not start with /", path)
+        operations = [method for method in item if method in HTTP_METHODS]
+        if not operations:
+            fail("{} has no operations", path)
+        for method in operations:
+            operation = item[method]
+            if not operation.get("responses"):
+                fail("{} {} has no responses", method.upper(), path)
+            if "x-amazon-apigateway-integration" not in operation:
+                fail("{} {} has no x-amazon-apigateway-integration", method.upper(), path)
+            _validate_settings(operation, "{} {}".format(method.upper(), path), fail)
+        _validate_settings(item, path, fail)
+
+    for reference in _references(definition):
+        parts = reference.split("/")
+        if parts[0] != "#" or len(parts) != 3 or parts[2] not in definition.get(parts[1], {}):
+            fail("unresolved $ref {!r}", reference)
+
+
+def _validate_settings(value, name, fail):
+    for extension in SETTING_EXTENSIONS:
+        setting = value.get(extension)
+        if setting is None:
+            continue
+        if not isinstance(setting, (int, float)) or isinstance(setting, bool) or setting < 0:
+            fail("{} of {} must be a non-negative number, got {!r}", extension, name, setting)
+    if not 0 <= value.get("x-cache-ttl", 0) <= 3600:
+        fail("x-cache-ttl of {} must be at most 3600 seconds", name)
+
+
+def method_settings(definition):
+    """
+    Stage MethodSettings from the setting extensions, path level ones apply to every method
+    of the path and are overridden by the operation's own.
+
+    :rtype list[apigateway.MethodSetting]
+    """
+    settings = []
+    for path, item in sorted(definition["paths"].items()):
+        # every "/" of the resource path is escaped as "~1", the root stays "/"
+        resource_path = "/" if path == "/" else "/" + path.replace("/", "~1")
+        targets = [("*", item)] + [(method.upper(), item[method]) for method in HTTP_METHODS if method in item]
+        for http_method, value in targets:
+            setting = dict(
+                (SETTING_EXTENSIONS[extension], value[extension])
+                for extension in SETTING_EXTENSIONS if extension in value
+            )
+            if not setting:
+                continue
+            if "CacheTtlInSeconds" in setting:
+                setting["CachingEnabled"] = setting["CacheTtlInSeconds"] > 0
+            if http_method == "X-AMAZON-APIGATEWAY-ANY-METHOD":
+                http_method = "*"
+            settings.append(apigateway.MethodSetting(
+                HttpMethod=http_method,
+                ResourcePath=resource_path,
+                **setting
+            ))
+    return settings
+
+
+def _strip_settings(definition):
+    body = copy.deepcopy(definition)
+    for item in body["paths"].values():
+        for method in HTTP_METHODS:
+            if method not in item:
+                continue
+            # without cache keys every request of a cached method gets the first cached response
+            integration = item[method]["x-amazon-apigateway-integration"]
+            cache_ttl = item[method].get("x-cache-ttl", item.get("x-cache-ttl", 0))
+            if cache_ttl > 0 and "cacheKeyParameters" not in integration:
+                integration["cacheKeyParameters"] = sorted(
+                    value for value in integration.get("requestParameters", {}).values()
+                    if value.startswith("method.request.")
+                )
+        for value in [item] + [item[method] for method in HTTP_METHODS if method in item]:
+            for extension in SETTING_EXTENSIONS:
+                value.pop(extension, None)
+    return body
+
+
+def build_template(api_name="MyAPI", api_description="My API", stage_name="live", swagger=None,
+                   minimum_compression_size=None, cache_size="0.5", tracing=False, access_logs=False):
+    """
+    :type api_name str
+    :type api_description str
+    :type stage_name str
+    :type swagger str Swagger file to validate and inline as Body (e.g. "swagger.json") instead of
+        reading it from the SourceBucket/FileName parameters; its x-cache-ttl, x-throttling-rate-limit
+        and x-throttling-burst-limit extensions become stage MethodSettings, cached operations without
+        cacheKeyParameters are keyed on the method request parameters their integration maps
+    :type minimum_compression_size int responses from this many bytes on are compressed,
+        MINIMUM_COMPRESSION_SIZE by default with an inlined definition, None otherwise
+    :type cache_size str stage cache cluster size in GB (see common.apigateway.CACHE_SIZES), used when an inlined
+        definition caches any method
+    :type tracing bool X-Ray tracing of the stage
+    :type access_logs bool JSON access logs with latency fields into a log group kept LogRetentionDays
+    :rtype Template
+    """
+    if cache_size not in CACHE_SIZES:
+        raise ValueError("cache_size must be one of {}, got {!r}".format(", ".join(CACHE_SIZES), cache_size))
+
+    template = Template()
+
+    template.add_description("Example API Gateway from Swagger")
+
+    api_options = {}
+    stage_options = stage_logging(template, "rest", tracing, access_logs)
+    caching = False
+    deployment_title = "APIDeployment"
+    if swagger is not None:
+        definition = load_swagger(swagger)
+        api_options["Body"] = _strip_settings(definition)
+        # a deployment is a snapshot, a changed definition needs a new one to reach the stage
+        deployment_title += hashlib.sha256(
+            json.dumps(api_options["Body"], sort_keys=True).encode("utf-8")
+        ).hexdigest()[:8]
+        if minimum_compression_size is None:
+            minimum_compression_size = MINIMUM_COMPRESSION_SIZE
+
+        settings = method_settings(definition)
+        if settings:
+            stage_options["MethodSettings"] = settings
+        caching = any(getattr(setting, "CachingEnabled", False) for setting in settings)
+        if caching:
+            stage_options["CacheClusterSize"] = cache_size
+    else:
+        param_source_bucket = template.add_parameter(Parameter(
+            "SourceBucket",
+            Type="String",
+            Description="Name of the bucket where Swagger file is stored"
+        ))
+
+        param_ile_name = template.add_parameter(Parameter(
+            "FileName",
+            Type="String",
+            Description="Name of the Swagger file inside S3 bucket"
+        ))
+
+        api_options["BodyS3Location"] = apigateway.S3Location(
+            Bucket=Ref(param_source_bucket),
+            Key=Ref(param_ile_name)
+        )
+    if minimum_compression_size is not None:
+        api_options["MinimumCompressionSize"] = minimum_compression_size
+
+    api = template.add_resource(apigateway.RestApi(
+        "API",
+        Description=api_description,
+        Name=api_name,
+        **api_options
+    ))
+
+    api_deployment = template.add_resource(apigateway.Deployment(
+        deployment_title,
+        RestApiId=Ref(api),
+        DependsOn=api.title,
+    ))
+
+    api_stage = template.add_resource(apigateway.Stage(
+        "APIStage",
+        CacheClusterEnabled=caching,
+        DeploymentId=Ref(api_deployment),
+        RestApiId=Ref(api),
+        StageName=stage_name,
+        **stage_options
+    ))
+
+    return template
+
+
+if __name__ == "__main__":
+    print(build_template().to_json())
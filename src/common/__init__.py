@@ -0,0 +1,4 @@
+"""
+Code shared by several templates. tools.build puts src/ on sys.path, so templates import it as
+"from common.subnets import plan"; standalone runs of a template package need PYTHONPATH=src.
+"""
@@ -0,0 +1,104 @@
+"""
+API Gateway stage settings shared by apigateway_with_lambda and apigateway_with_swagger.
+"""
+import json
+
+from awacs import aws, sts
+from troposphere import GetAtt, Parameter, Ref
+from troposphere import apigateway, apigatewayv2, iam, logs
+
+# stage cache cluster sizes in GB
+CACHE_SIZES = ("0.5", "1.6", "6.1", "13.5", "28.4", "58.2", "118", "237")
+
+LOG_RETENTION_DAYS = [1, 3, 5, 7, 14, 30, 60, 90, 120, 150, 180, 365, 400, 545, 731, 1827, 3653]
+# responseLatency is the whole request as seen by the client, integrationLatency the part spent
+# in the backend; a REST cache hit never reaches the integration and logs "-" for its fields
+REST_ACCESS_LOG_FORMAT = {
+    "requestId": "$context.requestId",
+    "ip": "$context.identity.sourceIp",
+    "requestTime": "$context.requestTime",
+    "httpMethod": "$context.httpMethod",
+    "resourcePath": "$context.resourcePath",
+    "status": "$context.status",
+    "responseLength": "$context.responseLength",
+    "responseLatency": "$context.responseLatency",
+    "integrationLatency": "$context.integrationLatency",
+    "integrationStatus": "$context.integrationStatus",
+    "xrayTraceId": "$context.xrayTraceId",
+}
+HTTP_ACCESS_LOG_FORMAT = {
+    "requestId": "$context.requestId",
+    "ip": "$context.identity.sourceIp",
+    "requestTime": "$context.requestTime",
+    "routeKey": "$context.routeKey",
+    "status": "$context.status",
+    "responseLength": "$context.responseLength",
+    "responseLatency": "$context.responseLatency",
+    "integrationLatency": "$context.integrationLatency",
+    "integrationStatus": "$context.integrationStatus",
+    "integrationError": "$context.integrationErrorMessage",
+}
+
+
+def stage_logging(template, api_type, tracing, access_logs):
+    """
+    :type template Template
+    :type api_type str "rest" (apigateway.Stage) or "http" (apigatewayv2.Stage)
+    :type tracing bool X-Ray tracing of a REST stage
+    :type access_logs bool JSON access logs with latency fields into a log group kept LogRetentionDays
+    :rtype dict APIStage properties for tracing and access logging
+    """
+    options = {}
+    if tracing and api_type == "rest":  # HTTP APIs cannot be traced, only their Lambda
+        options["TracingEnabled"] = True
+    if not access_logs:
+        return options
+
+    param_log_retention = template.add_parameter(Parameter(
+        "LogRetentionDays",
+        Type="Number",
+        AllowedValues=LOG_RETENTION_DAYS,
+        Default="30",
+        Description="Days to keep the API access logs"
+    ))
+
+    log_group = template.add_resource(logs.LogGroup(
+        "APIAccessLogGroup",
+        RetentionInDays=Ref(param_log_retention)
+    ))
+
+    if api_type == "http":
+        options["AccessLogSettings"] = apigatewayv2.AccessLogSettings(
+            DestinationArn=GetAtt(log_group, "Arn"),
+            Format=json.dumps(HTTP_ACCESS_LOG_FORMAT)
+        )
+        return options
+
+    # REST APIs log through a role set once per account and region
+    logging_role = template.add_resource(iam.Role(
+        "APIGatewayLoggingRole",
+        AssumeRolePolicyDocument=aws.Policy(
+            Statement=[
+                aws.Statement(
+                    Effect=aws.Allow,
+                    Action=[sts.AssumeRole],
+                    Principal=aws.Principal(
+                        "Service", ["apigateway.amazonaws.com"]
+                    )
+                )
+            ]
+        ),
+        ManagedPolicyArns=["arn:aws:iam::aws:policy/service-role/AmazonAPIGatewayPushToCloudWatchLogs"]
+    ))
+
+    account = template.add_resource(apigateway.Account(
+        "APIGatewayAccount",
+        CloudWatchRoleArn=GetAtt(logging_role, "Arn")
+    ))
+
+    options["AccessLogSetting"] = apigateway.AccessLogSetting(
+        DestinationArn=GetAtt(log_group, "Arn"),
+        Format=json.dumps(REST_ACCESS_LOG_FORMAT)
+    )
+    options["DependsOn"] = account.title
+    return options
@@ -0,0 +1,60 @@
+"""
+Subnet planning: carves one subnet per tier and availability zone out of a VPC CIDR.
+
+    plan("10.0.0.0/16", 2, {"public": 24, "private": 20})
+    -> public 10.0.32.0/24, 10.0.33.0/24; private 10.0.0.0/20, 10.0.16.0/20
+"""
+import ipaddress
+from collections import namedtuple
+
+TIERS = ("public", "private", "data")
+# smallest subnet AWS allows
+MAX_PREFIX = 28
+
+Subnet = namedtuple("Subnet", ["tier", "zone", "cidr"])
+
+
+def plan(network, zones, sizes):
+    """
+    Allocates the subnets largest first, so every block starts aligned right after
+    the previous one and no address space is lost between them.
+
+    :type network str VPC CIDR, e.g. "172.1.0.0/16"
+    :type zones int number of availability zones
+    :type sizes dict[str, int] subnet prefix length per tier, tiers left out get no subnets
+    :rtype list[Subnet] ordered by tier (TIERS order), then zone
+    """
+    network = ipaddress.ip_network(network)
+    if zones < 1:
+        raise ValueError("at least one availability zone is needed, got {!r}".format(zones))
+    unknown = set(sizes) - set(TIERS)
+    if unknown:
+        raise ValueError("unknown subnet tiers: {}".format(", ".join(sorted(unknown))))
+    for tier, prefix in sizes.items():
+        if not network.prefixlen <= prefix <= MAX_PREFIX:
+            raise ValueError("{} subnets must be between /{} and /{}, got /{}".format(
+                tier, network.prefixlen, MAX_PREFIX, prefix
+            ))
+
+    needed = sum(2 ** (network.max_prefixlen - prefix) for prefix in sizes.values()) * zones
+    if needed > network.num_addresses:
+        raise ValueError("subnets for {} zones need {} addresses, {} has {}".format(
+            zones, needed, network, network.num_addresses
+        ))
+
+    requests = sorted((sizes[tier], TIERS.index(tier), zone) for tier in sizes for zone in range(zones))
+    allocated = {}
+    start = int(network.network_address)
+    for prefix, tier, zone in requests:
+        block = ipaddress.ip_network((start, prefix))
+        allocated[tier, zone] = Subnet(TIERS[tier], zone, str(block))
+        start += block.num_addresses
+    return [allocated[key] for key in sorted(allocated)]
+
+
+def by_tier(subnets, tier):
+    """
+    :type subnets list[Subnet]
+    :rtype list[Subnet] the tier's subnets ordered by zone
+    """
+    return [subnet for subnet in subnets if subnet.tier == tier]
@@ -1,35 +1,46 @@
 from troposphere import Template
 from troposphere.elasticloadbalancing import Listener, LoadBalancer
 
-t = Template()
-
-t.add_description("ELB with Proxy Protocol enabled for ports 80 and 443")
-
-elb = t.add_resource(LoadBalancer(
-    "ElasticLoadBalancer",
-    Listeners=[
-        Listener(
-            LoadBalancerPort="80",
-            InstancePort="80",
-            Protocol="TCP"
-        ),
-        Listener(
-            LoadBalancerPort="443",
-            InstancePort="443",
-            Protocol="TCP"
-        ),
-    ],
-    Policies=[
-        {
-            "PolicyName": "EnableProxyProtocol",
-            "PolicyType": "ProxyProtocolPolicyType",
-            "Attributes": [{
-                "Name": "ProxyProtocol",
-                "Value": "true"
-            }],
-            "InstancePorts": ["80", "443"]
-        }
-    ]
-))
-
-print(t.to_json())
+PORTS = ["80", "443"]
+
+
+def build_template(ports=PORTS):
+    """
+    :type ports list[str|int] ports to forward over TCP with Proxy Protocol enabled
+    :rtype Template
+    """
+    if not ports:
+        raise ValueError("at least one port is needed")
+    ports = list(map(str, ports))
+
+    t = Template()
+
+    t.add_description("ELB with Proxy Protocol enabled for ports {}".format(" and ".join(ports)))
+
+    elb = t.add_resource(LoadBalancer(
+        "ElasticLoadBalancer",
+        Listeners=[
+            Listener(
+                LoadBalancerPort=port,
+                InstancePort=port,
+                Protocol="TCP"
+            ) for port in ports
+        ],
+        Policies=[
+            {
+                "PolicyName": "EnableProxyProtocol",
+                "PolicyType": "ProxyProtocolPolicyType",
+                "Attributes": [{
+                    "Name": "ProxyProtocol",
+                    "Value": "true"
+                }],
+                "InstancePorts": list(ports)
+            }
+        ]
+    ))
+
+    return t
+
+
+if __name__ == "__main__":
+    print(build_template().to_json())
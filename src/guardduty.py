@@ -6,84 +6,97 @@ MASTER_ACCOUNT_ID = "1234"
 MEMBER_ACCOUNT_ID = "5678"
 MEMBER_ACCOUNT_EMAIL = "user@example.com"
 
-t = Template()
 
-t.add_description("GuardDuty example deployment for master and member accounts")
+def build_template(master_account_id=MASTER_ACCOUNT_ID, member_account_id=MEMBER_ACCOUNT_ID,
+                   member_account_email=MEMBER_ACCOUNT_EMAIL):
+    """
+    :type master_account_id str account which invites members and receives their findings
+    :type member_account_id str
+    :type member_account_email str
+    :rtype Template
+    """
+    t = Template()
 
-member_invitation = t.add_parameter(Parameter(
-    "MemberInvitation",
-    Type="String",
-    Description="Invitation ID for member account, leave empty on master account"
-))
+    t.add_description("GuardDuty example deployment for master and member accounts")
 
-t.add_condition("IsMaster", Equals(Ref(AWS_ACCOUNT_ID), MASTER_ACCOUNT_ID))
-t.add_condition("IsMember", Not(Condition("IsMaster")))
+    member_invitation = t.add_parameter(Parameter(
+        "MemberInvitation",
+        Type="String",
+        Description="Invitation ID for member account, leave empty on master account"
+    ))
 
-detector = t.add_resource(guardduty.Detector(
-    "Detector",
-    Enable=True
-))
+    t.add_condition("IsMaster", Equals(Ref(AWS_ACCOUNT_ID), master_account_id))
+    t.add_condition("IsMember", Not(Condition("IsMaster")))
 
-master = t.add_resource(guardduty.Master(
-    "Master",
-    Condition="IsMember",
-    DetectorId=Ref(detector),
-    MasterId=MASTER_ACCOUNT_ID,
-    InvitationId=Ref(member_invitation),
-))
+    detector = t.add_resource(guardduty.Detector(
+        "Detector",
+        Enable=True
+    ))
 
-# You can create multiple members if you have multiple members accounts
-member = t.add_resource(guardduty.Member(
-    "Member",
-    Condition="IsMaster",
-    Status="Invited",
-    MemberId=MEMBER_ACCOUNT_ID,
-    Email=MEMBER_ACCOUNT_EMAIL,
-    DetectorId=Ref(detector)
-))
+    master = t.add_resource(guardduty.Master(
+        "Master",
+        Condition="IsMember",
+        DetectorId=Ref(detector),
+        MasterId=master_account_id,
+        InvitationId=Ref(member_invitation),
+    ))
 
-snstopic = t.add_resource(sns.Topic(
-    "SNSTopic",
-    Condition="IsMaster",
-    Subscription=[
-        # put any subscriptions here
-    ]
-))
+    # You can create multiple members if you have multiple members accounts
+    member = t.add_resource(guardduty.Member(
+        "Member",
+        Condition="IsMaster",
+        Status="Invited",
+        MemberId=member_account_id,
+        Email=member_account_email,
+        DetectorId=Ref(detector)
+    ))
 
-event = t.add_resource(events.Rule(
-    "EventsRule",
-    Condition="IsMaster",
-    EventPattern={
-        "source": [
-            "aws.guardduty"
+    snstopic = t.add_resource(sns.Topic(
+        "SNSTopic",
+        Condition="IsMaster",
+        Subscription=[
+            # put any subscriptions here
         ]
-    },
-    State="ENABLED",
-    Targets=[
-        events.Target(
-            Arn=Ref(snstopic),
-            Id="sns",
-        )
-    ]
-))
+    ))
 
-# Allow events to send notifications to SNS
-t.add_resource(sns.TopicPolicy(
-    "SNSTopicPolicy",
-    Condition="IsMaster",
-    PolicyDocument=aws.Policy(
-        Statement=[
-            aws.Statement(
-                Effect=aws.Allow,
-                Action=[
-                    aws.Action("sns", "Publish"),
-                ],
-                Principal=aws.Principal("Service", "events.amazonaws.com"),
-                Resource=[Ref(snstopic)],
-            ),
+    event = t.add_resource(events.Rule(
+        "EventsRule",
+        Condition="IsMaster",
+        EventPattern={
+            "source": [
+                "aws.guardduty"
+            ]
+        },
+        State="ENABLED",
+        Targets=[
+            events.Target(
+                Arn=Ref(snstopic),
+                Id="sns",
+            )
         ]
-    ),
-    Topics=[Ref(snstopic)]
-))
+    ))
 
-print(t.to_json())
+    # Allow events to send notifications to SNS
+    t.add_resource(sns.TopicPolicy(
+        "SNSTopicPolicy",
+        Condition="IsMaster",
+        PolicyDocument=aws.Policy(
+            Statement=[
+                aws.Statement(
+                    Effect=aws.Allow,
+                    Action=[
+                        aws.Action("sns", "Publish"),
+                    ],
+                    Principal=aws.Principal("Service", "events.amazonaws.com"),
+                    Resource=[Ref(snstopic)],
+                ),
+            ]
+        ),
+        Topics=[Ref(snstopic)]
+    ))
+
+    return t
+
+
+if __name__ == "__main__":
+    print(build_template().to_json())
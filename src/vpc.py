@@ -1,6 +1,9 @@
-from troposphere import GetAZs, Join, Ref, Select, Tags, Template
-from troposphere.ec2 import InternetGateway, NetworkAcl, NetworkAclEntry, Route, RouteTable, Subnet, \
-    SubnetNetworkAclAssociation, SubnetRouteTableAssociation, VPC, VPCGatewayAttachment
+from troposphere import GetAZs, GetAtt, Join, Ref, Select, Tags, Template
+from troposphere.ec2 import EIP, InternetGateway, NatGateway, NetworkAcl, NetworkAclEntry, PortRange, Route, \
+    RouteTable, SecurityGroup, SecurityGroupRule, Subnet, SubnetNetworkAclAssociation, SubnetRouteTableAssociation, \
+    VPC, VPCEndpoint, VPCGatewayAttachment
+
+from common import subnets
 
 VPC_NETWORK = "172.22.0.0/16"
 VPC_PRIVATE_1 = "172.22.1.0/24"
@@ -9,177 +12,274 @@ VPC_PUBLIC_A = "172.22.128.0/24"
 VPC_PUBLIC_1 = "172.22.129.0/24"
 VPC_PUBLIC_2 = "172.22.130.0/24"
 
-t = Template()
-
-t.add_description("Stack creating a basic VPC")
-
-vpc = t.add_resource(VPC(
-    "VPC",
-    CidrBlock=VPC_NETWORK,
-    InstanceTenancy="default",
-    EnableDnsSupport=True,
-    EnableDnsHostnames=False,
-    Tags=Tags(
-        Name=Ref("AWS::StackName")
-    )
-))
-
-# internet gateway
-internetGateway = t.add_resource(InternetGateway(
-    "InternetGateway",
-    Tags=Tags(
-        Name=Join("", [Ref("AWS::StackName"), "-gateway"]),
-    ),
-))
-
-gatewayAttachment = t.add_resource(VPCGatewayAttachment(
-    "InternetGatewayAttachment",
-    InternetGatewayId=Ref(internetGateway),
-    VpcId=Ref(vpc)
-))
-
-# public routing table
-publicRouteTable = t.add_resource(RouteTable(
-    "PublicRouteTable",
-    VpcId=Ref(vpc),
-    Tags=Tags(
-        Name=Join("-", [Ref("AWS::StackName"), "public-rt"]),
-    ),
-))
-
-privateRouteTable1 = t.add_resource(RouteTable(
-    "PrivateRouteTable1",
-    VpcId=Ref(vpc),
-    Tags=Tags(
-        Name=Join("-", [Ref("AWS::StackName"), "private-rt1"]),
-    ),
-))
-
-privateRouteTable2 = t.add_resource(RouteTable(
-    "PrivateRouteTable2",
-    VpcId=Ref(vpc),
-    Tags=Tags(
-        Name=Join("-", [Ref("AWS::StackName"), "private-rt2"]),
-    ),
-))
-
-internetRoute = t.add_resource(Route(
-    "RouteToInternet",
-    DestinationCidrBlock="0.0.0.0/0",
-    GatewayId=Ref(internetGateway),
-    RouteTableId=Ref(publicRouteTable),
-    DependsOn=gatewayAttachment.title
-))
-
-# private subnetworks
-subnetPrivate1 = t.add_resource(Subnet(
-    "StackPrivateSubnet1",
-    AvailabilityZone=Select(0, GetAZs()),
-    CidrBlock=VPC_PRIVATE_1,
-    MapPublicIpOnLaunch=False,
-    Tags=Tags(
-        Name=Join("", [Ref("AWS::StackName"), " private subnet 1"]),
-    ),
-    VpcId=Ref(vpc)
-))
-
-t.add_resource(SubnetRouteTableAssociation(
-    "PrivateSubnet1RouteTable",
-    RouteTableId=Ref(privateRouteTable1),
-    SubnetId=Ref(subnetPrivate1)
-))
-
-subnetPrivate2 = t.add_resource(Subnet(
-    "StackPrivateSubnet2",
-    AvailabilityZone=Select(1, GetAZs()),
-    CidrBlock=VPC_PRIVATE_2,
-    MapPublicIpOnLaunch=False,
-    Tags=Tags(
-        Name=Join("", [Ref("AWS::StackName"), " private subnet 2"]),
-    ),
-    VpcId=Ref(vpc)
-))
-
-t.add_resource(SubnetRouteTableAssociation(
-    "PrivateSubnet2RouteTable",
-    RouteTableId=Ref(privateRouteTable2),
-    SubnetId=Ref(subnetPrivate2)
-))
-
-# public subnetworks
-subnetPublic1 = t.add_resource(Subnet(
-    "StackPublicSubnet1",
-    AvailabilityZone=Select(0, GetAZs()),
-    CidrBlock=VPC_PUBLIC_1,
-    MapPublicIpOnLaunch=True,
-    Tags=Tags(
-        Name=Join("", [Ref("AWS::StackName"), " public subnet 1"]),
-    ),
-    VpcId=Ref(vpc),
-))
-
-t.add_resource(SubnetRouteTableAssociation(
-    "PublicSubnet1RouteTable",
-    RouteTableId=Ref(publicRouteTable),
-    SubnetId=Ref(subnetPublic1)
-))
-
-subnetPublic2 = t.add_resource(Subnet(
-    "StackPublicSubnet2",
-    AvailabilityZone=Select(1, GetAZs()),
-    CidrBlock=VPC_PUBLIC_2,
-    MapPublicIpOnLaunch=True,
-    Tags=Tags(
-        Name=Join("", [Ref("AWS::StackName"), " public subnet 2"]),
-    ),
-    VpcId=Ref(vpc),
-))
-
-t.add_resource(SubnetRouteTableAssociation(
-    "PublicSubnet2RouteTable",
-    RouteTableId=Ref(publicRouteTable),
-    SubnetId=Ref(subnetPublic2)
-))
-
-# network ACL for private subnets
-privateNetworkAcl = t.add_resource(NetworkAcl(
-    "PrivateNetworkAcl",
-    VpcId=Ref(vpc),
-    Tags=Tags(
-        Name=Join("", [Ref("AWS::StackName"), "-private-nacl"]),
-    ),
-))
-
-t.add_resource(SubnetNetworkAclAssociation(
-    "PrivateNetwork1AclAss",
-    SubnetId=Ref(subnetPrivate1),
-    NetworkAclId=Ref(privateNetworkAcl)
-))
-
-t.add_resource(SubnetNetworkAclAssociation(
-    "PrivateNetwork2AclAss",
-    SubnetId=Ref(subnetPrivate2),
-    NetworkAclId=Ref(privateNetworkAcl)
-))
-
-t.add_resource(NetworkAclEntry(
-    "PrivateNetworkAclEntryIngress",
-    CidrBlock=VPC_NETWORK,
-    Egress=False,
-    NetworkAclId=Ref(privateNetworkAcl),
-    Protocol=-1,
-    RuleAction="allow",
-    RuleNumber=200
-))
-
-t.add_resource(NetworkAclEntry(
-    "PrivateNetworkAclEntryEgress",
-    CidrBlock=VPC_NETWORK,
-    Egress=True,
-    NetworkAclId=Ref(privateNetworkAcl),
-    Protocol=-1,
-    RuleAction="allow",
-    RuleNumber=200
-))
-
-print(t.to_json())
+GATEWAY_ENDPOINTS = {
+    "s3": "S3",
+    "dynamodb": "DynamoDB",
+}
+# interface endpoint service name: logical ID part
+INTERFACE_ENDPOINTS = {
+    "logs": "Logs",
+    "ssm": "SSM",
+    "ssmmessages": "SSMMessages",
+    "ec2messages": "EC2Messages",
+    "secretsmanager": "SecretsManager",
+    "ecr.api": "ECRApi",
+    "ecr.dkr": "ECRDocker",
+}
+
+
+def build_template(network=VPC_NETWORK, private_subnets=(VPC_PRIVATE_1, VPC_PRIVATE_2),
+                   public_subnets=(VPC_PUBLIC_1, VPC_PUBLIC_2), nat_gateways=False, endpoints=(), data_subnets=(),
+                   zones=None, subnet_sizes=None):
+    """
+    :type network str VPC CIDR
+    :type private_subnets tuple[str] CIDRs of the private subnets, one per AZ
+    :type public_subnets tuple[str] CIDRs of the public subnets, one per AZ
+    :type data_subnets tuple[str] CIDRs of isolated subnets for databases and caches, one per AZ, none by default
+    :type zones int plan the subnets of this many AZs from network instead of using the CIDRs above
+    :type subnet_sizes dict[str, int] prefix length per tier when planning, see subnets.plan
+    :type nat_gateways bool a NAT gateway in each AZ, the private subnets route to the one in their AZ
+    :type endpoints list[str] VPC endpoints for the private subnets, see GATEWAY_ENDPOINTS and INTERFACE_ENDPOINTS
+    :rtype Template
+    """
+    if zones is not None or subnet_sizes is not None:
+        planned = subnets.plan(network, zones or 2, subnet_sizes or {"public": 24, "private": 24})
+        private_subnets, public_subnets, data_subnets = [
+            [subnet.cidr for subnet in subnets.by_tier(planned, tier)] for tier in ("private", "public", "data")
+        ]
+    if len(private_subnets) != len(public_subnets) or len(private_subnets) < 2:
+        raise ValueError("need a private and a public subnet in each of at least two AZs")
+    if data_subnets and len(data_subnets) != len(private_subnets):
+        raise ValueError("need a data subnet in each AZ, got {} for {} AZs".format(
+            len(data_subnets), len(private_subnets)
+        ))
+
+    unknown = set(endpoints) - set(GATEWAY_ENDPOINTS) - set(INTERFACE_ENDPOINTS)
+    if unknown:
+        raise ValueError("unknown VPC endpoints: {}".format(", ".join(sorted(unknown))))
+    interface_endpoints = sorted(set(endpoints) & set(INTERFACE_ENDPOINTS))
+
+    t = Template()
+
+    t.add_description("Stack creating a basic VPC")
+
+    vpc = t.add_resource(VPC(
+        "VPC",
+        CidrBlock=network,
+        InstanceTenancy="default",
+        EnableDnsSupport=True,
+        EnableDnsHostnames=bool(interface_endpoints),  # needed for their private DNS names
+        Tags=Tags(
+            Name=Ref("AWS::StackName")
+        )
+    ))
+
+    # internet gateway
+    internetGateway = t.add_resource(InternetGateway(
+        "InternetGateway",
+        Tags=Tags(
+            Name=Join("", [Ref("AWS::StackName"), "-gateway"]),
+        ),
+    ))
+
+    gatewayAttachment = t.add_resource(VPCGatewayAttachment(
+        "InternetGatewayAttachment",
+        InternetGatewayId=Ref(internetGateway),
+        VpcId=Ref(vpc)
+    ))
+
+    # public routing table
+    publicRouteTable = t.add_resource(RouteTable(
+        "PublicRouteTable",
+        VpcId=Ref(vpc),
+        Tags=Tags(
+            Name=Join("-", [Ref("AWS::StackName"), "public-rt"]),
+        ),
+    ))
+
+    privateRouteTables = []
+    for number in range(1, len(private_subnets) + 1):
+        privateRouteTables.append(t.add_resource(RouteTable(
+            "PrivateRouteTable{}".format(number),
+            VpcId=Ref(vpc),
+            Tags=Tags(
+                Name=Join("-", [Ref("AWS::StackName"), "private-rt{}".format(number)]),
+            ),
+        )))
+
+    # data subnets never reach the internet, they share one table
+    dataRouteTable = None
+    if data_subnets:
+        dataRouteTable = t.add_resource(RouteTable(
+            "DataRouteTable",
+            VpcId=Ref(vpc),
+            Tags=Tags(
+                Name=Join("-", [Ref("AWS::StackName"), "data-rt"]),
+            ),
+        ))
+
+    internetRoute = t.add_resource(Route(
+        "RouteToInternet",
+        DestinationCidrBlock="0.0.0.0/0",
+        GatewayId=Ref(internetGateway),
+        RouteTableId=Ref(publicRouteTable),
+        DependsOn=gatewayAttachment.title
+    ))
+
+    # subnetworks, one per tier and AZ
+    tierSubnets = {}
+    for tier, cidrs in (("Private", private_subnets), ("Public", public_subnets), ("Data", data_subnets)):
+        tierSubnets[tier] = []
+        for number, cidr in enumerate(cidrs, 1):
+            subnet = t.add_resource(Subnet(
+                "Stack{}Subnet{}".format(tier, number),
+                AvailabilityZone=Select(number - 1, GetAZs()),
+                CidrBlock=cidr,
+                MapPublicIpOnLaunch=tier == "Public",
+                Tags=Tags(
+                    Name=Join("", [Ref("AWS::StackName"), " {} subnet {}".format(tier.lower(), number)]),
+                ),
+                VpcId=Ref(vpc)
+            ))
+            tierSubnets[tier].append(subnet)
+
+            if tier == "Public":
+                routeTable = publicRouteTable
+            elif tier == "Private":
+                routeTable = privateRouteTables[number - 1]
+            else:
+                routeTable = dataRouteTable
+            t.add_resource(SubnetRouteTableAssociation(
+                "{}Subnet{}RouteTable".format(tier, number),
+                RouteTableId=Ref(routeTable),
+                SubnetId=Ref(subnet)
+            ))
+
+    # network ACL for private subnets
+    privateNetworkAcl = t.add_resource(NetworkAcl(
+        "PrivateNetworkAcl",
+        VpcId=Ref(vpc),
+        Tags=Tags(
+            Name=Join("", [Ref("AWS::StackName"), "-private-nacl"]),
+        ),
+    ))
+
+    for tier in ("Private", "Data"):
+        for number, subnet in enumerate(tierSubnets[tier], 1):
+            t.add_resource(SubnetNetworkAclAssociation(
+                "{}Network{}AclAss".format(tier, number),
+                SubnetId=Ref(subnet),
+                NetworkAclId=Ref(privateNetworkAcl)
+            ))
+
+    t.add_resource(NetworkAclEntry(
+        "PrivateNetworkAclEntryIngress",
+        CidrBlock=network,
+        Egress=False,
+        NetworkAclId=Ref(privateNetworkAcl),
+        Protocol=-1,
+        RuleAction="allow",
+        RuleNumber=200
+    ))
+
+    t.add_resource(NetworkAclEntry(
+        "PrivateNetworkAclEntryEgress",
+        CidrBlock=network,
+        Egress=True,
+        NetworkAclId=Ref(privateNetworkAcl),
+        Protocol=-1,
+        RuleAction="allow",
+        RuleNumber=200
+    ))
+
+    if nat_gateways:
+        for number, (subnet, routeTable) in enumerate(zip(tierSubnets["Public"], privateRouteTables), 1):
+            eip = t.add_resource(EIP(
+                "NatGateway{}EIP".format(number),
+                Domain="vpc",
+                DependsOn=gatewayAttachment.title
+            ))
+
+            natGateway = t.add_resource(NatGateway(
+                "NatGateway{}".format(number),
+                AllocationId=GetAtt(eip, "AllocationId"),
+                SubnetId=Ref(subnet),
+                Tags=Tags(
+                    Name=Join("", [Ref("AWS::StackName"), " NAT gateway ", str(number)]),
+                ),
+            ))
+
+            t.add_resource(Route(
+                "PrivateRouteToInternet{}".format(number),
+                DestinationCidrBlock="0.0.0.0/0",
+                NatGatewayId=Ref(natGateway),
+                RouteTableId=Ref(routeTable)
+            ))
+
+    if nat_gateways or set(endpoints) & set(GATEWAY_ENDPOINTS):
+        # NAT gateway and gateway endpoint traffic has public destinations, let connections
+        # out and their responses through the private network ACL
+        t.add_resource(NetworkAclEntry(
+            "PrivateNetworkAclEntryPublicIngress",
+            CidrBlock="0.0.0.0/0",
+            Egress=False,
+            NetworkAclId=Ref(privateNetworkAcl),
+            Protocol=6,
+            PortRange=PortRange(From=1024, To=65535),
+            RuleAction="allow",
+            RuleNumber=300
+        ))
+
+        t.add_resource(NetworkAclEntry(
+            "PrivateNetworkAclEntryPublicEgress",
+            CidrBlock="0.0.0.0/0",
+            Egress=True,
+            NetworkAclId=Ref(privateNetworkAcl),
+            Protocol=-1,
+            RuleAction="allow",
+            RuleNumber=300
+        ))
+
+    # VPC endpoints
+    for name in sorted(set(endpoints) & set(GATEWAY_ENDPOINTS)):
+        t.add_resource(VPCEndpoint(
+            "VPC{}Endpoint".format(GATEWAY_ENDPOINTS[name]),
+            ServiceName=Join("", ["com.amazonaws.", Ref("AWS::Region"), "." + name]),
+            VpcId=Ref(vpc),
+            RouteTableIds=[Ref(routeTable) for routeTable in privateRouteTables + [dataRouteTable] if routeTable]
+        ))
+
+    if interface_endpoints:
+        endpointSecurityGroup = t.add_resource(SecurityGroup(
+            "VPCEndpointSecurityGroup",
+            GroupDescription="Interface VPC endpoint security group",
+            SecurityGroupIngress=[
+                SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort=443,
+                    ToPort=443,
+                    CidrIp=network,
+                ),
+            ],
+            VpcId=Ref(vpc),
+            Tags=Tags(
+                Name=Join("", [Ref("AWS::StackName"), " VPC endpoint security group"]),
+            ),
+        ))
+
+    for name in interface_endpoints:
+        t.add_resource(VPCEndpoint(
+            "VPC{}Endpoint".format(INTERFACE_ENDPOINTS[name]),
+            ServiceName=Join("", ["com.amazonaws.", Ref("AWS::Region"), "." + name]),
+            VpcId=Ref(vpc),
+            VpcEndpointType="Interface",
+            PrivateDnsEnabled=True,
+            SubnetIds=[Ref(subnet) for subnet in tierSubnets["Private"]],
+            SecurityGroupIds=[Ref(endpointSecurityGroup)]
+        ))
+
+    return t
+
+
+if __name__ == "__main__":
+    print(build_template().to_json())
@@ -1,77 +1,366 @@
-from troposphere import GetAtt, Output, Template
+from troposphere import GetAtt, Join, Output, Parameter, Ref, Template
+from troposphere import cloudfront, ec2
 
+from common.subnets import plan
 from database import Database
 from ec2 import EC2
 from loadbalancer import LoadBalancer
 from mappings import Mappings
+from monitoring import Monitoring
 from parameters import Parameters
-from vpc import VPC
+from redis import Redis
+from registry import Registry
+from vpc import NETWORK, SUBNETS, VPC
 
 
-def main():
-    template = Template()
-    template.add_description("Example Server")
+def _interface(registry):
+    """
+    :type registry Registry
+    """
+    groups = [
+        {
+            "Label": {
+                "default": "Required parameters."
+            },
+            "Parameters": [
+                "DBPassword",
+                "KeyPair",
+            ]
+        },
+        {
+            "Label": {
+                "default": "Advanced: Database and instance"
+            },
+            "Parameters": ["DBInstanceType", "DBEngineVersion", "DBStorageSize", "DBBackupRetention",
+                           "DBProxyMaxConnections", "DBMaxReaders", "DBReaderScalingTarget", "CacheNodeType",
+                           "EC2InstanceType"]
+        },
+        {
+            "Label": {
+                "default": "Advanced: Database storage"
+            },
+            "Parameters": ["DBStorageType", "DBStorageIops", "DBStorageThroughput", "DBMaxStorageSize"]
+        },
+        {
+            "Label": {
+                "default": "Advanced: Scaling"
+            },
+            "Parameters": ["ScalingCPUTarget", "ScalingRequestTarget", "ScalingWarmup", "LifecycleHookTimeout"]
+        },
+        {
+            "Label": {
+                "default": "Advanced: Spot instances"
+            },
+            "Parameters": ["OnDemandBaseCapacity", "OnDemandPercentageAboveBaseCapacity", "SpotAllocationStrategy"]
+        },
+        {
+            "Label": {
+                "default": "Load balancer"
+            },
+            "Parameters": ["LoadBalancerCertificateArn", "DeregistrationDelay", "SlowStart", "IdleTimeout",
+                           "CloudFrontPrefixListId"]
+        },
+        {
+            "Label": {
+                "default": "Alarm thresholds"
+            },
+            "Parameters": ["AlarmLatencyP90", "AlarmLatencyP99", "AlarmServerErrors", "AlarmSurgeQueueLength",
+                           "AlarmRejectedConnections", "AlarmDBLatencyP90", "AlarmDBLatencyP99", "AlarmDBConnections",
+                           "AlarmMinInService", "AlarmNATPortAllocationErrors"]
+        },
+    ]
+    labels = {
+        "DBPassword": {"default": "Choose a database password"},
+        "DBStorageSize": {"default": "Database storage (advanced)"},
+        "DBBackupRetention": {"default": "How long to keep backups (advanced)"},
+        "DBInstanceType": {"default": "Database instance class (advanced)"},
+        "DBProxyMaxConnections": {"default": "Database proxy connection limit in percent (advanced)"},
+        "DBEngineVersion": {"default": "MySQL version (advanced)"},
+        "DBMaxReaders": {"default": "Maximum database readers (advanced)"},
+        "DBReaderScalingTarget": {"default": "Database reader scaling target (advanced)"},
+        "DBStorageType": {"default": "Database storage type (advanced)"},
+        "DBStorageIops": {"default": "Provisioned IOPS (advanced)"},
+        "DBStorageThroughput": {"default": "Provisioned throughput MiB/s (advanced)"},
+        "DBMaxStorageSize": {"default": "Storage autoscaling limit (advanced)"},
 
-    for key, value in Mappings().mappings.iteritems():
-        template.add_mapping(key, value)
+        "CacheNodeType": {"default": "Cache node type (advanced)"},
+
+        "KeyPair": {"default": "Choose a key pair"},
+        "EC2InstanceType": {"default": "Instance class (advanced)"},
 
-    parameters = Parameters()
-    for param in parameters.values():
-        template.add_parameter(param)
+        "ScalingCPUTarget": {"default": "Target CPU utilization (advanced)"},
+        "ScalingRequestTarget": {"default": "Target requests per instance (advanced)"},
+        "ScalingWarmup": {"default": "Instance warm-up seconds (advanced)"},
+        "LifecycleHookTimeout": {"default": "Instance initialization timeout seconds (advanced)"},
 
-    template.add_metadata({
+        "OnDemandBaseCapacity": {"default": "On-demand base capacity (advanced)"},
+        "OnDemandPercentageAboveBaseCapacity": {"default": "On-demand percentage above base (advanced)"},
+        "SpotAllocationStrategy": {"default": "Spot allocation strategy (advanced)"},
+
+        "LoadBalancerCertificateArn": {"default": "HTTPS certificate ARN"},
+        "DeregistrationDelay": {"default": "Deregistration delay seconds (advanced)"},
+        "SlowStart": {"default": "Slow start seconds (advanced)"},
+        "IdleTimeout": {"default": "Idle connection timeout seconds (advanced)"},
+        "CloudFrontPrefixListId": {"default": "CloudFront origin-facing prefix list ID"},
+
+        "AlarmLatencyP90": {"default": "p90 latency seconds"},
+        "AlarmLatencyP99": {"default": "p99 latency seconds"},
+        "AlarmServerErrors": {"default": "5XX responses per minute"},
+        "AlarmSurgeQueueLength": {"default": "Queued requests"},
+        "AlarmRejectedConnections": {"default": "Rejected connections per minute"},
+        "AlarmDBLatencyP90": {"default": "Database p90 latency seconds"},
+        "AlarmDBLatencyP99": {"default": "Database p99 latency seconds"},
+        "AlarmDBConnections": {"default": "Database connections"},
+        "AlarmMinInService": {"default": "Minimum instances in service"},
+        "AlarmNATPortAllocationErrors": {"default": "NAT port allocation errors per minute"},
+    }
+
+    # leave out parameters that were replaced by literal values
+    for group in groups:
+        group["Parameters"] = [name for name in group["Parameters"] if name in registry]
+    return {
         "AWS::CloudFormation::Interface": {
-            "ParameterGroups": [
-                {
-                    "Label": {
-                        "default": "Required parameters."
-                    },
-                    "Parameters": [
-                        "DBPassword",
-                        "KeyPair",
-                    ]
-                },
-                {
-                    "Label": {
-                        "default": "Advanced: Database and instance"
-                    },
-                    "Parameters": ["DBInstanceType", "DBStorageSize", "DBBackupRetention", "EC2InstanceType"]
-                },
-            ],
-            "ParameterLabels": {
-                "DBPassword": {"default": "Choose a database password"},
-                "DBStorageSize": {"default": "Database storage (advanced)"},
-                "DBBackupRetention": {"default": "How long to keep backups (advanced)"},
-                "DBInstanceType": {"default": "Database instance class (advanced)"},
-
-                "KeyPair": {"default": "Choose a key pair"},
-                "EC2InstanceType": {"default": "Instance class (advanced)"},
-            }
+            "ParameterGroups": [group for group in groups if group["Parameters"]],
+            "ParameterLabels": dict((name, label) for name, label in labels.items() if name in registry),
         }
-    })
+    }
+
 
-    vpc = VPC()
-    for res in vpc.values():
-        template.add_resource(res)
+# AWS managed policies for the default (dynamic) behaviour: pass everything through uncached
+CACHING_DISABLED_POLICY_ID = "4135ea2d-6df8-44a3-9df3-4b5a84be39ad"
+ALL_VIEWER_ORIGIN_REQUEST_POLICY_ID = "216adef6-5c7f-47e4-b989-5492eafa07d3"
+CDN_DEFAULTS = {
+    "behaviors": [],
+    "compress": True,
+    "keepalive_timeout": 5,
+    "read_timeout": 30,
+    "origin_shield_region": None,
+    "origin_domain": None,
+    "restrict_origin": False,
+}
 
-    elb = LoadBalancer(vpc=vpc)
-    for res in elb.values():
-        template.add_resource(res)
 
-    db = Database(parameters=parameters, vpc=vpc, loadbalancer=elb)
-    for res in db.values():
-        template.add_resource(res)
+def _distribution(registry, elb, options):
+    """
+    CloudFront distribution with the load balancer as origin. Requests are passed
+    through uncached unless they match one of the cache behaviours, e.g.
+    {"path": "/static/*", "ttl": 86400, "query_strings": false}.
+
+    :type registry Registry
+    :type elb LoadBalancer
+    :type options dict overrides of CDN_DEFAULTS
+    """
+    unknown = set(options) - set(CDN_DEFAULTS)
+    if unknown:
+        raise ValueError("unknown cdn options: {}".format(", ".join(sorted(unknown))))
+    options = dict(CDN_DEFAULTS, **options)
+    for name in ("keepalive_timeout", "read_timeout"):
+        if not 1 <= options[name] <= 60:
+            raise ValueError("{} must be between 1 and 60 seconds, got {!r}".format(name, options[name]))
+
+    # the classic and network load balancers only listen for HTTP, the application one redirects it to HTTPS
+    https = elb.kind == "application"
+    if https and not options["origin_domain"]:
+        # the certificate does not cover the load balancer's own DNS name, CloudFront would answer 502
+        raise ValueError("an application load balancer origin needs origin_domain, a name its certificate covers")
+    origin = cloudfront.Origin(
+        Id="LoadBalancer",
+        DomainName=options["origin_domain"] or GetAtt(elb.load_balancer, "DNSName"),
+        CustomOriginConfig=cloudfront.CustomOriginConfig(
+            OriginProtocolPolicy="https-only" if https else "http-only",
+            OriginKeepaliveTimeout=options["keepalive_timeout"],
+            OriginReadTimeout=options["read_timeout"],
+        ),
+    )
+    if options["origin_shield_region"]:
+        origin.OriginShield = cloudfront.OriginShield(
+            Enabled=True,
+            OriginShieldRegion=options["origin_shield_region"],
+        )
+
+    behaviors = []
+    for number, behavior in enumerate(options["behaviors"], 1):
+        ttl = behavior.get("ttl", 86400)
+        policy = registry.add(cloudfront.CachePolicy(
+            "CloudFrontCachePolicy{}".format(number),
+            CachePolicyConfig=cloudfront.CachePolicyConfig(
+                Name=Join("-", [Ref("AWS::StackName"), "cache", str(number)]),
+                Comment=behavior["path"],
+                MinTTL=0,
+                DefaultTTL=ttl,
+                MaxTTL=max(ttl, 31536000),
+                ParametersInCacheKeyAndForwardedToOrigin=cloudfront.ParametersInCacheKeyAndForwardedToOrigin(
+                    CookiesConfig=cloudfront.CacheCookiesConfig(CookieBehavior="none"),
+                    HeadersConfig=cloudfront.CacheHeadersConfig(HeaderBehavior="none"),
+                    QueryStringsConfig=cloudfront.CacheQueryStringsConfig(
+                        QueryStringBehavior="all" if behavior.get("query_strings", False) else "none"
+                    ),
+                    EnableAcceptEncodingGzip=options["compress"],
+                    EnableAcceptEncodingBrotli=options["compress"],
+                ),
+            ),
+        ))
+        behaviors.append(cloudfront.CacheBehavior(
+            PathPattern=behavior["path"],
+            TargetOriginId=origin.Id,
+            ViewerProtocolPolicy="redirect-to-https",
+            AllowedMethods=["GET", "HEAD", "OPTIONS"],
+            CachedMethods=["GET", "HEAD"],
+            CachePolicyId=Ref(policy),
+            Compress=options["compress"],
+        ))
+
+    distribution = registry.add(cloudfront.Distribution(
+        "CloudFront",
+        DistributionConfig=cloudfront.DistributionConfig(
+            Comment=Ref("AWS::StackName"),
+            Enabled=True,
+            HttpVersion="http2",
+            Origins=[origin],
+            DefaultCacheBehavior=cloudfront.DefaultCacheBehavior(
+                TargetOriginId=origin.Id,
+                ViewerProtocolPolicy="redirect-to-https",
+                AllowedMethods=["GET", "HEAD", "OPTIONS", "PUT", "PATCH", "POST", "DELETE"],
+                CachePolicyId=CACHING_DISABLED_POLICY_ID,
+                OriginRequestPolicyId=ALL_VIEWER_ORIGIN_REQUEST_POLICY_ID,
+                Compress=options["compress"],
+            ),
+            CacheBehaviors=behaviors,
+        ),
+    ))
+
+    if options["restrict_origin"]:
+        prefix_list = registry.add(Parameter(
+            "CloudFrontPrefixListId",
+            Type="String",
+            AllowedPattern="^pl-[0-9a-f]+$",
+            Description="ID of the com.amazonaws.global.cloudfront.origin-facing managed prefix list in this region."
+        ))
+        # the prefix list counts as ~55 rules against the security group quota, so only the origin port is opened
+        port = 443 if https else 80
+        elb.load_balancer_security_group.SecurityGroupIngress = [
+            ec2.SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort=port,
+                ToPort=port,
+                SourcePrefixListId=Ref(prefix_list),
+            ),
+        ]
+
+    registry.add(Output(
+        "CloudFrontDomainName",
+        Value=GetAtt(distribution, "DomainName")
+    ))
+
 
-    ec2 = EC2(parameters=parameters, vpc=vpc, loadbalancer=elb)
-    for res in ec2.values():
-        template.add_resource(res)
+def _bake(registry, parameter, value):
+    """
+    Drops a parameter whose value is known when the template is built.
 
-    template.add_output(Output(
+    :type registry Registry
+    :type parameter troposphere.Parameter
+    """
+    allowed = parameter.properties.get("AllowedValues")
+    if allowed and value not in allowed:
+        raise ValueError("{} must be one of {}, got {!r}".format(parameter.title, ", ".join(allowed), value))
+    registry.remove(parameter.title)
+
+
+def build_template(region=None, ec2_instance_type=None, db_instance_type=None, scaling=("step",),
+                   detailed_alarms=False, load_balancer="classic", launch_template=False, instance_types=None,
+                   capacity_rebalance=True, warm_pool=None, lifecycle_hook=False, read_replicas=0, db_proxy=False,
+                   performance_insights=False, db_monitoring_interval=0, database="instance", reader_scaling=None,
+                   redis=None, cdn=None, nat_gateways=False, vpc_endpoints=(), network=None, zones=None,
+                   subnet_sizes=None, monitoring=False):
+    """
+    Options set here are rendered as literal values instead of FindInMap/Ref,
+    producing a smaller template specialized for one region and environment.
+
+    :type region str AWS region the stack is created in, resolves the AMI from Mappings.AMIMap
+    :type ec2_instance_type str replaces the EC2InstanceType parameter
+    :type db_instance_type str replaces the DBInstanceType parameter
+    :type scaling list[str] auto scaling policies, see EC2
+    :type detailed_alarms bool 1-minute step scaling alarms
+    :type load_balancer str "classic", "application" or "network", see LoadBalancer
+    :type launch_template bool use a LaunchTemplate instead of a LaunchConfiguration
+    :type instance_types list[str] instance types for a spot/on-demand mixed instances policy
+    :type capacity_rebalance bool proactively replace spot instances about to be interrupted
+    :type warm_pool dict pre-initialized instances to scale out from, see EC2
+    :type lifecycle_hook bool launch lifecycle hook, see EC2
+    :type read_replicas int number of database read replicas
+    :type db_proxy bool RDS Proxy in front of the database writer
+    :type performance_insights bool enable database Performance Insights
+    :type db_monitoring_interval int database Enhanced Monitoring interval in seconds, 0 disables it
+    :type database str "instance" or "aurora", see Database
+    :type reader_scaling str "cpu" or "connections" to auto scale Aurora readers on
+    :type redis dict Redis options (node_type, shards, replicas, transit_encryption), None for no Redis cache
+    :type cdn dict CloudFront distribution options, see CDN_DEFAULTS, None for no distribution;
+        origin_domain is the load balancer's name on its certificate, required with load_balancer="application"
+    :type nat_gateways bool a NAT gateway per AZ for the private subnets
+    :type vpc_endpoints list[str] VPC endpoints for the private subnets, see VPC
+    :type network str VPC CIDR, subnets are planned from it instead of the fixed two AZ layout
+    :type zones int number of availability zones to plan subnets for, 2 by default
+    :type subnet_sizes dict[str, int] prefix length per tier (public, private, data), see subnets.plan
+    :type monitoring bool CloudWatch dashboard and latency/saturation alarms, see Monitoring
+    :rtype Template
+    """
+    template = Template()
+    template.add_description("Example Server")
+
+    mappings = Mappings(database=database).mappings
+    image_id = None
+    if region is not None:
+        if region not in mappings["AMIMap"]:
+            raise ValueError("no AMI for region {!r} in AMIMap".format(region))
+        image_id = mappings.pop("AMIMap")[region]["AMI"]
+    if db_instance_type is not None:
+        mappings.pop("DBParameterMap")
+
+    for key, value in mappings.items():
+        template.add_mapping(key, value)
+
+    registry = Registry()
+    parameters = Parameters(registry=registry, database=database)
+
+    subnets = SUBNETS
+    if network is not None or zones is not None or subnet_sizes is not None:
+        subnets = plan(network or NETWORK, zones or 2, subnet_sizes or {"public": 24, "private": 24})
+
+    vpc = VPC(registry=registry, nat_gateways=nat_gateways, endpoints=vpc_endpoints,
+              network=network or NETWORK, subnets=subnets)
+    elb = LoadBalancer(vpc=vpc, registry=registry, kind=load_balancer)
+    Database(parameters=parameters, vpc=vpc, loadbalancer=elb, registry=registry,
+             instance_type=db_instance_type, read_replicas=read_replicas, proxy=db_proxy,
+             performance_insights=performance_insights, monitoring_interval=db_monitoring_interval,
+             kind=database, reader_scaling=reader_scaling)
+    if redis is not None:
+        Redis(vpc=vpc, loadbalancer=elb, registry=registry, **redis)
+    if cdn is not None:
+        _distribution(registry, elb, cdn)
+    EC2(parameters=parameters, vpc=vpc, loadbalancer=elb, registry=registry,
+        image_id=image_id, instance_type=ec2_instance_type, scaling=scaling, detailed_alarms=detailed_alarms,
+        launch_template=launch_template, instance_types=instance_types, capacity_rebalance=capacity_rebalance,
+        warm_pool=warm_pool, lifecycle_hook=lifecycle_hook)
+    if monitoring:
+        Monitoring(registry=registry)
+
+    if db_instance_type is not None:
+        _bake(registry, parameters.db_instance_type, db_instance_type)
+    if ec2_instance_type is not None:
+        _bake(registry, parameters.ec2_instance_type, ec2_instance_type)
+
+    template.add_metadata(_interface(registry))
+
+    registry.add(Output(
         "LoadBalancerDNSName",
         Value=GetAtt(elb.load_balancer, "DNSName")
     ))
 
-    print(template.to_json())
+    return registry.add_to_template(template)
+
+
+def main():
+    print(build_template().to_json())
 
 
 if __name__ == "__main__":
@@ -1,20 +1,97 @@
-from troposphere import Join, Ref, Tags
-from troposphere import ec2, rds
+from awacs import aws, sts
+from troposphere import Equals, FindInMap, GetAtt, If, Join, Not, NoValue, Output, Parameter, Ref, Tags
+from troposphere import applicationautoscaling, ec2, iam, rds, secretsmanager
+from troposphere.validators import integer
 
 from loadbalancer import LoadBalancer
-from magicdict import MagicDict
-from parameters import Parameters
+from registry import Component
+from parameters import INSTANCE_TYPES, Parameters
 from vpc import VPC
 
+KINDS = ("instance", "aurora")
+MONITORING_INTERVALS = (0, 1, 5, 10, 15, 30, 60)
+READER_SCALING_METRICS = {
+    "cpu": "RDSReaderAverageCPUUtilization",
+    "connections": "RDSReaderAverageDatabaseConnections",
+}
+# Aurora MySQL release for each MySQL major version
+AURORA_ENGINE_VERSIONS = {
+    "5.7": "5.7.mysql_aurora.2.11.2",
+    "8.0": "8.0.mysql_aurora.3.04.0",
+}
 
-class Database(MagicDict):
-    def __init__(self, parameters, vpc, loadbalancer):
+if "StorageThroughput" in rds.DBInstance.props:
+    DBInstance = rds.DBInstance
+else:
+    class DBInstance(rds.DBInstance):  # troposphere 2.x predates gp3 storage throughput
+        props = dict(rds.DBInstance.props, StorageThroughput=(integer, False))
+
+
+def db_parameters(instance_class):
+    """
+    MySQL settings sized for the memory of a DB instance class.
+
+    :type instance_class str e.g. "db.m4.large"
+    :rtype dict[str, str]
+    """
+    memory = INSTANCE_TYPES["db_memory_gib"][instance_class] * 1024 ** 3
+    # small classes need the rest of their memory for connections and the OS
+    buffer_pool = memory * 3 // 4 if memory >= 4 * 1024 ** 3 else memory // 2
+    return {
+        "innodb_buffer_pool_size": str(buffer_pool),
+        "innodb_buffer_pool_instances": str(max(1, min(64, buffer_pool // 1024 ** 3))),
+        # about 4 MiB of session buffers per connection
+        "max_connections": str(min(16000, (memory - buffer_pool) // (4 * 1024 ** 2))),
+    }
+
+
+def _map_key(name):
+    return name.replace("_", "")
+
+
+def db_parameter_map(instance_classes):
+    """
+    db_parameters() of the DB instance classes, for looking them up by the DBInstanceType parameter.
+
+    :type instance_classes list[str]
+    """
+    return dict(
+        (instance_class, dict((_map_key(name), value) for name, value in db_parameters(instance_class).items()))
+        for instance_class in instance_classes
+    )
+
+
+class Database(Component):
+    def __init__(self, parameters, vpc, loadbalancer, registry=None, instance_type=None, read_replicas=0, proxy=False,
+                 performance_insights=False, monitoring_interval=0, kind="instance", reader_scaling=None):
         """
         :type parameters Parameters
         :type vpc VPC
         :type loadbalancer LoadBalancer
+        :type instance_type str instance class to use instead of the DBInstanceType parameter
+        :type read_replicas int read replicas (Aurora: reader instances) of the writer, spread over the private subnets
+        :type proxy bool put an RDS Proxy in front of the writer to pool application connections
+        :type performance_insights bool enable Performance Insights (7 days retention)
+        :type monitoring_interval int Enhanced Monitoring interval in seconds, 0 disables it
+        :type kind str "instance" Multi-AZ MySQL DB instance, "aurora" Aurora MySQL cluster
+        :type reader_scaling str Aurora only, "cpu" or "connections" metric to auto scale reader instances on
         """
-        super(Database, self).__init__()
+        super(Database, self).__init__(registry)
+
+        if kind not in KINDS:
+            raise ValueError("unknown database kind {!r}, expected one of {}".format(kind, ", ".join(KINDS)))
+        if reader_scaling is not None and (kind != "aurora" or reader_scaling not in READER_SCALING_METRICS):
+            raise ValueError("reader_scaling must be one of {} with an aurora database, got {!r}".format(
+                ", ".join(sorted(READER_SCALING_METRICS)), reader_scaling
+            ))
+        self.kind = kind
+
+        if read_replicas < 0:
+            raise ValueError("read_replicas must not be negative, got {!r}".format(read_replicas))
+        if monitoring_interval not in MONITORING_INTERVALS:
+            raise ValueError("monitoring_interval must be one of {}, got {!r}".format(
+                ", ".join(str(interval) for interval in MONITORING_INTERVALS), monitoring_interval
+            ))
 
         self.db_security_group = ec2.SecurityGroup(
             "DBSecurityGroup",
@@ -43,31 +120,355 @@ class Database(MagicDict):
         self.db_subnet_group = rds.DBSubnetGroup(
             "DBSubnetGroup",
             DBSubnetGroupDescription="DB Subnet group",
-            SubnetIds=[
-                Ref(vpc.private_subnet_1),
-                Ref(vpc.private_subnet_2),
-            ],
+            SubnetIds=[Ref(subnet) for subnet in vpc.data_subnets],
             Tags=Tags(
                 Name=Join("", [Ref("AWS::StackName"), " database subnet group"]),
             )
         )
 
-        self.database = rds.DBInstance(
-            "Database",
+        # Aurora sizes its buffer pool itself
+        names = ["max_connections"] if kind == "aurora" else sorted(db_parameters(INSTANCE_TYPES["db"][0]))
+        self.db_parameter_group = rds.DBParameterGroup(
+            "DBParameterGroup",
+            Description=Join("", [Ref("AWS::StackName"), " MySQL settings"]),
+            Family=Join("", ["aurora-mysql" if kind == "aurora" else "mysql", Ref(parameters.db_engine_version)]),
+            Parameters=dict(
+                (name, db_parameters(instance_type)[name] if instance_type else
+                 FindInMap("DBParameterMap", Ref(parameters.db_instance_type), _map_key(name)))
+                for name in names
+            ),
+            Tags=Tags(
+                Name=Join("", [Ref("AWS::StackName"), " database parameter group"]),
+            ),
+        )
+
+        monitoring = {}
+        if performance_insights:
+            monitoring.update(EnablePerformanceInsights=True, PerformanceInsightsRetentionPeriod=7)
+        if monitoring_interval:
+            self.db_monitoring_role = iam.Role(
+                "DBMonitoringRole",
+                AssumeRolePolicyDocument=aws.Policy(
+                    Statement=[
+                        aws.Statement(
+                            Effect=aws.Allow,
+                            Action=[sts.AssumeRole],
+                            Principal=aws.Principal(
+                                "Service", ["monitoring.rds.amazonaws.com"]
+                            )
+                        )
+                    ]
+                ),
+                Path="/",
+                ManagedPolicyArns=["arn:aws:iam::aws:policy/service-role/AmazonRDSEnhancedMonitoringRole"],
+            )
+            monitoring.update(
+                MonitoringInterval=monitoring_interval,
+                MonitoringRoleArn=GetAtt(self.db_monitoring_role, "Arn"),
+            )
+
+        if kind == "aurora":
+            self._aurora_cluster(parameters, vpc, instance_type, read_replicas, reader_scaling, monitoring)
+        else:
+            iops = self.registry.add_condition(
+                "DBStorageIopsSet", Not(Equals(Ref(parameters.db_storage_iops), "0"))
+            )
+            # the condition would leave out Iops, which io1 can not do without
+            self.registry.add_rule("DBStorageIopsForIo1", {
+                "RuleCondition": Equals(Ref(parameters.db_storage_type), "io1"),
+                "Assertions": [{
+                    "Assert": Not(Equals(Ref(parameters.db_storage_iops), "0")),
+                    "AssertDescription": "io1 storage needs DBStorageIops",
+                }],
+            })
+            throughput = self.registry.add_condition(
+                "DBStorageThroughputSet", Not(Equals(Ref(parameters.db_storage_throughput), "0"))
+            )
+            autoscaling = self.registry.add_condition(
+                "DBStorageAutoscaling", Not(Equals(Ref(parameters.db_max_storage_size), "0"))
+            )
+            storage = dict(
+                StorageType=Ref(parameters.db_storage_type),
+                Iops=If(iops, Ref(parameters.db_storage_iops), NoValue),
+                StorageThroughput=If(throughput, Ref(parameters.db_storage_throughput), NoValue),
+            )
+
+            self.database = DBInstance(
+                "Database",
+                BackupRetentionPeriod=Ref(parameters.db_backup_retention),
+                AllocatedStorage=Ref(parameters.db_storage_size),
+                MaxAllocatedStorage=If(autoscaling, Ref(parameters.db_max_storage_size), NoValue),
+                DBInstanceClass=instance_type or Ref(parameters.db_instance_type),
+                DBInstanceIdentifier=Ref("AWS::StackName"),
+                DBParameterGroupName=Ref(self.db_parameter_group),
+                Engine="MySQL",
+                EngineVersion=Ref(parameters.db_engine_version),
+                AllowMajorVersionUpgrade=True,
+                MasterUsername="root",
+                MasterUserPassword=Ref(parameters.db_password),
+                DeletionPolicy="Snapshot",
+                DBSubnetGroupName=Ref(self.db_subnet_group),
+                MultiAZ=True,
+                VPCSecurityGroups=[Ref(self.db_security_group)],
+                Tags=Tags(
+                    Name=Ref("AWS::StackName")
+                ),
+                **dict(storage, **monitoring)
+            )
+
+            self.replicas = []
+            for number in range(1, read_replicas + 1):
+                replica = DBInstance(
+                    "DatabaseReplica{}".format(number),
+                    SourceDBInstanceIdentifier=Ref(self.database),
+                    Engine="MySQL",
+                    DBInstanceClass=instance_type or Ref(parameters.db_instance_type),
+                    DBInstanceIdentifier=Join("-", [Ref("AWS::StackName"), "replica", str(number)]),
+                    AvailabilityZone=GetAtt(vpc.data_subnets[(number - 1) % len(vpc.data_subnets)], "AvailabilityZone"),
+                    DBParameterGroupName=Ref(self.db_parameter_group),
+                    DeletionPolicy="Delete",  # replicas can not be snapshotted, the writer is
+                    VPCSecurityGroups=[Ref(self.db_security_group)],
+                    Tags=Tags(
+                        Name=Join("", [Ref("AWS::StackName"), " replica ", str(number)]),
+                    ),
+                    **dict(storage, **monitoring)
+                )
+                setattr(self, "replica_{}".format(number), replica)
+                self.replicas.append(replica)
+
+        if proxy:
+            self._proxy(parameters, vpc, loadbalancer)
+
+        writer = self.cluster if kind == "aurora" else self.database
+        self.writer_endpoint = Output(
+            "DatabaseWriterEndpoint",
+            Description="Database endpoint for reads and writes",
+            Value=GetAtt(writer, "Endpoint.Address")
+        )
+
+        if self.replicas or reader_scaling:
+            self.reader_endpoint = Output(
+                "DatabaseReaderEndpoint",
+                Description="Database endpoints for reads, comma separated",
+                Value=GetAtt(self.cluster, "ReadEndpoint.Address") if kind == "aurora" else
+                Join(",", [GetAtt(replica, "Endpoint.Address") for replica in self.replicas])
+            )
+
+        if proxy:
+            self.proxy_endpoint = Output(
+                "DatabaseProxyEndpoint",
+                Description="RDS Proxy endpoint pooling connections to the writer",
+                Value=GetAtt(self.db_proxy, "Endpoint")
+            )
+
+    def _aurora_cluster(self, parameters, vpc, instance_type, readers, reader_scaling, monitoring):
+        """
+        Aurora MySQL cluster with its writer as self.database and reader instances as self.replicas.
+
+        :type readers int
+        :type reader_scaling str
+        :type monitoring dict Performance Insights/Enhanced Monitoring properties of the instances
+        """
+        version = self.registry.add_condition("DBEngineVersion57", Equals(Ref(parameters.db_engine_version), "5.7"))
+        self.cluster = rds.DBCluster(
+            "DatabaseCluster",
             BackupRetentionPeriod=Ref(parameters.db_backup_retention),
-            AllocatedStorage=Ref(parameters.db_storage_size),
-            DBInstanceClass=Ref(parameters.db_instance_type),
-            DBInstanceIdentifier=Ref("AWS::StackName"),
-            Engine="MySQL",
-            EngineVersion="5.6",
+            DBClusterIdentifier=Ref("AWS::StackName"),
+            Engine="aurora-mysql",
+            EngineVersion=If(version, AURORA_ENGINE_VERSIONS["5.7"], AURORA_ENGINE_VERSIONS["8.0"]),
             MasterUsername="root",
             MasterUserPassword=Ref(parameters.db_password),
-            StorageType="gp2",
             DeletionPolicy="Snapshot",
             DBSubnetGroupName=Ref(self.db_subnet_group),
-            MultiAZ=True,
-            VPCSecurityGroups=[Ref(self.db_security_group)],
+            VpcSecurityGroupIds=[Ref(self.db_security_group)],
             Tags=Tags(
                 Name=Ref("AWS::StackName")
             ),
         )
+
+        self.replicas = []
+        for number in range(readers + 1):
+            instance = DBInstance(
+                "DatabaseReader{}".format(number) if number else "Database",
+                DBClusterIdentifier=Ref(self.cluster),
+                Engine="aurora-mysql",
+                DBInstanceClass=instance_type or Ref(parameters.db_instance_type),
+                DBInstanceIdentifier=Join("-", [Ref("AWS::StackName"), str(number)]) if number else Ref("AWS::StackName"),
+                AvailabilityZone=GetAtt(vpc.data_subnets[number % len(vpc.data_subnets)], "AvailabilityZone"),
+                DBParameterGroupName=Ref(self.db_parameter_group),
+                DeletionPolicy="Delete",  # the cluster keeps the data and is snapshotted
+                Tags=Tags(
+                    Name=Join("", [Ref("AWS::StackName"), " reader ", str(number)]) if number else Ref("AWS::StackName"),
+                ),
+                **monitoring
+            )
+            if number:
+                setattr(self, "reader_{}".format(number), instance)
+                self.replicas.append(instance)
+            else:
+                self.database = instance
+
+        if not reader_scaling:
+            return
+
+        self.db_max_readers = Parameter(
+            "DBMaxReaders",
+            Type="Number",
+            Default=str(max(readers, 4)),
+            MinValue=readers,
+            MaxValue=15,
+            Description="Maximum number of reader instances auto scaling can run."
+        )
+
+        self.db_reader_scaling_target = Parameter(
+            "DBReaderScalingTarget",
+            Type="Number",
+            Default="70" if reader_scaling == "cpu" else "500",
+            MinValue=1,
+            Description="{} to keep reader instances at by adding and removing them.".format(
+                "Average reader CPU utilization in percent" if reader_scaling == "cpu" else "Average connections per reader"
+            )
+        )
+
+        self.reader_scalable_target = applicationautoscaling.ScalableTarget(
+            "DatabaseReaderScalableTarget",
+            ServiceNamespace="rds",
+            ScalableDimension="rds:cluster:ReadReplicaCount",
+            ResourceId=Join(":", ["cluster", Ref(self.cluster)]),
+            MinCapacity=readers,
+            MaxCapacity=Ref(self.db_max_readers),
+            RoleARN=Join("", [
+                "arn:aws:iam::", Ref("AWS::AccountId"),
+                ":role/aws-service-role/rds.application-autoscaling.amazonaws.com/"
+                "AWSServiceRoleForApplicationAutoScaling_RDSCluster",
+            ]),
+            DependsOn=[instance.title for instance in [self.database] + self.replicas],
+        )
+
+        self.reader_scaling_policy = applicationautoscaling.ScalingPolicy(
+            "DatabaseReaderScalingPolicy",
+            PolicyName=Join("-", [Ref("AWS::StackName"), "readers"]),
+            PolicyType="TargetTrackingScaling",
+            ScalingTargetId=Ref(self.reader_scalable_target),
+            TargetTrackingScalingPolicyConfiguration=applicationautoscaling.TargetTrackingScalingPolicyConfiguration(
+                PredefinedMetricSpecification=applicationautoscaling.PredefinedMetricSpecification(
+                    PredefinedMetricType=READER_SCALING_METRICS[reader_scaling],
+                ),
+                TargetValue=Ref(self.db_reader_scaling_target),
+                ScaleInCooldown=300,
+                ScaleOutCooldown=300,
+            ),
+        )
+
+    def _proxy(self, parameters, vpc, loadbalancer):
+        self.db_proxy_max_connections = Parameter(
+            "DBProxyMaxConnections",
+            Type="Number",
+            Default="90",
+            MinValue=1,
+            MaxValue=100,
+            Description="Percentage of the database max_connections the proxy may open."
+        )
+
+        # the proxy authenticates to the database with credentials from Secrets Manager
+        self.db_secret = secretsmanager.Secret(
+            "DBSecret",
+            Description=Join("", [Ref("AWS::StackName"), " database credentials"]),
+            SecretString=Join("", ['{"username":"root","password":"', Ref(parameters.db_password), '"}']),
+        )
+
+        self.db_proxy_role = iam.Role(
+            "DBProxyRole",
+            AssumeRolePolicyDocument=aws.Policy(
+                Statement=[
+                    aws.Statement(
+                        Effect=aws.Allow,
+                        Action=[sts.AssumeRole],
+                        Principal=aws.Principal(
+                            "Service", ["rds.amazonaws.com"]
+                        )
+                    )
+                ]
+            ),
+            Path="/",
+            Policies=[
+                iam.Policy(
+                    PolicyName="secret",
+                    PolicyDocument=aws.Policy(
+                        Statement=[
+                            aws.Statement(
+                                Effect=aws.Allow,
+                                Action=[aws.Action("secretsmanager", "GetSecretValue")],
+                                Resource=[Ref(self.db_secret)]
+                            )
+                        ]
+                    ),
+                ),
+            ],
+        )
+
+        self.db_proxy_security_group = ec2.SecurityGroup(
+            "DBProxySecurityGroup",
+            GroupDescription="Database proxy security group",
+            SecurityGroupIngress=[
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort=3306,
+                    ToPort=3306,
+                    SourceSecurityGroupId=Ref(loadbalancer.instance_security_group)
+                )
+            ],
+            SecurityGroupEgress=[  # only to the database
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort=3306,
+                    ToPort=3306,
+                    DestinationSecurityGroupId=Ref(self.db_security_group)
+                )
+            ],
+            VpcId=Ref(vpc.vpc),
+            Tags=Tags(
+                Name=Join("", [Ref("AWS::StackName"), " RDS proxy security group"]),
+            ),
+        )
+
+        # separate resource, an inline rule would make the two groups reference each other
+        self.db_security_group_proxy_ingress = ec2.SecurityGroupIngress(
+            "DBSecurityGroupProxyIngress",
+            GroupId=Ref(self.db_security_group),
+            IpProtocol="tcp",
+            FromPort=3306,
+            ToPort=3306,
+            SourceSecurityGroupId=Ref(self.db_proxy_security_group)
+        )
+
+        self.db_proxy = rds.DBProxy(
+            "DBProxy",
+            DBProxyName=Ref("AWS::StackName"),
+            EngineFamily="MYSQL",
+            Auth=[
+                rds.AuthFormat(
+                    AuthScheme="SECRETS",
+                    SecretArn=Ref(self.db_secret),
+                    IAMAuth="DISABLED",
+                ),
+            ],
+            RoleArn=GetAtt(self.db_proxy_role, "Arn"),
+            VpcSubnetIds=[Ref(subnet) for subnet in vpc.data_subnets],
+            VpcSecurityGroupIds=[Ref(self.db_proxy_security_group)],
+            RequireTLS=False,
+            IdleClientTimeout=1800,
+        )
+
+        self.db_proxy_target_group = rds.DBProxyTargetGroup(
+            "DBProxyTargetGroup",
+            DBProxyName=Ref(self.db_proxy),
+            TargetGroupName="default",
+            ConnectionPoolConfigurationInfo=rds.ConnectionPoolConfigurationInfoFormat(
+                MaxConnectionsPercent=Ref(self.db_proxy_max_connections),
+                MaxIdleConnectionsPercent=50,
+                ConnectionBorrowTimeout=120,
+            ),
+            **({"DBClusterIdentifiers": [Ref(self.cluster)]} if self.kind == "aurora" else
+               {"DBInstanceIdentifiers": [Ref(self.database)]})
+        )
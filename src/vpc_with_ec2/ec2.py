@@ -1,21 +1,122 @@
 from awacs import aws, sts
-from troposphere import AWS_REGION, FindInMap, GetAtt, Join, Ref
-from troposphere import autoscaling, cloudwatch, iam, policies
+from troposphere import AWS_REGION, AWSObject, AWSProperty, Base64, FindInMap, GetAtt, Join, Parameter, Ref
+from troposphere import autoscaling, cloudwatch, ec2, iam, policies
+from troposphere.validators import boolean, integer
 
 from loadbalancer import LoadBalancer
-from magicdict import MagicDict
-from parameters import Parameters
+from registry import Component
+from parameters import INSTANCE_TYPES, Parameters
 from vpc import VPC
 
+SCALING_POLICIES = ("step", "cpu", "requests")
+SPOT_ALLOCATION_STRATEGIES = ["capacity-optimized", "capacity-optimized-prioritized", "lowest-price"]
+# seconds until an instance from the warm pool passes ELB health checks, it was initialized before
+WARM_POOL_GRACE_PERIODS = {
+    "Running": 30,
+    "Hibernated": 60,
+    "Stopped": 90,
+}
+COLD_START_GRACE_PERIOD = 300
+LIFECYCLE_HOOK_NAME = "Launch"
+# completes the launch lifecycle action once the instance is bootstrapped: on the first boot, and again
+# whenever it leaves the warm pool (resumed, or booted again, hence the per-boot script)
+LIFECYCLE_USER_DATA = """#!/bin/bash
+script=/var/lib/cloud/scripts/per-boot/complete-lifecycle-action
+cat > $script <<'SCRIPT'
+#!/bin/bash
+# bootstrap the instance here, it stays in Pending:Wait until the lifecycle action is completed
+meta() {
+    token=$(curl -sf -X PUT -H "X-aws-ec2-metadata-token-ttl-seconds: 60" http://169.254.169.254/latest/api/token)
+    curl -sf -H "X-aws-ec2-metadata-token: $token" "http://169.254.169.254/latest/meta-data/$1"
+}
+instance=$(meta instance-id)
+export AWS_DEFAULT_REGION=$(meta placement/region)
+group=$(aws autoscaling describe-auto-scaling-instances --instance-ids "$instance" \\
+    --query "AutoScalingInstances[0].AutoScalingGroupName" --output text)
+completed=
+while true; do
+    target=$(meta autoscaling/target-lifecycle-state || echo InService)
+    if [ "$target" != "$completed" ]; then
+        aws autoscaling complete-lifecycle-action --auto-scaling-group-name "$group" \\
+            --lifecycle-hook-name {hook} --instance-id "$instance" --lifecycle-action-result CONTINUE
+        completed=$target
+    fi
+    [ "$target" = InService ] && break
+    sleep 5
+done
+SCRIPT
+chmod +x $script
+$script
+""".replace("{hook}", LIFECYCLE_HOOK_NAME)
 
-class EC2(MagicDict):
-    def __init__(self, parameters, vpc, loadbalancer):
+try:
+    from troposphere.autoscaling import InstanceReusePolicy, WarmPool
+except ImportError:  # not in troposphere 2.x
+    class InstanceReusePolicy(AWSProperty):
+        props = {
+            'ReuseOnScaleIn': (boolean, False),
+        }
+
+    class WarmPool(AWSObject):
+        resource_type = "AWS::AutoScaling::WarmPool"
+
+        props = {
+            'AutoScalingGroupName': (str, True),
+            'InstanceReusePolicy': (InstanceReusePolicy, False),
+            'MaxGroupPreparedCapacity': (integer, False),
+            'MinSize': (integer, False),
+            'PoolState': (str, False),
+        }
+
+
+class EC2(Component):
+    def __init__(self, parameters, vpc, loadbalancer, registry=None, image_id=None, instance_type=None,
+                 scaling=("step",), detailed_alarms=False, launch_template=False, instance_types=None,
+                 capacity_rebalance=True, warm_pool=None, lifecycle_hook=False):
         """
         :type parameters Parameters
         :type vpc VPC
         :type loadbalancer LoadBalancer
+        :type image_id str AMI to use instead of looking it up in AMIMap
+        :type instance_type str instance type to use instead of the EC2InstanceType parameter
+        :type scaling list[str] scaling policies to create: "step" (CPU alarms at 70%/20%),
+            "cpu" (target tracking on average CPU), "requests" (target tracking on load balancer
+            requests per target, needs an application load balancer)
+        :type detailed_alarms bool evaluate the step scaling alarms every minute instead of every 5 minutes
+        :type launch_template bool launch instances from a LaunchTemplate instead of a LaunchConfiguration
+        :type instance_types list[str] instance types for a mixed instances policy (spot and on-demand),
+            implies launch_template
+        :type capacity_rebalance bool replace spot instances at elevated risk of interruption ahead of time
+        :type warm_pool dict keep pre-initialized instances to scale out from: {"state": "Stopped", "Hibernated"
+            or "Running", "min_size": 0, "max_prepared_capacity": None, "reuse_on_scale_in": True};
+            hibernation needs launch_template and an AMI with an encrypted root volume
+        :type lifecycle_hook bool hold launching instances (including those going into or leaving the warm
+            pool) in Pending:Wait until their UserData has bootstrapped them and completed the lifecycle action,
+            or LifecycleHookTimeout passes; only then does a warm pool shorten the health check grace period
         """
-        super(EC2, self).__init__()
+        super(EC2, self).__init__(registry)
+
+        if isinstance(scaling, str):  # "step,cpu" from the command line
+            scaling = scaling.split(",")
+        unknown = set(scaling) - set(SCALING_POLICIES)
+        if unknown:
+            raise ValueError("unknown scaling policies: {}".format(", ".join(sorted(unknown))))
+        if "requests" in scaling and loadbalancer.kind != "application":
+            raise ValueError("request count scaling needs an application load balancer")
+        if isinstance(instance_types, str):
+            instance_types = instance_types.split(",")
+        unknown = set(instance_types or []) - set(INSTANCE_TYPES["ec2"])
+        if unknown:
+            raise ValueError("unknown instance types: {}".format(", ".join(sorted(unknown))))
+        if warm_pool is not None:
+            warm_pool = dict({"state": "Stopped", "min_size": 0, "max_prepared_capacity": None,
+                              "reuse_on_scale_in": True}, **warm_pool)
+            if warm_pool["state"] not in WARM_POOL_GRACE_PERIODS:
+                raise ValueError("unknown warm pool state {!r}".format(warm_pool["state"]))
+            if instance_types:
+                raise ValueError("a warm pool can not be used with a mixed instances policy")
+            if warm_pool["state"] == "Hibernated" and not launch_template:
+                raise ValueError("a hibernated warm pool needs launch_template")
 
         # Ec2 instance
         self.instance_role = iam.Role(
@@ -49,7 +150,17 @@ class EC2(MagicDict):
                         ],
                         Resource=["arn:aws:logs:*:*:*"]
                     )
-                ]
+                ] + ([
+                    aws.Statement(  # instances complete the launch lifecycle action, see LIFECYCLE_USER_DATA
+                        Effect=aws.Allow,
+                        Action=[
+                            aws.Action("autoscaling", "DescribeAutoScalingInstances"),
+                            aws.Action("autoscaling", "CompleteLifecycleAction"),
+                            aws.Action("autoscaling", "RecordLifecycleActionHeartbeat"),
+                        ],
+                        Resource=["*"]
+                    )
+                ] if lifecycle_hook else [])
             ),
             Roles=[Ref(self.instance_role)]
         )
@@ -60,28 +171,129 @@ class EC2(MagicDict):
             Roles=[Ref(self.instance_role)]
         )
 
-        self.launch_configuration = autoscaling.LaunchConfiguration(
-            "LaunchConfiguration",
-            ImageId=FindInMap("AMIMap", Ref(AWS_REGION), "AMI"),
-            InstanceType=Ref(parameters.ec2_instance_type),
-            KeyName=Ref(parameters.key_pair),
-            InstanceMonitoring=True,
-            SecurityGroups=[
-                GetAtt(loadbalancer.instance_security_group, "GroupId"),
-            ],
-            IamInstanceProfile=Ref(self.instance_profile),
-        )
+        if launch_template or instance_types:
+            self.launch_template = ec2.LaunchTemplate(
+                "LaunchTemplate",
+                LaunchTemplateData=ec2.LaunchTemplateData(
+                    ImageId=image_id or FindInMap("AMIMap", Ref(AWS_REGION), "AMI"),
+                    InstanceType=instance_type or Ref(parameters.ec2_instance_type),
+                    KeyName=Ref(parameters.key_pair),
+                    Monitoring=ec2.Monitoring(Enabled=True),
+                    SecurityGroupIds=[
+                        GetAtt(loadbalancer.instance_security_group, "GroupId"),
+                    ],
+                    IamInstanceProfile=ec2.IamInstanceProfile(
+                        Arn=GetAtt(self.instance_profile, "Arn"),
+                    ),
+                    **dict(
+                        {"HibernationOptions": ec2.HibernationOptions(Configured=True)}
+                        if warm_pool and warm_pool["state"] == "Hibernated" else {},
+                        **({"UserData": Base64(LIFECYCLE_USER_DATA)} if lifecycle_hook else {})
+                    )
+                ),
+            )
+            launch_template_specification = autoscaling.LaunchTemplateSpecification(
+                LaunchTemplateId=Ref(self.launch_template),
+                Version=GetAtt(self.launch_template, "LatestVersionNumber"),
+            )
+            group_options = {}
+            termination_policies = ['OldestLaunchTemplate', 'ClosestToNextInstanceHour', 'Default']
+        else:
+            self.launch_configuration = autoscaling.LaunchConfiguration(
+                "LaunchConfiguration",
+                ImageId=image_id or FindInMap("AMIMap", Ref(AWS_REGION), "AMI"),
+                InstanceType=instance_type or Ref(parameters.ec2_instance_type),
+                KeyName=Ref(parameters.key_pair),
+                InstanceMonitoring=True,
+                SecurityGroups=[
+                    GetAtt(loadbalancer.instance_security_group, "GroupId"),
+                ],
+                IamInstanceProfile=Ref(self.instance_profile),
+                **({"UserData": Base64(LIFECYCLE_USER_DATA)} if lifecycle_hook else {})
+            )
+            group_options = {"LaunchConfigurationName": Ref(self.launch_configuration)}
+            termination_policies = ['OldestLaunchConfiguration', 'ClosestToNextInstanceHour', 'Default']
+
+        if instance_types:
+            self.on_demand_base_capacity = Parameter(
+                "OnDemandBaseCapacity",
+                Type="Number",
+                Default="1",
+                MinValue=0,
+                Description="Number of instances always launched as on-demand."
+            )
+
+            self.on_demand_percentage = Parameter(
+                "OnDemandPercentageAboveBaseCapacity",
+                Type="Number",
+                Default="0",
+                MinValue=0,
+                MaxValue=100,
+                Description="Percentage of on-demand instances above the base capacity, the rest is spot."
+            )
+
+            self.spot_allocation_strategy = Parameter(
+                "SpotAllocationStrategy",
+                Type="String",
+                AllowedValues=SPOT_ALLOCATION_STRATEGIES,
+                Default="capacity-optimized",
+                Description="How spot instances are spread across the instance types."
+            )
+
+            group_options["MixedInstancesPolicy"] = autoscaling.MixedInstancesPolicy(
+                LaunchTemplate=autoscaling.LaunchTemplate(
+                    LaunchTemplateSpecification=launch_template_specification,
+                    Overrides=[
+                        autoscaling.LaunchTemplateOverrides(InstanceType=override) for override in instance_types
+                    ],
+                ),
+                InstancesDistribution=autoscaling.InstancesDistribution(
+                    OnDemandAllocationStrategy="prioritized",
+                    OnDemandBaseCapacity=Ref(self.on_demand_base_capacity),
+                    OnDemandPercentageAboveBaseCapacity=Ref(self.on_demand_percentage),
+                    SpotAllocationStrategy=Ref(self.spot_allocation_strategy),
+                ),
+            )
+            group_options["CapacityRebalance"] = capacity_rebalance
+        elif launch_template:
+            group_options["LaunchTemplate"] = launch_template_specification
+
+        if lifecycle_hook:
+            self.lifecycle_hook_timeout = Parameter(
+                "LifecycleHookTimeout",
+                Type="Number",
+                Default="120",
+                MinValue=30,
+                MaxValue=7200,
+                Description="Seconds a launching instance can take to bootstrap and complete the lifecycle action "
+                            "before it continues anyway."
+            )
+
+            group_options["LifecycleHookSpecificationList"] = [
+                autoscaling.LifecycleHookSpecification(
+                    LifecycleHookName=LIFECYCLE_HOOK_NAME,
+                    LifecycleTransition="autoscaling:EC2_INSTANCE_LAUNCHING",
+                    HeartbeatTimeout=Ref(self.lifecycle_hook_timeout),
+                    DefaultResult="CONTINUE",
+                ),
+            ]
+
+        if loadbalancer.kind == "classic":
+            group_options["LoadBalancerNames"] = [Ref(loadbalancer.load_balancer)]
+        else:
+            group_options["TargetGroupARNs"] = [Ref(loadbalancer.target_group)]
 
         self.auto_scaling_group = autoscaling.AutoScalingGroup(
             "AutoScalingGroup",
-            LaunchConfigurationName=Ref(self.launch_configuration),
             MinSize=1,
             DesiredCapacity=1,
             MaxSize=10,
             HealthCheckType='ELB',
-            HealthCheckGracePeriod=300,
-            VPCZoneIdentifier=[Ref(vpc.public_subnet_1), Ref(vpc.public_subnet_2)],
-            LoadBalancerNames=[Ref(loadbalancer.load_balancer)],
+            # warmed instances only skip the cold start if the lifecycle hook kept them out of
+            # InService until they were initialized
+            HealthCheckGracePeriod=(WARM_POOL_GRACE_PERIODS[warm_pool["state"]] if warm_pool and lifecycle_hook
+                                    else COLD_START_GRACE_PERIOD),
+            VPCZoneIdentifier=[Ref(subnet) for subnet in vpc.public_subnets],
             Tags=[
                 autoscaling.Tag("Name", Ref("AWS::StackName"), True)
             ],
@@ -93,72 +305,145 @@ class EC2(MagicDict):
                     WaitOnResourceSignals=False
                 )
             ),
-            TerminationPolicies=['OldestLaunchConfiguration', 'ClosestToNextInstanceHour', 'Default'],
+            TerminationPolicies=termination_policies,
             MetricsCollection=[
                 autoscaling.MetricsCollection(
                     Granularity="1Minute"
                 )
-            ]
-        )
-
-        self.scale_up_policy = autoscaling.ScalingPolicy(
-            "ScaleUPPolicy",
-            AdjustmentType='ChangeInCapacity',
-            AutoScalingGroupName=Ref(self.auto_scaling_group),
-            PolicyType='StepScaling',
-            MetricAggregationType='Average',
-            StepAdjustments=[
-                autoscaling.StepAdjustments(
-                    MetricIntervalLowerBound=0,
-                    ScalingAdjustment=1
-                )
             ],
+            **group_options
         )
 
-        self.scale_down_policy = autoscaling.ScalingPolicy(
-            "ScaleDOWNPolicy",
-            AdjustmentType='ChangeInCapacity',
-            AutoScalingGroupName=Ref(self.auto_scaling_group),
-            PolicyType='StepScaling',
-            MetricAggregationType='Average',
-            StepAdjustments=[
-                autoscaling.StepAdjustments(
-                    MetricIntervalUpperBound=0,
-                    ScalingAdjustment=-1
-                )
-            ],
-        )
+        if warm_pool:
+            self.warm_pool = WarmPool(
+                "WarmPool",
+                AutoScalingGroupName=Ref(self.auto_scaling_group),
+                PoolState=warm_pool["state"],
+                MinSize=warm_pool["min_size"],
+                InstanceReusePolicy=InstanceReusePolicy(
+                    ReuseOnScaleIn=warm_pool["reuse_on_scale_in"],
+                ),
+                **({"MaxGroupPreparedCapacity": warm_pool["max_prepared_capacity"]}
+                   if warm_pool["max_prepared_capacity"] is not None else {})
+            )
 
-        self.ec2_high_cpu_usage_alarm = cloudwatch.Alarm(
-            "EC2HighCPUUsageAlarm",
-            ActionsEnabled=True,
-            AlarmActions=[Ref(self.scale_up_policy)],
-            ComparisonOperator='GreaterThanThreshold',
-            Dimensions=[cloudwatch.MetricDimension(
-                Name='AutoScalingGroupName',
-                Value=Ref(self.auto_scaling_group)
-            )],
-            EvaluationPeriods=3,
-            MetricName='CPUUtilization',
-            Namespace='AWS/EC2',
-            Period=300,
-            Statistic='Average',
-            Threshold='70',
-        )
+        if "step" in scaling:
+            self.scale_up_policy = autoscaling.ScalingPolicy(
+                "ScaleUPPolicy",
+                AdjustmentType='ChangeInCapacity',
+                AutoScalingGroupName=Ref(self.auto_scaling_group),
+                PolicyType='StepScaling',
+                MetricAggregationType='Average',
+                StepAdjustments=[
+                    autoscaling.StepAdjustments(
+                        MetricIntervalLowerBound=0,
+                        ScalingAdjustment=1
+                    )
+                ],
+            )
 
-        self.ec2_low_cpu_usage_alarm = cloudwatch.Alarm(
-            "EC2LowCPUUsageAlarm",
-            ActionsEnabled=True,
-            AlarmActions=[Ref(self.scale_down_policy)],
-            ComparisonOperator='LessThanThreshold',
-            Dimensions=[cloudwatch.MetricDimension(
-                Name='AutoScalingGroupName',
-                Value=Ref(self.auto_scaling_group)
-            )],
-            EvaluationPeriods=3,
-            MetricName='CPUUtilization',
-            Namespace='AWS/EC2',
-            Period=300,
-            Statistic='Average',
-            Threshold='20',
-        )
+            self.scale_down_policy = autoscaling.ScalingPolicy(
+                "ScaleDOWNPolicy",
+                AdjustmentType='ChangeInCapacity',
+                AutoScalingGroupName=Ref(self.auto_scaling_group),
+                PolicyType='StepScaling',
+                MetricAggregationType='Average',
+                StepAdjustments=[
+                    autoscaling.StepAdjustments(
+                        MetricIntervalUpperBound=0,
+                        ScalingAdjustment=-1
+                    )
+                ],
+            )
+
+            self.ec2_high_cpu_usage_alarm = cloudwatch.Alarm(
+                "EC2HighCPUUsageAlarm",
+                ActionsEnabled=True,
+                AlarmActions=[Ref(self.scale_up_policy)],
+                ComparisonOperator='GreaterThanThreshold',
+                Dimensions=[cloudwatch.MetricDimension(
+                    Name='AutoScalingGroupName',
+                    Value=Ref(self.auto_scaling_group)
+                )],
+                EvaluationPeriods=3,
+                MetricName='CPUUtilization',
+                Namespace='AWS/EC2',
+                Period=60 if detailed_alarms else 300,
+                Statistic='Average',
+                Threshold='70',
+            )
+
+            self.ec2_low_cpu_usage_alarm = cloudwatch.Alarm(
+                "EC2LowCPUUsageAlarm",
+                ActionsEnabled=True,
+                AlarmActions=[Ref(self.scale_down_policy)],
+                ComparisonOperator='LessThanThreshold',
+                Dimensions=[cloudwatch.MetricDimension(
+                    Name='AutoScalingGroupName',
+                    Value=Ref(self.auto_scaling_group)
+                )],
+                EvaluationPeriods=3,
+                MetricName='CPUUtilization',
+                Namespace='AWS/EC2',
+                Period=60 if detailed_alarms else 300,
+                Statistic='Average',
+                Threshold='20',
+            )
+
+        if "cpu" in scaling or "requests" in scaling:
+            self.scaling_warmup = Parameter(
+                "ScalingWarmup",
+                Type="Number",
+                Default="120",
+                MinValue=0,
+                Description="Seconds until a new instance contributes to the scaling metrics."
+            )
+
+        if "cpu" in scaling:
+            self.scaling_cpu_target = Parameter(
+                "ScalingCPUTarget",
+                Type="Number",
+                Default="50",
+                MinValue=1,
+                MaxValue=100,
+                Description="Average CPU utilization (%) the auto scaling group is kept at."
+            )
+
+            self.cpu_target_tracking_policy = autoscaling.ScalingPolicy(
+                "CPUTargetTrackingPolicy",
+                AutoScalingGroupName=Ref(self.auto_scaling_group),
+                PolicyType='TargetTrackingScaling',
+                EstimatedInstanceWarmup=Ref(self.scaling_warmup),
+                TargetTrackingConfiguration=autoscaling.TargetTrackingConfiguration(
+                    PredefinedMetricSpecification=autoscaling.PredefinedMetricSpecification(
+                        PredefinedMetricType='ASGAverageCPUUtilization'
+                    ),
+                    TargetValue=Ref(self.scaling_cpu_target),
+                ),
+            )
+
+        if "requests" in scaling:
+            self.scaling_request_target = Parameter(
+                "ScalingRequestTarget",
+                Type="Number",
+                Default="1000",
+                MinValue=1,
+                Description="Load balancer requests per minute each instance should serve."
+            )
+
+            self.request_target_tracking_policy = autoscaling.ScalingPolicy(
+                "RequestCountTargetTrackingPolicy",
+                AutoScalingGroupName=Ref(self.auto_scaling_group),
+                PolicyType='TargetTrackingScaling',
+                EstimatedInstanceWarmup=Ref(self.scaling_warmup),
+                TargetTrackingConfiguration=autoscaling.TargetTrackingConfiguration(
+                    PredefinedMetricSpecification=autoscaling.PredefinedMetricSpecification(
+                        PredefinedMetricType='ALBRequestCountPerTarget',
+                        ResourceLabel=Join("/", [
+                            GetAtt(loadbalancer.load_balancer, "LoadBalancerFullName"),
+                            GetAtt(loadbalancer.target_group, "TargetGroupFullName"),
+                        ]),
+                    ),
+                    TargetValue=Ref(self.scaling_request_target),
+                ),
+            )
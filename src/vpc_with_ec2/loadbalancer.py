@@ -1,16 +1,24 @@
-from troposphere import GetAtt, Join, Ref, Tags
-from troposphere import ec2, elasticloadbalancing
+from troposphere import GetAtt, Join, Parameter, Ref, Tags
+from troposphere import ec2, elasticloadbalancing, elasticloadbalancingv2
 
-from magicdict import MagicDict
+from registry import Component
 from vpc import VPC
 
+KINDS = ("classic", "application", "network")
 
-class LoadBalancer(MagicDict):
-    def __init__(self, vpc):
+
+class LoadBalancer(Component):
+    def __init__(self, vpc, registry=None, kind="classic"):
         """
         :type vpc VPC
+        :type kind str "classic" ELB with an HTTP listener, "application" load balancer with HTTPS
+            and HTTP/2 (HTTP redirects to HTTPS), or "network" load balancer with TCP and TLS listeners
         """
-        super(LoadBalancer, self).__init__()
+        super(LoadBalancer, self).__init__(registry)
+
+        if kind not in KINDS:
+            raise ValueError("unknown load balancer kind {!r}, expected one of {}".format(kind, ", ".join(KINDS)))
+        self.kind = kind
 
         self.load_balancer_security_group = ec2.SecurityGroup(
             "LoadBalancerSecurityGroup",
@@ -37,7 +45,7 @@ class LoadBalancer(MagicDict):
             ],
             SecurityGroupEgress=[
                 ec2.SecurityGroupRule(
-                    CidrIp="172.1.0.0/16",
+                    CidrIp=vpc.network,
                     FromPort=0,
                     IpProtocol="-1",
                     ToPort=65535
@@ -46,34 +54,37 @@ class LoadBalancer(MagicDict):
             VpcId=Ref(vpc.vpc)
         )
 
-        self.load_balancer = elasticloadbalancing.LoadBalancer(
-            "LoadBalancer",
-            Subnets=[Ref(vpc.public_subnet_1), Ref(vpc.public_subnet_2)],
-            ConnectionDrainingPolicy=elasticloadbalancing.ConnectionDrainingPolicy(
-                Enabled=True,
-                Timeout=300,
-            ),
-            CrossZone=True,
-            Listeners=[
-                elasticloadbalancing.Listener(
-                    LoadBalancerPort="80",
-                    InstancePort="80",
-                    Protocol="HTTP",
-                    InstanceProtocol="HTTP"
+        if kind == "classic":
+            self.load_balancer = elasticloadbalancing.LoadBalancer(
+                "LoadBalancer",
+                Subnets=[Ref(subnet) for subnet in vpc.public_subnets],
+                ConnectionDrainingPolicy=elasticloadbalancing.ConnectionDrainingPolicy(
+                    Enabled=True,
+                    Timeout=300,
                 ),
-            ],
-            HealthCheck=elasticloadbalancing.HealthCheck(
-                Target="HTTP:80/",
-                HealthyThreshold="2",
-                UnhealthyThreshold="3",
-                Interval="30",
-                Timeout="10",
-            ),
-            SecurityGroups=[
-                GetAtt(self.load_balancer_security_group, "GroupId"),
-            ],
-            DependsOn=vpc.internet_gateway_attachment.title
-        )
+                CrossZone=True,
+                Listeners=[
+                    elasticloadbalancing.Listener(
+                        LoadBalancerPort="80",
+                        InstancePort="80",
+                        Protocol="HTTP",
+                        InstanceProtocol="HTTP"
+                    ),
+                ],
+                HealthCheck=elasticloadbalancing.HealthCheck(
+                    Target="HTTP:80/",
+                    HealthyThreshold="2",
+                    UnhealthyThreshold="3",
+                    Interval="30",
+                    Timeout="10",
+                ),
+                SecurityGroups=[
+                    GetAtt(self.load_balancer_security_group, "GroupId"),
+                ],
+                DependsOn=vpc.internet_gateway_attachment.title
+            )
+        else:
+            self._v2_load_balancer(vpc, kind)
 
         # EC2 instance security group
         self.instance_security_group = ec2.SecurityGroup(
@@ -122,7 +133,7 @@ class LoadBalancer(MagicDict):
                     IpProtocol="-1",
                     FromPort="-1",
                     ToPort="-1",
-                    CidrIp="172.1.0.0/16",
+                    CidrIp=vpc.network,
                 ),
             ],
             VpcId=Ref(vpc.vpc),
@@ -130,3 +141,145 @@ class LoadBalancer(MagicDict):
                 Name=Join("", [Ref("AWS::StackName"), " instance security group"]),
             ),
         )
+
+    def _v2_load_balancer(self, vpc, kind):
+        """
+        :type vpc VPC
+        :type kind str "application" or "network"
+        """
+        self.certificate_arn = Parameter(
+            "LoadBalancerCertificateArn",
+            Type="String",
+            Description="ARN of the ACM certificate for the HTTPS/TLS listener on port 443."
+        )
+
+        self.deregistration_delay = Parameter(
+            "DeregistrationDelay",
+            Type="Number",
+            Default="30",
+            MinValue=0,
+            MaxValue=3600,
+            Description="Seconds to let in-flight requests finish before an instance is deregistered."
+        )
+
+        load_balancer_attributes = []
+        target_group_attributes = [
+            elasticloadbalancingv2.TargetGroupAttribute(
+                Key="deregistration_delay.timeout_seconds",
+                Value=Ref(self.deregistration_delay),
+            ),
+        ]
+
+        if kind == "application":
+            self.slow_start = Parameter(
+                "SlowStart",
+                Type="String",  # AllowedPattern only applies to strings
+                Default="0",
+                AllowedPattern="^(0|[3-8][0-9]|9[0-9]|[1-8][0-9]{2}|900)$",
+                ConstraintDescription="SlowStart must be 0 or between 30 and 900 seconds.",
+                Description="Seconds over which a new instance ramps up to its full share of requests, "
+                            "0 disables it, otherwise 30-900."
+            )
+
+            self.idle_timeout = Parameter(
+                "IdleTimeout",
+                Type="Number",
+                Default="60",
+                MinValue=1,
+                MaxValue=4000,
+                Description="Seconds a connection to the load balancer can stay idle."
+            )
+
+            load_balancer_attributes = [
+                elasticloadbalancingv2.LoadBalancerAttributes(
+                    Key="idle_timeout.timeout_seconds",
+                    Value=Ref(self.idle_timeout),
+                ),
+                elasticloadbalancingv2.LoadBalancerAttributes(
+                    Key="routing.http2.enabled",
+                    Value="true",
+                ),
+            ]
+            target_group_attributes.append(elasticloadbalancingv2.TargetGroupAttribute(
+                Key="slow_start.duration_seconds",
+                Value=Ref(self.slow_start),
+            ))
+
+        self.load_balancer = elasticloadbalancingv2.LoadBalancer(
+            "LoadBalancer",
+            Type=kind,
+            Scheme="internet-facing",
+            Subnets=[Ref(subnet) for subnet in vpc.public_subnets],
+            SecurityGroups=[
+                GetAtt(self.load_balancer_security_group, "GroupId"),
+            ],
+            LoadBalancerAttributes=load_balancer_attributes,
+            DependsOn=vpc.internet_gateway_attachment.title
+        )
+
+        self.target_group = elasticloadbalancingv2.TargetGroup(
+            "TargetGroup",
+            Port=80,
+            Protocol="HTTP" if kind == "application" else "TCP",
+            VpcId=Ref(vpc.vpc),
+            HealthCheckProtocol="HTTP",
+            HealthCheckPath="/",
+            HealthCheckIntervalSeconds=30,
+            HealthCheckTimeoutSeconds=10 if kind == "application" else 6,
+            HealthyThresholdCount=2 if kind == "application" else 3,
+            UnhealthyThresholdCount=3,
+            TargetGroupAttributes=target_group_attributes,
+        )
+
+        if kind == "application":
+            self.https_listener = elasticloadbalancingv2.Listener(
+                "HTTPSListener",
+                LoadBalancerArn=Ref(self.load_balancer),
+                Port=443,
+                Protocol="HTTPS",
+                SslPolicy="ELBSecurityPolicy-TLS-1-2-2017-01",
+                Certificates=[elasticloadbalancingv2.Certificate(CertificateArn=Ref(self.certificate_arn))],
+                DefaultActions=[elasticloadbalancingv2.Action(
+                    Type="forward",
+                    TargetGroupArn=Ref(self.target_group),
+                )],
+            )
+
+            self.http_listener = elasticloadbalancingv2.Listener(
+                "HTTPListener",
+                LoadBalancerArn=Ref(self.load_balancer),
+                Port=80,
+                Protocol="HTTP",
+                DefaultActions=[elasticloadbalancingv2.Action(
+                    Type="redirect",
+                    RedirectConfig=elasticloadbalancingv2.RedirectConfig(
+                        Protocol="HTTPS",
+                        Port="443",
+                        StatusCode="HTTP_301",
+                    ),
+                )],
+            )
+        else:
+            self.tls_listener = elasticloadbalancingv2.Listener(
+                "TLSListener",
+                LoadBalancerArn=Ref(self.load_balancer),
+                Port=443,
+                Protocol="TLS",
+                SslPolicy="ELBSecurityPolicy-TLS-1-2-2017-01",
+                Certificates=[elasticloadbalancingv2.Certificate(CertificateArn=Ref(self.certificate_arn))],
+                DefaultActions=[elasticloadbalancingv2.Action(
+                    Type="forward",
+                    TargetGroupArn=Ref(self.target_group),
+                )],
+            )
+
+            self.tcp_listener = elasticloadbalancingv2.Listener(
+                "TCPListener",
+                LoadBalancerArn=Ref(self.load_balancer),
+                Port=80,
+                Protocol="TCP",
+                DefaultActions=[elasticloadbalancingv2.Action(
+                    Type="forward",
+                    TargetGroupArn=Ref(self.target_group),
+                )],
+            )
@@ -1,5 +1,12 @@
+from database import db_parameter_map
+from parameters import INSTANCE_TYPES
+
+
 class Mappings:
-    def __init__(self):
+    def __init__(self, database="instance"):
+        """
+        :type database str "instance" or "aurora", see Database
+        """
         self.mappings = {
             "AMIMap":
                 {
@@ -45,5 +52,6 @@ class Mappings:
                     "sa-east-1": {
                         "AMI": "xxx",
                     }
-                }
+                },
+            "DBParameterMap": db_parameter_map(INSTANCE_TYPES["aurora" if database == "aurora" else "db"]),
         }
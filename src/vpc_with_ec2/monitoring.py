@@ -0,0 +1,265 @@
+import json
+import re
+
+from troposphere import GetAtt, Output, Parameter, Ref, Sub, Tags
+from troposphere import cloudwatch, sns
+
+from registry import Component, Registry
+
+# alarms look at one minute periods and fire when 3 of the last 5 breach
+PERIOD = 60
+EVALUATION_PERIODS = 5
+DATAPOINTS_TO_ALARM = 3
+
+# threshold parameter: default, description
+THRESHOLDS = {
+    "AlarmLatencyP90": ("0.5", "Seconds the 90th percentile of load balancer latency may reach."),
+    "AlarmLatencyP99": ("2", "Seconds the 99th percentile of load balancer latency may reach."),
+    "AlarmServerErrors": ("10", "5XX responses from the instances per minute."),
+    "AlarmSurgeQueueLength": ("100", "Requests queued by the load balancer waiting for an instance."),
+    "AlarmRejectedConnections": ("1", "Connections per minute the load balancer rejects because it is at capacity."),
+    "AlarmDBLatencyP90": ("0.02", "Seconds the 90th percentile of database read and write latency may reach."),
+    "AlarmDBLatencyP99": ("0.1", "Seconds the 99th percentile of database read and write latency may reach."),
+    "AlarmDBConnections": ("100", "Database connections, keep it below max_connections of the instance class."),
+    "AlarmMinInService": ("1", "Alarm when fewer instances than this are in service."),
+    "AlarmNATPortAllocationErrors": ("0", "Connections per minute a NAT gateway fails to allocate a port for."),
+}
+
+
+def _attribute(title):
+    return re.sub(r"(?<!^)(?=[A-Z][a-z])", "_", title).lower()
+
+
+class Monitoring(Component):
+    """
+    CloudWatch dashboard and alarms for the resources already in the registry:
+    the load balancer (latency percentiles, 5XX, queueing), the database instances
+    or Aurora cluster (latency percentiles, connections), the auto scaling group
+    (instances in service) and NAT gateways (port allocation errors). Every
+    threshold is a parameter; alarms notify the AlarmTopic SNS topic.
+
+    Network load balancers have no latency metrics and only show up on the dashboard.
+    """
+
+    def __init__(self, registry):
+        """
+        :type registry Registry shared registry, built after the other components
+        """
+        super(Monitoring, self).__init__(registry)
+        self._widgets = []
+        self._alarms = []
+
+        self.alarm_topic = sns.Topic(
+            "AlarmTopic",
+            DisplayName=Sub("${AWS::StackName} alarms"),
+            Tags=Tags(
+                Name=Ref("AWS::StackName")
+            ),
+        )
+
+        for load_balancer in registry.of_type("AWS::ElasticLoadBalancing::LoadBalancer"):
+            self._classic_load_balancer(load_balancer)
+        for load_balancer in registry.of_type("AWS::ElasticLoadBalancingV2::LoadBalancer"):
+            self._v2_load_balancer(load_balancer)
+
+        clusters = registry.of_type("AWS::RDS::DBCluster")
+        for cluster in clusters:
+            self._database("DBClusterIdentifier", cluster, writer=True)
+        for instance in registry.of_type("AWS::RDS::DBInstance"):
+            if "DBClusterIdentifier" not in instance.properties:  # Aurora instances are covered by their cluster
+                self._database("DBInstanceIdentifier", instance,
+                               writer="SourceDBInstanceIdentifier" not in instance.properties)
+
+        for group in registry.of_type("AWS::AutoScaling::AutoScalingGroup"):
+            self._auto_scaling_group(group)
+
+        nat_gateways = registry.of_type("AWS::EC2::NatGateway")
+        if nat_gateways:
+            self._nat_gateways(nat_gateways)
+
+        self._widgets.append({
+            "type": "alarm",
+            "width": 24,
+            "height": 3,
+            "properties": {
+                "title": "Alarms",
+                "alarms": ["${{{}.Arn}}".format(alarm.title) for alarm in self._alarms],
+            },
+        })
+        self.dashboard = cloudwatch.Dashboard(
+            "Dashboard",
+            DashboardBody=Sub(json.dumps({"widgets": self._widgets}, sort_keys=True)),
+        )
+
+        self.alarm_topic_arn = Output(
+            "AlarmTopicArn",
+            Description="Subscribe to this topic to get notified about alarms",
+            Value=Ref(self.alarm_topic)
+        )
+
+    def _threshold(self, name):
+        attribute = _attribute(name)
+        if attribute not in self:
+            default, description = THRESHOLDS[name]
+            setattr(self, attribute, Parameter(
+                name,
+                Type="Number",
+                Default=default,
+                MinValue=0,
+                Description=description
+            ))
+        return getattr(self, attribute)
+
+    def _alarm(self, title, description, namespace, metric, dimensions, threshold, statistic="Sum",
+               comparison="GreaterThanThreshold", missing="notBreaching"):
+        """
+        :type dimensions list[tuple[str, object]] metric dimension name and value
+        :type threshold str name of the threshold parameter, see THRESHOLDS
+        :type statistic str statistic or percentile (e.g. p99)
+        """
+        alarm = cloudwatch.Alarm(
+            title,
+            AlarmDescription=description,
+            Namespace=namespace,
+            MetricName=metric,
+            Dimensions=[cloudwatch.MetricDimension(Name=name, Value=value) for name, value in dimensions],
+            Period=PERIOD,
+            EvaluationPeriods=EVALUATION_PERIODS,
+            DatapointsToAlarm=DATAPOINTS_TO_ALARM,
+            ComparisonOperator=comparison,
+            Threshold=Ref(self._threshold(threshold)),
+            TreatMissingData=missing,
+            AlarmActions=[Ref(self.alarm_topic)],
+            OKActions=[Ref(self.alarm_topic)],
+            **({"ExtendedStatistic": statistic} if statistic.startswith("p") else {"Statistic": statistic})
+        )
+        setattr(self, _attribute(title), alarm)
+        self._alarms.append(alarm)
+
+    def _widget(self, title, metrics, stat="Sum"):
+        """
+        :type metrics list[list] CloudWatch dashboard metric arrays, values may use ${} substitutions
+        """
+        self._widgets.append({
+            "type": "metric",
+            "width": 12,
+            "height": 6,
+            "properties": {
+                "title": title,
+                "region": "${AWS::Region}",
+                "period": PERIOD,
+                "stat": stat,
+                "metrics": metrics,
+            },
+        })
+
+    def _classic_load_balancer(self, load_balancer):
+        name = load_balancer.title
+        dimension = [("LoadBalancerName", Ref(load_balancer))]
+        metric = ["AWS/ELB", "Latency", "LoadBalancerName", "${{{}}}".format(name)]
+        for percentile in ("p90", "p99"):
+            self._alarm(
+                "{}Latency{}Alarm".format(name, percentile.upper()),
+                "{} latency of the load balancer is high".format(percentile),
+                "AWS/ELB", "Latency", dimension, "AlarmLatency" + percentile.upper(), statistic=percentile,
+            )
+        self._alarm("{}ServerErrorsAlarm".format(name), "Instances respond with 5XX errors",
+                    "AWS/ELB", "HTTPCode_Backend_5XX", dimension, "AlarmServerErrors")
+        self._alarm("{}SurgeQueueAlarm".format(name), "Requests queue up waiting for an instance",
+                    "AWS/ELB", "SurgeQueueLength", dimension, "AlarmSurgeQueueLength", statistic="Maximum")
+
+        self._widget("Load balancer latency", [
+            metric + [{"stat": percentile, "label": percentile}] for percentile in ("p50", "p90", "p99")
+        ])
+        self._widget("Load balancer errors and queue", [
+            ["AWS/ELB", "HTTPCode_Backend_5XX", "LoadBalancerName", "${{{}}}".format(name)],
+            ["AWS/ELB", "SurgeQueueLength", "LoadBalancerName", "${{{}}}".format(name), {"stat": "Maximum"}],
+            ["AWS/ELB", "SpilloverCount", "LoadBalancerName", "${{{}}}".format(name)],
+        ])
+
+    def _v2_load_balancer(self, load_balancer):
+        name = load_balancer.title
+        full_name = "${{{}.LoadBalancerFullName}}".format(name)
+        if load_balancer.properties.get("Type", "application") == "network":
+            self._widget("Load balancer flows", [
+                ["AWS/NetworkELB", "ActiveFlowCount", "LoadBalancer", full_name, {"stat": "Average"}],
+                ["AWS/NetworkELB", "NewFlowCount", "LoadBalancer", full_name],
+                ["AWS/NetworkELB", "TCP_Target_Reset_Count", "LoadBalancer", full_name],
+            ])
+            return
+
+        dimension = [("LoadBalancer", GetAtt(load_balancer, "LoadBalancerFullName"))]
+        for percentile in ("p90", "p99"):
+            self._alarm(
+                "{}Latency{}Alarm".format(name, percentile.upper()),
+                "{} response time of the targets is high".format(percentile),
+                "AWS/ApplicationELB", "TargetResponseTime", dimension, "AlarmLatency" + percentile.upper(),
+                statistic=percentile,
+            )
+        self._alarm("{}ServerErrorsAlarm".format(name), "Targets respond with 5XX errors",
+                    "AWS/ApplicationELB", "HTTPCode_Target_5XX_Count", dimension, "AlarmServerErrors")
+        self._alarm("{}RejectedConnectionsAlarm".format(name), "The load balancer is at its connection limit",
+                    "AWS/ApplicationELB", "RejectedConnectionCount", dimension, "AlarmRejectedConnections",
+                    comparison="GreaterThanOrEqualToThreshold")
+
+        self._widget("Load balancer latency", [
+            ["AWS/ApplicationELB", "TargetResponseTime", "LoadBalancer", full_name,
+             {"stat": percentile, "label": percentile}] for percentile in ("p50", "p90", "p99")
+        ])
+        self._widget("Load balancer errors and rejected connections", [
+            ["AWS/ApplicationELB", "HTTPCode_Target_5XX_Count", "LoadBalancer", full_name],
+            ["AWS/ApplicationELB", "RejectedConnectionCount", "LoadBalancer", full_name],
+        ])
+
+    def _database(self, dimension_name, database, writer):
+        """
+        :type dimension_name str DBClusterIdentifier or DBInstanceIdentifier
+        :type writer bool False for read replicas, which get no write latency alarms
+        """
+        name = database.title
+        dimension = [(dimension_name, Ref(database))]
+        metrics = ["ReadLatency", "WriteLatency"] if writer else ["ReadLatency"]
+        for metric in metrics:
+            for percentile in ("p90", "p99"):
+                self._alarm(
+                    "{}{}{}Alarm".format(name, metric, percentile.upper()),
+                    "{} {} of {} is high".format(percentile, metric, name),
+                    "AWS/RDS", metric, dimension, "AlarmDBLatency" + percentile.upper(), statistic=percentile,
+                )
+        self._alarm("{}ConnectionsAlarm".format(name), "{} is running out of connections".format(name),
+                    "AWS/RDS", "DatabaseConnections", dimension, "AlarmDBConnections", statistic="Maximum")
+
+        self._widget("{} latency".format(name), [
+            ["AWS/RDS", metric, dimension_name, "${{{}}}".format(name), {"stat": percentile}]
+            for metric in metrics for percentile in ("p90", "p99")
+        ])
+        self._widget("{} connections".format(name), [
+            ["AWS/RDS", "DatabaseConnections", dimension_name, "${{{}}}".format(name), {"stat": "Maximum"}],
+        ])
+
+    def _auto_scaling_group(self, group):
+        name = group.title
+        self._alarm("{}InServiceAlarm".format(name), "Too few instances are in service",
+                    "AWS/AutoScaling", "GroupInServiceInstances", [("AutoScalingGroupName", Ref(group))],
+                    "AlarmMinInService", statistic="Minimum", comparison="LessThanThreshold", missing="breaching")
+
+        self._widget("Instances", [
+            ["AWS/AutoScaling", metric, "AutoScalingGroupName", "${{{}}}".format(name)]
+            for metric in ("GroupInServiceInstances", "GroupDesiredCapacity", "GroupPendingInstances")
+        ], stat="Maximum")
+        self._widget("Instance CPU", [
+            ["AWS/EC2", "CPUUtilization", "AutoScalingGroupName", "${{{}}}".format(name), {"stat": stat}]
+            for stat in ("Average", "Maximum")
+        ])
+
+    def _nat_gateways(self, nat_gateways):
+        for nat_gateway in nat_gateways:
+            self._alarm("{}PortAllocationAlarm".format(nat_gateway.title),
+                        "{} cannot allocate ports for new connections".format(nat_gateway.title),
+                        "AWS/NATGateway", "ErrorPortAllocation", [("NatGatewayId", Ref(nat_gateway))],
+                        "AlarmNATPortAllocationErrors")
+
+        self._widget("NAT gateways", [
+            ["AWS/NATGateway", metric, "NatGatewayId", "${{{}}}".format(nat_gateway.title)]
+            for nat_gateway in nat_gateways for metric in ("ActiveConnectionCount", "ErrorPortAllocation")
+        ], stat="Maximum")
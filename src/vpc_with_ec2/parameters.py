@@ -1,11 +1,20 @@
+import json
+import os
+
 from troposphere import Parameter
 
-from magicdict import MagicDict
+from registry import Component
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance_types.json")) as f:
+    INSTANCE_TYPES = json.load(f)
 
 
-class Parameters(MagicDict):
-    def __init__(self):
-        super(Parameters, self).__init__()
+class Parameters(Component):
+    def __init__(self, registry=None, database="instance"):
+        """
+        :type database str "instance" or "aurora", see Database; Aurora has no storage settings
+        """
+        super(Parameters, self).__init__(registry)
 
         self.key_pair = Parameter(
             "KeyPair",
@@ -26,21 +35,64 @@ class Parameters(MagicDict):
         self.db_instance_type = Parameter(
             "DBInstanceType",
             Type="String",
-            AllowedValues=[
-                "db.t2.micro", "db.t2.small", "db.t2.medium", "db.t2.large",
-                "db.m4.large", "db.m4.xlarge", "db.m4.2xlarge", "db.m4.4xlarge", "db.m4.10xlarge"
-            ],
-            Default="db.t2.micro",
+            AllowedValues=INSTANCE_TYPES["aurora" if database == "aurora" else "db"],
+            Default="db.t3.medium" if database == "aurora" else "db.t2.micro",
             Description="Instance class for your database. Defines amount of CPU and Memory."
         )
 
-        self.db_storage_size = Parameter(
-            "DBStorageSize",
-            Type="Number",
-            Default="10",
-            Description="Storage size for your database in GB."
+        self.db_engine_version = Parameter(
+            "DBEngineVersion",
+            Type="String",
+            # RDS upgrades one major version at a time, existing stacks step 5.6 -> 5.7 -> 8.0 in separate
+            # updates; Aurora starts at 5.7
+            AllowedValues=["5.7", "8.0"] if database == "aurora" else ["5.6", "5.7", "8.0"],
+            Default="8.0" if database == "aurora" else "5.6",
+            Description="MySQL major version of your database. Upgrade one major version per stack update "
+                        "(5.6, then 5.7, then 8.0)."
         )
 
+        if database != "aurora":  # cluster storage grows by itself
+            self.db_storage_size = Parameter(
+                "DBStorageSize",
+                Type="Number",
+                Default="20",
+                MinValue=20,  # smallest gp3 volume
+                Description="Storage size for your database in GB."
+            )
+
+            self.db_storage_type = Parameter(
+                "DBStorageType",
+                Type="String",
+                AllowedValues=["gp2", "gp3", "io1"],
+                Default="gp3",
+                Description="Storage type for your database. gp2 IOPS grow with the storage size, gp3 and io1 IOPS are provisioned."
+            )
+
+            self.db_storage_iops = Parameter(
+                "DBStorageIops",
+                Type="Number",
+                Default="0",
+                MinValue=0,
+                Description="Provisioned IOPS, 0 for the baseline of the storage type. Required for io1, "
+                            "gp3 accepts it from 400 GB of storage."
+            )
+
+            self.db_storage_throughput = Parameter(
+                "DBStorageThroughput",
+                Type="Number",
+                Default="0",
+                MinValue=0,
+                Description="Provisioned gp3 throughput in MiB/s, 0 for the baseline. gp3 accepts it from 400 GB of storage."
+            )
+
+            self.db_max_storage_size = Parameter(
+                "DBMaxStorageSize",
+                Type="Number",
+                Default="0",
+                MinValue=0,
+                Description="Storage autoscaling limit in GB, 0 to disable storage autoscaling."
+            )
+
         self.db_backup_retention = Parameter(
             "DBBackupRetention",
             Type="Number",
@@ -51,12 +103,7 @@ class Parameters(MagicDict):
         self.ec2_instance_type = Parameter(
             "EC2InstanceType",
             Type="String",
-            AllowedValues=[
-                "t2.micro", "t2.small", "t2.medium", "t2.large", "t2.xlarge", "t2.2xlarge",
-                "m4.large", "m4.xlarge", "m4.2xlarge",
-                "m4.4xlarge", "m4.10xlarge", "m4.16xlarge",
-
-            ],
+            AllowedValues=INSTANCE_TYPES["ec2"],
             Default="t2.micro",
             Description="Instance class for your server. Defines amount of CPU and Memory."
         )
@@ -0,0 +1,116 @@
+from troposphere import GetAtt, Join, Output, Parameter, Ref, Tags
+from troposphere import ec2, elasticache
+
+from loadbalancer import LoadBalancer
+from registry import Component
+from parameters import INSTANCE_TYPES
+from vpc import VPC
+
+
+class Redis(Component):
+    def __init__(self, vpc, loadbalancer, registry=None, node_type=None, shards=None, replicas=1,
+                 transit_encryption=False):
+        """
+        :type vpc VPC
+        :type loadbalancer LoadBalancer
+        :type node_type str node type to use instead of the CacheNodeType parameter
+        :type shards int cluster mode with this many shards, None for a single shard without cluster mode
+        :type replicas int read replicas per shard
+        :type transit_encryption bool TLS between clients and Redis
+        """
+        super(Redis, self).__init__(registry)
+
+        if shards is not None and shards < 1:
+            raise ValueError("shards must be at least 1, got {!r}".format(shards))
+        if not 0 <= replicas <= 5:
+            raise ValueError("replicas must be between 0 and 5, got {!r}".format(replicas))
+        if node_type is not None and node_type not in INSTANCE_TYPES["cache"]:
+            raise ValueError("unknown cache node type {!r}".format(node_type))
+
+        if node_type is None:
+            self.cache_node_type = Parameter(
+                "CacheNodeType",
+                Type="String",
+                AllowedValues=INSTANCE_TYPES["cache"],
+                Default="cache.t3.micro",
+                Description="Node type for your Redis cache. Defines amount of CPU and Memory."
+            )
+
+        self.cache_security_group = ec2.SecurityGroup(
+            "CacheSecurityGroup",
+            GroupDescription="Cache security group",
+            SecurityGroupIngress=[
+                ec2.SecurityGroupRule(  # redis
+                    IpProtocol="tcp",
+                    FromPort=6379,
+                    ToPort=6379,
+                    SourceSecurityGroupId=Ref(loadbalancer.instance_security_group)
+                )
+            ],
+            SecurityGroupEgress=[  # disallow outgoing connections
+                {
+                    "CidrIp": "127.0.0.1/32",
+                    "IpProtocol": "-1"
+                }
+            ],
+            VpcId=Ref(vpc.vpc),
+            Tags=Tags(
+                Name=Join("", [Ref("AWS::StackName"), " Redis security group"]),
+            ),
+        )
+
+        self.cache_subnet_group = elasticache.SubnetGroup(
+            "CacheSubnetGroup",
+            Description="Cache Subnet group",
+            SubnetIds=[Ref(subnet) for subnet in vpc.data_subnets],
+        )
+
+        if shards is None:
+            group = dict(
+                NumCacheClusters=replicas + 1,
+                AutomaticFailoverEnabled=replicas > 0,
+                MultiAZEnabled=replicas > 0,
+            )
+        else:
+            # cluster mode always fails over, shards are spread over the subnets
+            group = dict(
+                NumNodeGroups=shards,
+                ReplicasPerNodeGroup=replicas,
+                AutomaticFailoverEnabled=True,
+                MultiAZEnabled=replicas > 0,
+                CacheParameterGroupName="default.redis7.cluster.on",
+            )
+
+        self.replication_group = elasticache.ReplicationGroup(
+            "Cache",
+            ReplicationGroupDescription=Join("", [Ref("AWS::StackName"), " Redis"]),
+            Engine="redis",
+            EngineVersion="7.0",
+            CacheNodeType=node_type or Ref(self.cache_node_type),
+            CacheSubnetGroupName=Ref(self.cache_subnet_group),
+            SecurityGroupIds=[Ref(self.cache_security_group)],
+            AtRestEncryptionEnabled=True,
+            TransitEncryptionEnabled=transit_encryption,
+            Tags=Tags(
+                Name=Ref("AWS::StackName")
+            ),
+            **group
+        )
+
+        if shards is None:
+            self.primary_endpoint = Output(
+                "CachePrimaryEndpoint",
+                Description="Redis endpoint for reads and writes",
+                Value=GetAtt(self.replication_group, "PrimaryEndPoint.Address")
+            )
+            self.reader_endpoint = Output(
+                "CacheReaderEndpoint",
+                Description="Redis endpoint for reads, spread over the replicas",
+                Value=GetAtt(self.replication_group, "ReaderEndPoint.Address")
+            )
+        else:
+            self.configuration_endpoint = Output(
+                "CacheConfigurationEndpoint",
+                Description="Redis cluster endpoint, clients discover primaries and replicas from it",
+                Value=GetAtt(self.replication_group, "ConfigurationEndPoint.Address")
+            )
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+
+from troposphere import BaseAWSObject, Output, Parameter
+
+
+class Entry(object):
+    __slots__ = ("logical_id", "resource_type", "name", "component", "value")
+
+    def __init__(self, logical_id, resource_type, name, component, value):
+        self.logical_id = logical_id
+        self.resource_type = resource_type
+        self.name = name
+        self.component = component
+        self.value = value
+
+    def __repr__(self):
+        return "Entry({!r}, {!r})".format(self.logical_id, self.resource_type)
+
+
+def resource_type(value):
+    """
+    AWS resource type of a troposphere object, "Parameter" or "Output" for those declarations.
+    """
+    return getattr(value, "resource_type", None) or type(value).__name__
+
+
+class Registry(object):
+    """
+    Template objects (resources, parameters, outputs) in insertion order,
+    indexed by logical ID and by resource type, and the conditions and rules they use.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._by_type = {}
+        self._conditions = OrderedDict()
+        self._rules = OrderedDict()
+
+    def add(self, value, name=None, component=None):
+        """
+        :type value BaseAWSObject
+        :type name str attribute name on the component
+        :type component Component
+        """
+        self.check(value)
+        logical_id = value.title
+        entry = Entry(logical_id, resource_type(value), name, component, value)
+        self._entries[logical_id] = entry
+        self._by_type.setdefault(entry.resource_type, OrderedDict())[logical_id] = entry
+        return value
+
+    def check(self, value):
+        """
+        Raises the ValueError add() would for a duplicate logical ID.
+
+        :type value BaseAWSObject
+        """
+        if value.title in self._entries:
+            existing = self._entries[value.title]
+            raise ValueError('duplicate key "{}" detected ({} already registered by {})'.format(
+                value.title, existing.resource_type, type(existing.component).__name__
+            ))
+
+    def add_condition(self, name, condition):
+        """
+        :type name str condition name used in Condition/Fn::If
+        :type condition AWSHelperFn e.g. Equals(...)
+        """
+        if name in self._conditions:
+            raise ValueError('duplicate condition "{}" detected'.format(name))
+        self._conditions[name] = condition
+        return name
+
+    def conditions(self):
+        return list(self._conditions.items())
+
+    def add_rule(self, name, rule):
+        """
+        :type name str rule name
+        :type rule dict "Assertions" and an optional "RuleCondition" on parameter values
+        """
+        if name in self._rules:
+            raise ValueError('duplicate rule "{}" detected'.format(name))
+        self._rules[name] = rule
+        return name
+
+    def rules(self):
+        return list(self._rules.items())
+
+    def remove(self, logical_id):
+        entry = self._entries.pop(logical_id)
+        del self._by_type[entry.resource_type][logical_id]
+        return entry.value
+
+    def entry(self, logical_id):
+        return self._entries[logical_id]
+
+    def __getitem__(self, logical_id):
+        return self._entries[logical_id].value
+
+    def __contains__(self, logical_id):
+        return logical_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (entry.value for entry in self._entries.values())
+
+    def entries(self):
+        return list(self._entries.values())
+
+    def of_type(self, resource_type):
+        """
+        :type resource_type str e.g. "AWS::EC2::SecurityGroup"
+        """
+        return [entry.value for entry in self._by_type.get(resource_type, {}).values()]
+
+    def types(self):
+        return [key for key, entries in self._by_type.items() if entries]
+
+    def add_to_template(self, template):
+        """
+        :type template troposphere.Template
+        """
+        for name, condition in self._conditions.items():
+            template.add_condition(name, condition)
+        for name, rule in self._rules.items():
+            template.add_rule(name, rule)
+        for value in self:
+            if isinstance(value, Parameter):
+                template.add_parameter(value)
+            elif isinstance(value, Output):
+                template.add_output(value)
+            else:
+                template.add_resource(value)
+        return template
+
+
+class Component(object):
+    """
+    Base class for stack components: every troposphere object assigned as an
+    attribute is registered in the (possibly shared) registry under its logical ID.
+    """
+
+    def __init__(self, registry=None):
+        object.__setattr__(self, "registry", Registry() if registry is None else registry)
+        object.__setattr__(self, "_attributes", OrderedDict())
+
+    def __setattr__(self, key, value):
+        old = self._attributes.get(key)
+        if not isinstance(value, BaseAWSObject):
+            if old is not None:
+                self.registry.remove(old.title)
+                del self._attributes[key]
+            object.__setattr__(self, key, value)
+            return
+        # a duplicate must leave the registry and the component as they were
+        if old is None or old.title != value.title:
+            self.registry.check(value)
+        if old is not None:
+            self.registry.remove(old.title)
+        self.registry.add(value, name=key, component=self)
+        self._attributes[key] = value
+        self.__dict__.pop(key, None)  # would hide the registered value from __getattr__
+
+    def __getattr__(self, key):
+        try:
+            return self.__dict__["_attributes"][key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __iter__(self):
+        return iter(self._attributes)
+
+    def values(self):
+        return list(self._attributes.values())
@@ -1,16 +1,55 @@
-from troposphere import GetAZs, Join, Ref, Select, Tags
+from troposphere import GetAZs, GetAtt, Join, Ref, Select, Tags
 from troposphere import ec2
 
-from magicdict import MagicDict
+from common.subnets import Subnet, by_tier
+from registry import Component
 
+NETWORK = "172.1.0.0/16"
+SUBNETS = [
+    Subnet("public", 0, "172.1.128.0/24"),
+    Subnet("public", 1, "172.1.129.0/24"),
+    Subnet("private", 0, "172.1.1.0/24"),
+    Subnet("private", 1, "172.1.2.0/24"),
+]
+GATEWAY_ENDPOINTS = {
+    "dynamodb": "DynamoDB",
+}
+# interface endpoint service name: logical ID part
+INTERFACE_ENDPOINTS = {
+    "logs": "Logs",
+    "ssm": "SSM",
+    "ssmmessages": "SSMMessages",
+    "ec2messages": "EC2Messages",
+    "secretsmanager": "SecretsManager",
+    "ecr.api": "ECRApi",
+    "ecr.dkr": "ECRDocker",
+}
 
-class VPC(MagicDict):
-    def __init__(self):
-        super(VPC, self).__init__()
+
+class VPC(Component):
+    def __init__(self, registry=None, nat_gateways=False, endpoints=(), network=NETWORK, subnets=SUBNETS):
+        """
+        :type nat_gateways bool internet egress for the private subnets through a NAT gateway
+            in each AZ, every private subnet routing to the one in its own AZ
+        :type endpoints list[str] AWS services reached from the private subnets through VPC endpoints
+            instead of the internet, see GATEWAY_ENDPOINTS and INTERFACE_ENDPOINTS (S3 is always there)
+        :type network str VPC CIDR
+        :type subnets list[subnets.Subnet] public and private subnets in every AZ, optionally data
+            subnets (no internet access) for the database and cache; see subnets.plan()
+        """
+        super(VPC, self).__init__(registry)
+
+        unknown = set(endpoints) - set(GATEWAY_ENDPOINTS) - set(INTERFACE_ENDPOINTS)
+        if unknown:
+            raise ValueError("unknown VPC endpoints: {}".format(", ".join(sorted(unknown))))
+        zones = len(by_tier(subnets, "private"))
+        if zones < 2 or len(by_tier(subnets, "public")) != zones:
+            raise ValueError("public and private subnets are needed in the same two or more AZs")
+        self.network = network
 
         self.vpc = ec2.VPC(
             "VPC",
-            CidrBlock="172.1.0.0/16",
+            CidrBlock=network,
             InstanceTenancy="default",
             EnableDnsSupport=True,
             EnableDnsHostnames=True,
@@ -48,11 +87,35 @@ class VPC(MagicDict):
             ),
         )
 
+        # one per AZ with NAT gateways, the first one is shared by all AZs without them
+        private_route_tables = [self.private_route_table]
+        for number in range(2, zones + 1) if nat_gateways else ():
+            route_table = ec2.RouteTable(
+                "PrivateRouteTable{}".format(number),
+                VpcId=Ref(self.vpc),
+                Tags=Tags(
+                    Name=Join("-", [Ref("AWS::StackName"), "private-route-table-{}".format(number)]),
+                ),
+            )
+            setattr(self, "private_route_table_{}".format(number), route_table)
+            private_route_tables.append(route_table)
+
+        route_tables = [self.public_route_table] + private_route_tables
+        if by_tier(subnets, "data"):
+            self.data_route_table = ec2.RouteTable(
+                "DataRouteTable",
+                VpcId=Ref(self.vpc),
+                Tags=Tags(
+                    Name=Join("-", [Ref("AWS::StackName"), "data-route-table"]),
+                ),
+            )
+            route_tables.append(self.data_route_table)
+
         self.vpc_s3_endpoint = ec2.VPCEndpoint(
             "VPCS3Endpoint",
             ServiceName=Join("", ["com.amazonaws.", Ref("AWS::Region"), ".s3"]),
             VpcId=Ref(self.vpc),
-            RouteTableIds=[Ref(self.public_route_table), Ref(self.private_route_table)],
+            RouteTableIds=[Ref(table) for table in route_tables],
         )
 
         self.route_to_internet = ec2.Route(
@@ -63,42 +126,6 @@ class VPC(MagicDict):
             DependsOn=self.internet_gateway_attachment.title,
         )
 
-        # private subnets
-
-        self.private_subnet_1 = ec2.Subnet(
-            "PrivateSubnet1",
-            AvailabilityZone=Select(0, GetAZs()),
-            CidrBlock="172.1.1.0/24",
-            MapPublicIpOnLaunch=False,
-            Tags=Tags(
-                Name=Join("", [Ref("AWS::StackName"), "-private-subnet-1"]),
-            ),
-            VpcId=Ref(self.vpc),
-        )
-
-        self.private_subnet_1_route_table_association = ec2.SubnetRouteTableAssociation(
-            "PrivateSubnet1RouteTableAssociation",
-            RouteTableId=Ref(self.private_route_table),
-            SubnetId=Ref(self.private_subnet_1),
-        )
-
-        self.private_subnet_2 = ec2.Subnet(
-            "PrivateSubnet2",
-            AvailabilityZone=Select(1, GetAZs()),
-            CidrBlock="172.1.2.0/24",
-            MapPublicIpOnLaunch=False,
-            Tags=Tags(
-                Name=Join("", [Ref("AWS::StackName"), "-private-subnet-2"]),
-            ),
-            VpcId=Ref(self.vpc),
-        )
-
-        self.private_subnet_2_route_table_association = ec2.SubnetRouteTableAssociation(
-            "PrivateSubnet2RouteTableAssociation",
-            RouteTableId=Ref(self.private_route_table),
-            SubnetId=Ref(self.private_subnet_2),
-        )
-
         self.private_network_aCL = ec2.NetworkAcl(
             "PrivateNetworkACL",
             VpcId=Ref(self.vpc),
@@ -107,21 +134,9 @@ class VPC(MagicDict):
             ),
         )
 
-        self.private_subnet_1_network_acl_association = ec2.SubnetNetworkAclAssociation(
-            "PrivateSubnet1NetworkAclAssociation",
-            SubnetId=Ref(self.private_subnet_1),
-            NetworkAclId=Ref(self.private_network_aCL),
-        )
-
-        self.private_subnet_2_network_acl_association = ec2.SubnetNetworkAclAssociation(
-            "PrivateSubnet2NetworkAclAssociation",
-            SubnetId=Ref(self.private_subnet_2),
-            NetworkAclId=Ref(self.private_network_aCL),
-        )
-
         self.private_network_acl_entry_in = ec2.NetworkAclEntry(
             "PrivateNetworkAclEntryIn",
-            CidrBlock="172.1.0.0/16",
+            CidrBlock=network,
             Egress=False,
             NetworkAclId=Ref(self.private_network_aCL),
             Protocol=-1,
@@ -131,7 +146,7 @@ class VPC(MagicDict):
 
         self.private_network_acl_entry_out = ec2.NetworkAclEntry(
             "PrivateNetworkAclEntryOut",
-            CidrBlock="172.1.0.0/16",
+            CidrBlock=network,
             Egress=True,
             NetworkAclId=Ref(self.private_network_aCL),
             Protocol=-1,
@@ -139,38 +154,153 @@ class VPC(MagicDict):
             RuleNumber=200,
         )
 
-        # public subnets
-        self.public_subnet_1 = ec2.Subnet(
-            "PublicSubnet1",
-            AvailabilityZone=Select(0, GetAZs()),
-            CidrBlock="172.1.128.0/24",
-            MapPublicIpOnLaunch=True,
+        self.public_subnets = [
+            self._subnet(subnet, self.public_route_table) for subnet in by_tier(subnets, "public")
+        ]
+        self.private_subnets = [
+            self._subnet(subnet, private_route_tables[subnet.zone % len(private_route_tables)])
+            for subnet in by_tier(subnets, "private")
+        ]
+        # the database and cache use the private subnets without a data tier
+        self.data_subnets = [
+            self._subnet(subnet, self.data_route_table) for subnet in by_tier(subnets, "data")
+        ] or self.private_subnets
+
+        if nat_gateways:
+            self._nat_gateways(private_route_tables)
+        if nat_gateways or set(endpoints) & set(GATEWAY_ENDPOINTS):
+            self._private_acl_to_internet()
+        for name in sorted(endpoints):
+            self._endpoint(name, private_route_tables)
+
+    def _subnet(self, subnet, route_table):
+        """
+        Subnet with its route table association, and network ACL association
+        unless it is public. Registered as e.g. private_subnet_1 (PrivateSubnet1).
+
+        :type subnet subnets.Subnet
+        :rtype ec2.Subnet
+        """
+        number = subnet.zone + 1
+        name = "{}_subnet_{}".format(subnet.tier, number)
+        title = "{}Subnet{}".format(subnet.tier.capitalize(), number)
+
+        resource = ec2.Subnet(
+            title,
+            AvailabilityZone=Select(subnet.zone, GetAZs()),
+            CidrBlock=subnet.cidr,
+            MapPublicIpOnLaunch=subnet.tier == "public",
             Tags=Tags(
-                Name=Join("", [Ref("AWS::StackName"), "-public-subnet-1"]),
+                Name=Join("", [Ref("AWS::StackName"), "-{}-subnet-{}".format(subnet.tier, number)]),
             ),
             VpcId=Ref(self.vpc),
         )
+        setattr(self, name, resource)
 
-        self.public_subnet_1_route_table_association = ec2.SubnetRouteTableAssociation(
-            "PublicSubnet1RouteTableAssociation",
-            RouteTableId=Ref(self.public_route_table),
-            SubnetId=Ref(self.public_subnet_1),
+        setattr(self, name + "_route_table_association", ec2.SubnetRouteTableAssociation(
+            title + "RouteTableAssociation",
+            RouteTableId=Ref(route_table),
+            SubnetId=Ref(resource),
+        ))
 
-        )
+        if subnet.tier != "public":
+            setattr(self, name + "_network_acl_association", ec2.SubnetNetworkAclAssociation(
+                title + "NetworkAclAssociation",
+                SubnetId=Ref(resource),
+                NetworkAclId=Ref(self.private_network_aCL),
+            ))
+        return resource
 
-        self.public_subnet_2 = ec2.Subnet(
-            "PublicSubnet2",
-            AvailabilityZone=Select(1, GetAZs()),
-            CidrBlock="172.1.129.0/24",
-            MapPublicIpOnLaunch=True,
-            Tags=Tags(
-                Name=Join("", [Ref("AWS::StackName"), "-public-subnet-2"]),
-            ),
-            VpcId=Ref(self.vpc),
+    def _nat_gateways(self, private_route_tables):
+        for number, (subnet, route_table) in enumerate(zip(self.public_subnets, private_route_tables), 1):
+            eip = ec2.EIP(
+                "NatGateway{}EIP".format(number),
+                Domain="vpc",
+                DependsOn=self.internet_gateway_attachment.title,
+            )
+            setattr(self, "nat_gateway_{}_eip".format(number), eip)
+
+            nat_gateway = ec2.NatGateway(
+                "NatGateway{}".format(number),
+                AllocationId=GetAtt(eip, "AllocationId"),
+                SubnetId=Ref(subnet),
+                Tags=Tags(
+                    Name=Join("", [Ref("AWS::StackName"), "-nat-gateway-", str(number)]),
+                ),
+            )
+            setattr(self, "nat_gateway_{}".format(number), nat_gateway)
+
+            setattr(self, "private_route_to_internet_{}".format(number), ec2.Route(
+                "PrivateRouteToInternet{}".format(number),
+                DestinationCidrBlock="0.0.0.0/0",
+                NatGatewayId=Ref(nat_gateway),
+                RouteTableId=Ref(route_table),
+            ))
+
+    def _private_acl_to_internet(self):
+        # the private network ACL only allows traffic within the VPC; NAT gateway and gateway
+        # endpoint traffic has public destinations, so connections out and their responses are let through
+        self.private_network_acl_entry_public_in = ec2.NetworkAclEntry(
+            "PrivateNetworkAclEntryPublicIn",
+            CidrBlock="0.0.0.0/0",
+            Egress=False,
+            NetworkAclId=Ref(self.private_network_aCL),
+            Protocol=6,
+            PortRange=ec2.PortRange(From=1024, To=65535),
+            RuleAction="allow",
+            RuleNumber=300,
         )
 
-        self.public_subnet_2_route_table_association = ec2.SubnetRouteTableAssociation(
-            "PublicSubnet2RouteTableAssociation",
-            RouteTableId=Ref(self.public_route_table),
-            SubnetId=Ref(self.public_subnet_2),
+        self.private_network_acl_entry_public_out = ec2.NetworkAclEntry(
+            "PrivateNetworkAclEntryPublicOut",
+            CidrBlock="0.0.0.0/0",
+            Egress=True,
+            NetworkAclId=Ref(self.private_network_aCL),
+            Protocol=-1,
+            RuleAction="allow",
+            RuleNumber=300,
         )
+
+    def _endpoint(self, name, private_route_tables):
+        """
+        :type name str service name without the com.amazonaws.<region> prefix
+        """
+        service = Join("", ["com.amazonaws.", Ref("AWS::Region"), "." + name])
+        if name in GATEWAY_ENDPOINTS:
+            setattr(self, "vpc_{}_endpoint".format(name), ec2.VPCEndpoint(
+                "VPC{}Endpoint".format(GATEWAY_ENDPOINTS[name]),
+                ServiceName=service,
+                VpcId=Ref(self.vpc),
+                RouteTableIds=[Ref(table) for table in private_route_tables] + (
+                    [Ref(self.data_route_table)] if self.data_subnets is not self.private_subnets else []
+                ),
+            ))
+            return
+
+        if getattr(self, "vpc_endpoint_security_group", None) is None:  # shared by all interface endpoints
+            self.vpc_endpoint_security_group = ec2.SecurityGroup(
+                "VPCEndpointSecurityGroup",
+                GroupDescription="Interface VPC endpoint security group",
+                SecurityGroupIngress=[
+                    ec2.SecurityGroupRule(
+                        IpProtocol="tcp",
+                        FromPort=443,
+                        ToPort=443,
+                        CidrIp=self.network,
+                    ),
+                ],
+                VpcId=Ref(self.vpc),
+                Tags=Tags(
+                    Name=Join("", [Ref("AWS::StackName"), " VPC endpoint security group"]),
+                ),
+            )
+
+        setattr(self, "vpc_{}_endpoint".format(name.replace(".", "_")), ec2.VPCEndpoint(
+            "VPC{}Endpoint".format(INTERFACE_ENDPOINTS[name]),
+            ServiceName=service,
+            VpcId=Ref(self.vpc),
+            VpcEndpointType="Interface",
+            PrivateDnsEnabled=True,
+            SubnetIds=[Ref(subnet) for subnet in self.private_subnets],
+            SecurityGroupIds=[Ref(self.vpc_endpoint_security_group)],
+        ))
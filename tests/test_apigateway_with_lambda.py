@@ -0,0 +1,39 @@
+import os
+import runpy
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def build_template():
+    namespace = runpy.run_path(os.path.join(ROOT, "src", "apigateway_with_lambda.py"), run_name="__template__")
+    return namespace["build_template"]
+
+
+def test_http_stage_waits_for_throttled_routes(build_template):
+    resources = build_template(
+        api_type="http", methods={"GET /{param1}": {"rate_limit": 100, "burst_limit": 200}}
+    ).to_dict()["Resources"]
+    routes = sorted(name for name, resource in resources.items() if resource["Type"] == "AWS::ApiGatewayV2::Route")
+    stage = resources["APIStage"]
+    assert routes
+    assert "GET /{param1}" in stage["Properties"]["RouteSettings"]
+    assert sorted(stage["DependsOn"]) == routes
+
+
+def test_http_api_has_no_cache(build_template):
+    with pytest.raises(ValueError, match="no cache"):
+        build_template(api_type="http", methods={"GET /{param1}": {"cache_ttl": 60}})
+
+
+def test_version_follows_function_configuration(build_template):
+    def description(**options):
+        resources = build_template(provisioned_concurrency=True, **options).to_dict()["Resources"]
+        return resources["LambdaVersion"]["Properties"]["Description"]["Fn::Join"][1]
+
+    refs = [part["Ref"] for part in description() if isinstance(part, dict)]
+    assert {"LambdaFileName", "LambdaMemorySize", "LambdaArchitecture", "LambdaRuntime"} <= set(refs)
+    # literal properties only show up in the hash
+    assert description()[0] != description(tracing=True)[0]
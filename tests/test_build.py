@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from tools.build import ROOT, Job, discover, parse_options, render
+
+
+def test_parse_options():
+    assert parse_options([
+        'vpc.network="10.0.0.0/16"',
+        "vpc.zones=3",
+        "vpc_with_ec2.warm_pool={\"state\": \"Running\"}",
+        "elb_with_proxy_protocol.ports=[80,443]",
+        "apigateway_with_lambda.stage_name=v1",  # plain strings need no quotes
+        "apigateway_with_lambda.tracing=true",
+    ]) == {
+        "vpc": {"network": "10.0.0.0/16", "zones": 3},
+        "vpc_with_ec2": {"warm_pool": {"state": "Running"}},
+        "elb_with_proxy_protocol": {"ports": [80, 443]},
+        "apigateway_with_lambda": {"stage_name": "v1", "tracing": True},
+    }
+
+
+def test_parse_options_value_with_equals():
+    assert parse_options(["vpc.name=a=b"]) == {"vpc": {"name": "a=b"}}
+
+
+@pytest.mark.parametrize("definition", ["vpc", "vpc.zones", "vpc.=3", "zones=3"])
+def test_parse_options_malformed(definition):
+    with pytest.raises(ValueError, match="expected template.option=value"):
+        parse_options([definition])
+
+
+def test_render_records_dependencies():
+    jobs = dict((job.name, job) for job in discover())
+    for _ in range(2):  # shared modules are recorded again by the next render
+        result = render(jobs["vpc"]._replace(options={"zones": 3}))
+        dependencies = [os.path.relpath(path, ROOT) for path in result.dependencies]
+        assert os.path.join("src", "vpc.py") in dependencies
+        assert os.path.join("src", "common", "subnets.py") in dependencies
+    assert '"172.22.0.0/16"' in result.body
+
+
+def test_render_error_is_chained(tmp_path):
+    source = tmp_path / "broken.py"
+    source.write_text("def build_template():\n    raise KeyError('AMIMap')\n")
+    with pytest.raises(RuntimeError, match="broken: KeyError: 'AMIMap'") as raised:
+        render(Job("broken", str(source)))
+    assert isinstance(raised.value.__cause__, KeyError)
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from tools import cache as cache_module
+from tools.cache import Cache
+
+
+@pytest.fixture
+def dependency(tmp_path):
+    path = tmp_path / "template.py"
+    path.write_text("VALUE = 1\n")
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return Cache(str(tmp_path / "cache"))
+
+
+def test_hit_after_put(cache, dependency):
+    assert cache.get("vpc") is None
+    cache.put("vpc", "{}", [dependency], {"format": "json"})
+    assert cache.get("vpc", {"format": "json"}) == "{}"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_survives_a_new_instance(cache, dependency):
+    cache.put("vpc", "{}", [dependency])
+    cache.save()
+    assert Cache(cache.directory).get("vpc") == "{}"
+
+
+def test_changed_dependency(cache, dependency):
+    cache.put("vpc", "{}", [dependency])
+    with open(dependency, "w") as f:
+        f.write("VALUE = 2\n")
+    assert Cache(cache.directory).get("vpc") is None  # a new build hashes the files again
+
+
+def test_removed_dependency(cache, dependency, tmp_path):
+    cache.put("vpc", "{}", [dependency])
+    cache.save()
+    (tmp_path / "template.py").unlink()
+    assert Cache(cache.directory).get("vpc") is None
+
+
+@pytest.mark.parametrize("params", [
+    {"format": "compact"},
+    {"format": "json", "options": {"network": "10.0.0.0/16"}},
+    None,
+])
+def test_changed_params(cache, dependency, params):
+    cache.put("vpc", "{}", [dependency], {"format": "json"})
+    assert cache.get("vpc", params) is None
+
+
+@pytest.mark.parametrize("library", ["troposphere", "awacs"])
+def test_changed_library_version(cache, dependency, monkeypatch, library):
+    cache.put("vpc", "{}", [dependency])
+    monkeypatch.setattr(getattr(cache_module, library), "__version__", "0.0.0")
+    assert cache.get("vpc") is None
+
+
+def test_least_recently_used_are_evicted(tmp_path, dependency):
+    cache = Cache(str(tmp_path / "cache"), max_bytes=20)
+    for name in ("first", "second", "third"):
+        cache.put(name, "x" * 10, [dependency])
+    assert cache.get("first") is not None  # now more recently used than second
+    cache.save()
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == 20
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.get("third") is not None
+
+
+def test_clear(cache, dependency):
+    cache.put("vpc", "{}", [dependency])
+    cache.save()
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+    assert os.listdir(cache.directory) == ["index.json"]
+    assert Cache(cache.directory).get("vpc") is None
@@ -0,0 +1,30 @@
+import os
+import runpy
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def build_template():
+    namespace = runpy.run_path(os.path.join(ROOT, "src", "elb_with_proxy_protocol.py"), run_name="__template__")
+    return namespace["build_template"]
+
+
+@pytest.mark.parametrize("ports, description", [
+    (["80"], "80"),
+    ([80, 443], "80 and 443"),  # -D values are parsed as JSON
+    ([80, "443", 8080], "80 and 443 and 8080"),
+])
+def test_ports(build_template, ports, description):
+    data = build_template(ports).to_dict()
+    assert data["Description"] == "ELB with Proxy Protocol enabled for ports " + description
+    assert data["Resources"]["ElasticLoadBalancer"]["Properties"]["Policies"][0]["InstancePorts"] == [
+        str(port) for port in ports
+    ]
+
+
+def test_no_ports(build_template):
+    with pytest.raises(ValueError, match="at least one port"):
+        build_template([])
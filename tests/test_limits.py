@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from tools import limits
+
+
+def body(resources=0, parameters=0, outputs=0, mappings=0, padding=0):
+    data = {
+        "Resources": dict(("R{}".format(i), {"Type": "AWS::SNS::Topic"}) for i in range(resources)),
+        "Parameters": dict(("P{}".format(i), {"Type": "String"}) for i in range(parameters)),
+        "Outputs": dict(("O{}".format(i), {"Value": "x"}) for i in range(outputs)),
+        "Mappings": dict(("M{}".format(i), {"k": {"v": "x"}}) for i in range(mappings)),
+        "Description": "x" * padding,
+    }
+    return json.dumps(data)
+
+
+def test_usage():
+    used = limits.usage(body(resources=3, parameters=2, outputs=1))
+    assert (used.resources, used.parameters, used.outputs, used.mappings) == (3, 2, 1, 0)
+    assert used.bytes == len(body(resources=3, parameters=2, outputs=1))
+
+
+def test_usage_counts_encoded_bytes():
+    text = json.dumps({"Description": "é"}, ensure_ascii=False)
+    assert limits.usage(text).bytes == len(text) + 1
+
+
+def test_usage_yaml():
+    used = limits.usage("Resources:\n  Topic:\n    Type: AWS::SNS::Topic\n", fmt="yaml")
+    assert used.resources == 1
+
+
+def test_within_limits():
+    assert limits.violations(limits.usage(body(resources=500, parameters=200, outputs=200, mappings=200))) == []
+
+
+@pytest.mark.parametrize("counts, violation", [
+    ({"resources": 501}, "resources 501 > 500"),
+    ({"parameters": 201}, "parameters 201 > 200"),
+    ({"outputs": 201}, "outputs 201 > 200"),
+    ({"mappings": 201}, "mappings 201 > 200"),
+])
+def test_count_limits(counts, violation):
+    assert limits.violations(limits.usage(body(**counts))) == [violation]
+
+
+def test_body_limits():
+    used = limits.usage(body(padding=limits.BODY_LIMITS["inline"]))
+    assert limits.violations(used) == ["template body bytes {} > 51200".format(used.bytes)]
+    assert limits.violations(used, body_limit="s3") == []
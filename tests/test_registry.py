@@ -0,0 +1,88 @@
+import pytest
+from troposphere import Equals, Output, Parameter, Ref, Template, ec2
+
+from vpc_with_ec2.registry import Component, Registry
+
+
+def security_group(title):
+    return ec2.SecurityGroup(title, GroupDescription=title)
+
+
+class Example(Component):
+    def __init__(self, registry=None):
+        super(Example, self).__init__(registry)
+        self.parameter = Parameter("Size", Type="Number")
+        self.first = security_group("First")
+        self.vpc = ec2.VPC("Network", CidrBlock="10.0.0.0/16")
+        self.second = security_group("Second")
+        self.output = Output("SecondId", Value=Ref(self.second))
+
+
+def test_insertion_order_and_lookup():
+    component = Example()
+    assert [value.title for value in component.registry] == ["Size", "First", "Network", "Second", "SecondId"]
+    assert list(component) == ["parameter", "first", "vpc", "second", "output"]
+    assert component.registry["Network"] is component.vpc
+    assert component.registry.entry("First").name == "first"
+    assert component.registry.entry("First").component is component
+
+
+def test_of_type():
+    registry = Example().registry
+    assert [value.title for value in registry.of_type("AWS::EC2::SecurityGroup")] == ["First", "Second"]
+    assert [value.title for value in registry.of_type("Parameter")] == ["Size"]
+    assert registry.of_type("AWS::EC2::Subnet") == []
+    assert registry.types() == ["Parameter", "AWS::EC2::SecurityGroup", "AWS::EC2::VPC", "Output"]
+
+
+def test_duplicate_logical_id():
+    registry = Registry()
+    Example(registry)
+    with pytest.raises(ValueError, match=r'duplicate key "Size" detected \(Parameter already registered by Example\)'):
+        Example(registry)
+
+
+def test_reassignment_replaces_the_entry():
+    component = Example()
+    replacement = security_group("Replacement")
+    component.first = replacement
+    assert "First" not in component.registry
+    assert component.first is replacement
+    assert component.registry.of_type("AWS::EC2::SecurityGroup") == [component.second, replacement]
+
+    same_title = security_group("Second")
+    component.second = same_title
+    assert component.registry["Second"] is same_title
+
+
+def test_failed_reassignment_keeps_the_old_value():
+    component = Example()
+    first = component.first
+    with pytest.raises(ValueError, match="duplicate key"):
+        component.first = security_group("Second")
+    assert component.first is first
+    assert component.registry["First"] is first
+    assert len(component.registry) == 5
+
+
+def test_plain_value_over_aws_object():
+    component = Example()
+    component.first = None
+    assert component.first is None
+    assert "First" not in component.registry
+    assert "first" not in list(component)
+
+    component.first = security_group("First")
+    assert component.first.title == "First"
+
+
+def test_add_to_template():
+    registry = Example().registry
+    registry.add_condition("Big", Equals(Ref("Size"), "10"))
+    with pytest.raises(ValueError, match="duplicate condition"):
+        registry.add_condition("Big", Equals(Ref("Size"), "10"))
+    data = registry.add_to_template(Template()).to_dict()
+    assert list(data["Parameters"]) == ["Size"]
+    assert list(data["Resources"]) == ["First", "Network", "Second"]
+    assert list(data["Outputs"]) == ["SecondId"]
+    assert list(data["Conditions"]) == ["Big"]
@@ -0,0 +1,71 @@
+import ipaddress
+
+import pytest
+
+from common.subnets import TIERS, by_tier, plan
+
+
+def networks(subnets):
+    return [ipaddress.ip_network(subnet.cidr) for subnet in subnets]
+
+
+@pytest.mark.parametrize("network, zones, sizes", [
+    ("10.0.0.0/16", 2, {"public": 24, "private": 20}),
+    ("172.1.0.0/16", 3, {"public": 24, "private": 22, "data": 24}),
+    ("10.0.0.0/20", 4, {"public": 28, "private": 24, "data": 26}),
+])
+def test_allocations_are_aligned(network, zones, sizes):
+    for subnet in plan(network, zones, sizes):
+        block = ipaddress.ip_network(subnet.cidr)  # strict, raises when host bits are set
+        assert block.prefixlen == sizes[subnet.tier]
+        assert block.subnet_of(ipaddress.ip_network(network))
+
+
+@pytest.mark.parametrize("zones", [1, 2, 3, 6])
+def test_no_overlap_across_tiers_and_zones(zones):
+    subnets = plan("10.0.0.0/16", zones, {"public": 24, "private": 20, "data": 23})
+    assert len(subnets) == 3 * zones
+    blocks = networks(subnets)
+    for i, block in enumerate(blocks):
+        for other in blocks[i + 1:]:
+            assert not block.overlaps(other)
+
+
+def test_one_subnet_per_tier_and_zone_in_order():
+    subnets = plan("10.0.0.0/16", 3, {"private": 20, "public": 24})
+    for tier in ("public", "private"):
+        assert [subnet.zone for subnet in by_tier(subnets, tier)] == [0, 1, 2]
+    assert [subnet.tier for subnet in subnets] == sorted((s.tier for s in subnets), key=TIERS.index)
+    assert by_tier(subnets, "data") == []
+
+
+def test_docstring_example():
+    subnets = plan("10.0.0.0/16", 2, {"public": 24, "private": 20})
+    assert [s.cidr for s in by_tier(subnets, "public")] == ["10.0.32.0/24", "10.0.33.0/24"]
+    assert [s.cidr for s in by_tier(subnets, "private")] == ["10.0.0.0/20", "10.0.16.0/20"]
+
+
+def test_network_too_small():
+    with pytest.raises(ValueError, match="need"):
+        plan("10.0.0.0/24", 2, {"public": 25, "private": 25, "data": 26})
+
+
+def test_exactly_full_network():
+    subnets = plan("10.0.0.0/24", 2, {"public": 26, "private": 26})
+    assert sum(block.num_addresses for block in networks(subnets)) == 256
+
+
+@pytest.mark.parametrize("prefix", [15, 29, 32])
+def test_prefix_out_of_bounds(prefix):
+    with pytest.raises(ValueError, match="between /16 and /28"):
+        plan("10.0.0.0/16", 2, {"public": prefix, "private": 24})
+
+
+def test_unknown_tier():
+    with pytest.raises(ValueError, match="unknown subnet tiers: dmz"):
+        plan("10.0.0.0/16", 2, {"public": 24, "dmz": 24})
+
+
+def test_no_zones():
+    with pytest.raises(ValueError, match="availability zone"):
+        plan("10.0.0.0/16", 0, {"public": 24})
@@ -0,0 +1,234 @@
+"""
+Template generation benchmarks.
+
+For every template build_template() and Template.to_json() are timed separately
+(best of --repeat runs), and peak memory of one full render is taken with
+tracemalloc. synthetic_xN entries repeat the vpc_with_ec2 components N times
+in one stack to show how generation scales with stack size.
+
+    python -m tools.benchmark [--repeat N] [--copies 10,50] [--save] [--threshold 0.25] [--timings] [name ...]
+
+--save stores the results as the baseline; later runs are compared against it
+and exit non-zero when a metric regresses by more than the threshold. Only the
+machine independent metrics (peak memory, resources, bytes) are compared unless
+--timings is given, wall-clock times only compare with a baseline from the same machine.
+"""
+import argparse
+import gc
+import json
+import os
+import runpy
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from troposphere import AWSHelperFn, BaseAWSObject, Parameter, Tags, Template
+
+from tools.build import ROOT, discover
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+METRICS = ["peak_bytes", "resources", "bytes"]
+TIMING_METRICS = ["construct_seconds", "serialize_seconds"]
+# ignore timing differences below this, they are noise for sub-millisecond templates
+MIN_SECONDS_DELTA = 0.0005
+
+
+def _best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(build_template, repeat):
+    """
+    :type build_template callable returning a Template
+    :rtype dict
+    """
+    template = build_template()
+    gc.collect()
+    construct = _best_time(build_template, repeat)
+    serialize = _best_time(template.to_json, repeat)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        build_template().to_json()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ("construct_seconds", construct),
+        ("serialize_seconds", serialize),
+        ("peak_bytes", peak),
+        ("resources", len(template.resources)),
+        ("bytes", len(template.to_json())),
+    ])
+
+
+def _retitle(value, titles):
+    # Ref/GetAtt/DependsOn keep logical IDs as strings, so they are renamed in place
+    if isinstance(value, Tags):
+        _retitle(value.tags, titles)
+    elif isinstance(value, AWSHelperFn):
+        _retitle(value.data, titles)
+    elif isinstance(value, BaseAWSObject):
+        _retitle(value.resource, titles)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key == "Ref" and item in titles:
+                value[key] = titles[item]
+            elif key == "Fn::GetAtt" and item[0] in titles:
+                item[0] = titles[item[0]]
+            elif key == "DependsOn":
+                value[key] = [titles.get(i, i) for i in item] if isinstance(item, list) else titles.get(item, item)
+            else:
+                _retitle(item, titles)
+    elif isinstance(value, list):
+        for item in value:
+            _retitle(item, titles)
+
+
+def synthetic_stack(namespace, copies):
+    """
+    vpc_with_ec2 with its VPC, LoadBalancer, Database and EC2 components repeated,
+    every copy after the first getting a numeric suffix on its logical IDs.
+
+    :type namespace dict globals of src/vpc_with_ec2/__main__.py
+    """
+    registry = namespace["Registry"]()
+    parameters = namespace["Parameters"](registry=registry)
+    template = Template()
+    for key, value in namespace["Mappings"]().mappings.items():
+        template.add_mapping(key, value)
+
+    for copy in range(copies):
+        copy_registry = registry if copy == 0 else namespace["Registry"]()
+        vpc = namespace["VPC"](registry=copy_registry)
+        elb = namespace["LoadBalancer"](vpc=vpc, registry=copy_registry)
+        namespace["Database"](parameters=parameters, vpc=vpc, loadbalancer=elb, registry=copy_registry)
+        namespace["EC2"](parameters=parameters, vpc=vpc, loadbalancer=elb, registry=copy_registry)
+        if copy:
+            values = list(copy_registry)
+            titles = dict((value.title, value.title + str(copy)) for value in values)
+            for value in values:
+                _retitle(value, titles)
+                value.title = titles[value.title]
+                registry.add(value)
+
+    for name, condition in registry.conditions():
+        template.add_condition(name, condition)
+    for value in registry:
+        if isinstance(value, Parameter):
+            template.add_parameter(value)
+        else:
+            # large copy counts go past the 500 resource quota on purpose, bypass the check
+            template.resources[value.title] = value
+    return template
+
+
+def load(job):
+    namespace = runpy.run_path(job.source, run_name="__template__")
+    if "build_template" not in namespace:
+        raise ValueError("{} has no build_template()".format(job.name))
+    return namespace
+
+
+def run(names=None, repeat=20, copies=(10, 50)):
+    results = OrderedDict()
+    for job in discover():
+        if names and job.name not in names:
+            continue
+        namespace = load(job)
+        results[job.name] = measure(namespace["build_template"], repeat)
+        if job.name == "vpc_with_ec2":
+            for count in copies:
+                results["synthetic_x{}".format(count)] = measure(
+                    lambda: synthetic_stack(namespace, count), max(1, repeat // count)
+                )
+    return results
+
+
+def compare(results, baseline, threshold, timings=False):
+    """
+    :type timings bool compare TIMING_METRICS too
+    :rtype list[str] metrics that got worse than baseline * (1 + threshold)
+    """
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric in METRICS + (TIMING_METRICS if timings else []):
+            before, after = baseline[name][metric], metrics[metric]
+            if metric.endswith("_seconds") and after - before < MIN_SECONDS_DELTA:
+                continue
+            if before and after > before * (1 + threshold):
+                regressions.append("{} {}: {:.6g} -> {:.6g} (+{:.0%})".format(
+                    name, metric, before, after, float(after) / before - 1
+                ))
+    return regressions
+
+
+def report(results, stream=sys.stdout):
+    width = max([len(name) for name in results] + [len("template")])
+    line = "{:<{w}}  {:>12}  {:>12}  {:>11}  {:>9}  {:>9}\n"
+    stream.write(line.format("template", "construct ms", "to_json ms", "peak KiB", "resources", "bytes", w=width))
+    for name, metrics in results.items():
+        stream.write(line.format(
+            name,
+            "{:.3f}".format(metrics["construct_seconds"] * 1000),
+            "{:.3f}".format(metrics["serialize_seconds"] * 1000),
+            "{:.1f}".format(metrics["peak_bytes"] / 1024.0),
+            metrics["resources"],
+            metrics["bytes"],
+            w=width,
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark template generation")
+    parser.add_argument("names", nargs="*", help="Templates to benchmark (default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="Timing runs per template, best is kept")
+    parser.add_argument("--copies", default="10,50",
+                        help="Comma separated sizes of the synthetic vpc_with_ec2 stacks (empty to skip)")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed relative regression against the baseline (default: %(default)s)")
+    parser.add_argument("--timings", action="store_true",
+                        help="Compare the timings too, for a baseline saved on this machine")
+    args = parser.parse_args(argv)
+
+    copies = [int(count) for count in args.copies.split(",") if count.strip()]
+    results = run(args.names, args.repeat, copies)
+    report(results)
+
+    if args.save:
+        directory = os.path.dirname(args.baseline)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+            f.write("\n")
+        print("baseline saved to {}".format(os.path.relpath(args.baseline)))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline at {}, run with --save to create one".format(os.path.relpath(args.baseline)))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.timings)
+    for regression in regressions:
+        sys.stderr.write("regression: {}\n".format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
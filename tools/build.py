@@ -0,0 +1,315 @@
+"""
+Renders every template from src/ into templates/ in a single interpreter.
+
+troposphere and awacs are imported once here, before the worker pool is
+started, so each template only pays for its own construction. Templates
+exposing build_template(**options) are rendered by calling it, so options
+can be passed with -D template.option=value (values are parsed as JSON).
+
+Every template is checked against the CloudFormation quotas in tools.limits;
+the build fails when one is crossed. --format compact writes minified,
+key-sorted JSON, --format yaml writes YAML.
+
+    python -m tools.build [--jobs N] [--output-dir DIR] [--format json|compact|yaml] [name ...]
+"""
+import argparse
+import glob
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+import time
+from collections import namedtuple
+from contextlib import redirect_stdout
+from functools import partial
+
+import cfn_flip
+
+import awacs  # noqa: F401
+import troposphere  # noqa: F401
+
+from tools import limits
+from tools.cache import CACHE_DIR, DEFAULT_MAX_BYTES, Cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(ROOT, "src")
+OUTPUT_DIR = os.path.join(ROOT, "templates")
+# code shared by several templates, imported as "common"
+SHARED_DIR = os.path.join(SOURCE_DIR, "common")
+FORMATS = {
+    "json": ".json",
+    "compact": ".json",
+    "yaml": ".yaml",
+}
+
+# appended, so a template's own modules (e.g. vpc_with_ec2/vpc.py) win over the src/*.py templates
+if SOURCE_DIR not in sys.path:
+    sys.path.append(SOURCE_DIR)
+
+Job = namedtuple("Job", ["name", "source", "options"])
+Job.__new__.__defaults__ = ({},)
+Result = namedtuple("Result", ["name", "body", "seconds", "dependencies", "cached", "usage"])
+
+_opened = None
+_hooked = False
+
+
+def discover(source_dir=SOURCE_DIR):
+    """
+    Same sources as the Makefile: src/*.py and src/*/__main__.py
+    """
+    jobs = []
+    for path in glob.glob(os.path.join(source_dir, "*.py")):
+        jobs.append(Job(os.path.splitext(os.path.basename(path))[0], path))
+    for path in glob.glob(os.path.join(source_dir, "*", "__main__.py")):
+        directory = os.path.dirname(path)
+        jobs.append(Job(os.path.basename(directory), directory))
+    return sorted(jobs)
+
+
+def _forget_modules(directory):
+    # templates split into packages use plain "from vpc import VPC" imports,
+    # so their modules must not leak into the next job run by this worker
+    directory = os.path.join(os.path.abspath(directory), "")
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(directory):
+            del sys.modules[name]
+
+
+def _record_open(event, args):
+    if event == "open" and _opened is not None and isinstance(args[0], str):
+        _opened.add(os.path.abspath(args[0]))
+
+
+def _dependencies(paths):
+    root = os.path.join(ROOT, "")
+    dependencies = set()
+    for path in paths:
+        if path.endswith(".pyc"):  # imported from bytecode, depend on the source instead
+            path = importlib.util.source_from_cache(path)
+        if path.startswith(root) and os.path.isfile(path):
+            dependencies.add(path)
+    return sorted(dependencies)
+
+
+def serialize(data, fmt="json"):
+    """
+    :type data dict template as returned by Template.to_dict()
+    :type fmt str one of FORMATS
+    """
+    if fmt == "json":  # same as Template.to_json()
+        return json.dumps(data, indent=4, sort_keys=True, separators=(",", ": ")) + "\n"
+    compact = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    if fmt == "compact":
+        return compact + "\n"
+    if fmt == "yaml":
+        return cfn_flip.to_yaml(compact)
+    raise ValueError("unknown format {!r}".format(fmt))
+
+
+def render(job, fmt="json"):
+    """
+    :type job Job
+    :type fmt str one of FORMATS
+    :rtype Result
+    """
+    global _opened, _hooked
+
+    if not _hooked:
+        # every file a template reads (sibling modules included) ends up in its cache key; audit hooks
+        # can not be removed, so only processes that render install one
+        sys.addaudithook(_record_open)
+        _hooked = True
+    # shared modules imported earlier (by another template or the caller) would not be opened again
+    # and go missing from this template's dependencies
+    _forget_modules(SHARED_DIR)
+    start = time.time()
+    _opened = set()
+    try:
+        namespace = runpy.run_path(job.source, run_name="__template__")
+        if "build_template" in namespace:
+            data = namespace["build_template"](**job.options).to_dict()
+        else:
+            if job.options:
+                raise TypeError("template does not accept options")
+            output = io.StringIO()
+            with redirect_stdout(output):
+                runpy.run_path(job.source, run_name="__main__")
+            data = json.loads(output.getvalue())
+        body = serialize(data, fmt)
+    except Exception as e:
+        raise RuntimeError("{}: {}: {}".format(job.name, type(e).__name__, e)) from e
+    finally:
+        opened, _opened = _opened, None
+        if os.path.isdir(job.source):
+            _forget_modules(job.source)
+    return Result(job.name, body, time.time() - start, _dependencies(opened), False, None)
+
+
+def _write(path, body):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    try:
+        with open(path) as f:
+            if f.read() == body:
+                return
+    except IOError:
+        pass
+    with open(path, "w") as f:
+        f.write(body)
+
+
+def build(jobs, output_dir=OUTPUT_DIR, processes=None, cache=None, fmt="json"):
+    """
+    Renders jobs across a process pool, writing each template as soon as it is done.
+    Templates found in the cache are written out without being rendered.
+
+    :type jobs list[Job]
+    :type cache Cache
+    :type fmt str one of FORMATS
+    :rtype list[Result]
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    params = {"format": fmt}
+    extension = FORMATS[fmt]
+
+    options = dict((job.name, job.options) for job in jobs)
+    done = []
+    if cache is not None:
+        pending = []
+        for job in jobs:
+            body = cache.get(job.name, dict(params, options=job.options))
+            if body is None:
+                pending.append(job)
+            else:
+                _write(os.path.join(output_dir, job.name + extension), body)
+                done.append(Result(job.name, body, 0.0, [], True, limits.usage(body, fmt)))
+        jobs = pending
+
+    if processes == 1 or len(jobs) <= 1:
+        pool = None
+        results = map(partial(render, fmt=fmt), jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(partial(render, fmt=fmt), jobs)
+
+    try:
+        for result in results:
+            _write(os.path.join(output_dir, result.name + extension), result.body)
+            if cache is not None:
+                cache.put(result.name, result.body, result.dependencies, dict(params, options=options[result.name]))
+            done.append(result._replace(usage=limits.usage(result.body, fmt)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if cache is not None:
+            cache.save()
+    return done
+
+
+def check(results, body_limit="inline"):
+    """
+    :type results list[Result]
+    :rtype list[str] quotas crossed by the templates
+    """
+    problems = []
+    for result in sorted(results):
+        for violation in limits.violations(result.usage, body_limit):
+            problems.append("{}: {}".format(result.name, violation))
+    return problems
+
+
+def report(results, seconds, stream=sys.stdout):
+    width = max([len(r.name) for r in results] + [len("template")])
+    line = "{:<{w}}  {:>9}  {:>9}  {:>9}  {:>10}  {:>7}\n"
+    stream.write(line.format("template", "seconds", "bytes", "resources", "parameters", "outputs", w=width))
+    for result in sorted(results, key=lambda r: r.seconds, reverse=True):
+        seconds_column = "cached" if result.cached else "{:.3f}".format(result.seconds)
+        stream.write(line.format(
+            result.name, seconds_column, result.usage.bytes, result.usage.resources,
+            result.usage.parameters, result.usage.outputs, w=width
+        ))
+    cached = len([r for r in results if r.cached])
+    stream.write("{} templates in {:.3f}s (cache: {} hits, {} misses)\n".format(
+        len(results), seconds, cached, len(results) - cached))
+
+
+def parse_options(definitions):
+    """
+    Turns ["vpc.network=\"10.0.0.0/16\""] into {"vpc": {"network": "10.0.0.0/16"}}
+    """
+    options = {}
+    for definition in definitions:
+        name, _, assignment = definition.partition(".")
+        key, equals, value = assignment.partition("=")
+        if not key or not equals:
+            raise ValueError("expected template.option=value, got {!r}".format(definition))
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass  # plain strings do not need quoting
+        options.setdefault(name, {})[key] = value
+    return options
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render CloudFormation templates from src/ into templates/")
+    parser.add_argument("names", nargs="*", help="Templates to render (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("-o", "--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("-q", "--quiet", action="store_true", help="Do not print the timing report")
+    parser.add_argument("-f", "--format", choices=sorted(FORMATS), default="json",
+                        help="json: indented like Template.to_json(), compact: minified JSON, yaml")
+    parser.add_argument("--body-limit", choices=sorted(limits.BODY_LIMITS), default="inline",
+                        help="inline: TemplateBody limit ({inline} bytes), s3: TemplateURL limit ({s3} bytes)".format(
+                            **limits.BODY_LIMITS))
+    parser.add_argument("--no-cache", action="store_true", help="Render every template, ignoring the build cache")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Build cache size cap in MB (default: %(default)s)")
+    parser.add_argument("-D", "--define", action="append", default=[], metavar="TEMPLATE.OPTION=VALUE",
+                        help="Keyword argument passed to the template's build_template()")
+    args = parser.parse_args(argv)
+
+    try:
+        options = parse_options(args.define)
+    except ValueError as e:
+        parser.error(str(e))
+
+    jobs = discover()
+    unknown = (set(args.names) | set(options)) - set(job.name for job in jobs)
+    if unknown:
+        parser.error("unknown templates: {}".format(", ".join(sorted(unknown))))
+    if args.names:
+        jobs = [job for job in jobs if job.name in args.names]
+    jobs = [job._replace(options=options.get(job.name, {})) for job in jobs]
+
+    cache = None if args.no_cache else Cache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+
+    start = time.time()
+    try:
+        results = build(jobs, output_dir=args.output_dir, processes=args.jobs, cache=cache, fmt=args.format)
+    except RuntimeError as e:
+        sys.stderr.write("build failed: {}\n".format(e))
+        return 1
+
+    if not args.quiet:
+        report(results, time.time() - start)
+
+    problems = check(results, args.body_limit)
+    for problem in problems:
+        sys.stderr.write("limit exceeded: {}\n".format(problem))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Content-hash cache for rendered templates.
+
+Each entry is keyed on the template name, the SHA-256 of every file the
+template read while it was last rendered (its own modules, sibling modules,
+data files), the troposphere/awacs versions and the build parameters.
+Entries are evicted least-recently-used once the cache grows past its size cap.
+
+    python -m tools.cache [stats|clear]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import awacs
+import troposphere
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(ROOT, ".build-cache")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Cache(object):
+    def __init__(self, directory=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}
+        self._index = self._load_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _load_index(self):
+        index = {"entries": {}, "dependencies": {}, "clock": 0, "hits": 0, "misses": 0}
+        try:
+            with open(self.index_path) as f:
+                index.update(json.load(f))
+        except (IOError, ValueError):
+            pass
+        return index
+
+    def _digest(self, relative_path):
+        if relative_path not in self._digests:
+            self._digests[relative_path] = file_digest(os.path.join(ROOT, relative_path))
+        return self._digests[relative_path]
+
+    def key(self, name, dependencies, params=None):
+        """
+        :type dependencies list[str] paths relative to the repository root
+        :type params dict build parameters that change the output
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            "name": name,
+            "troposphere": troposphere.__version__,
+            "awacs": awacs.__version__,
+            "python": list(sys.version_info[:2]),
+            "params": params or {},
+            "dependencies": [[path, self._digest(path)] for path in sorted(dependencies)],
+        }, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _tick(self):
+        self._index["clock"] += 1
+        return self._index["clock"]
+
+    def get(self, name, params=None):
+        """
+        Returns the cached body for the template, or None when it has to be rendered.
+        """
+        dependencies = self._index["dependencies"].get(name)
+        body = None
+        if dependencies is not None:
+            try:
+                key = self.key(name, dependencies, params)
+            except (IOError, OSError):  # a dependency was removed
+                key = None
+            if key in self._index["entries"]:
+                try:
+                    with open(os.path.join(self.directory, key + ".json")) as f:
+                        body = f.read()
+                except IOError:
+                    del self._index["entries"][key]
+                else:
+                    self._index["entries"][key]["used"] = self._tick()
+
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def put(self, name, body, dependencies, params=None):
+        """
+        :type dependencies list[str] absolute or repository-relative paths read while rendering
+        """
+        dependencies = sorted(set(os.path.relpath(path, ROOT) for path in dependencies))
+        self._index["dependencies"][name] = dependencies
+        key = self.key(name, dependencies, params)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(os.path.join(self.directory, key + ".json"), "w") as f:
+            f.write(body)
+        self._index["entries"][key] = {"name": name, "size": len(body), "used": self._tick()}
+
+    def evict(self):
+        entries = self._index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["used"]):
+            if total <= self.max_bytes:
+                break
+            total -= entries.pop(key)["size"]
+            try:
+                os.remove(os.path.join(self.directory, key + ".json"))
+            except OSError:
+                pass
+
+    def save(self):
+        self.evict()
+        self._index["hits"] += self.hits
+        self._index["misses"] += self.misses
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(self.index_path, "w") as f:
+            json.dump(self._index, f, indent=1, sort_keys=True)
+        self.hits = self.misses = 0
+
+    def clear(self):
+        for key in self._index["entries"]:
+            try:
+                os.remove(os.path.join(self.directory, key + ".json"))
+            except OSError:
+                pass
+        self._index.update(entries={}, dependencies={})
+        self.save()
+
+    def stats(self):
+        entries = self._index["entries"]
+        return {
+            "entries": len(entries),
+            "bytes": sum(entry["size"] for entry in entries.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self._index["hits"] + self.hits,
+            "misses": self._index["misses"] + self.misses,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the template build cache")
+    parser.add_argument("command", nargs="?", choices=["stats", "clear"], default="stats")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    cache = Cache(args.cache_dir)
+    if args.command == "clear":
+        cache.clear()
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    print("entries:  {entries}".format(**stats))
+    print("size:     {bytes} / {max_bytes} bytes".format(**stats))
+    print("hits:     {hits}".format(**stats))
+    print("misses:   {misses}".format(**stats))
+    print("hit rate: {:.1%}".format(float(stats["hits"]) / lookups if lookups else 0.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+Estimates how long CloudFormation takes to create a stack from a generated template.
+
+CloudFormation creates a resource as soon as everything it depends on is
+complete. Dependencies come from Ref, Fn::GetAtt and Fn::Sub (implicit) and
+from DependsOn (explicit). With a typical create time per resource type the
+earliest finish of every resource gives the wall-clock estimate, the chain of
+resources that determines it (critical path), and how many resources are
+being created at the same time.
+
+    python -m tools.critical_path templates/vpc_with_ec2.json [--durations overrides.json] [--json]
+"""
+import argparse
+import json
+import re
+import sys
+from collections import OrderedDict, namedtuple
+
+from tools import limits
+
+# typical seconds from CREATE_IN_PROGRESS to CREATE_COMPLETE
+DURATIONS = {
+    "AWS::ApiGateway::Account": 5,
+    "AWS::ApiGateway::Deployment": 5,
+    "AWS::ApiGateway::Method": 5,
+    "AWS::ApiGateway::Resource": 5,
+    "AWS::ApiGateway::RestApi": 5,
+    "AWS::ApiGateway::Stage": 10,
+    "AWS::ApiGatewayV2::Api": 5,
+    "AWS::ApiGatewayV2::Integration": 5,
+    "AWS::ApiGatewayV2::Route": 5,
+    "AWS::ApiGatewayV2::Stage": 5,
+    "AWS::ApplicationAutoScaling::ScalableTarget": 10,
+    "AWS::ApplicationAutoScaling::ScalingPolicy": 5,
+    "AWS::AutoScaling::AutoScalingGroup": 240,
+    "AWS::AutoScaling::LaunchConfiguration": 5,
+    "AWS::AutoScaling::LifecycleHook": 5,
+    "AWS::AutoScaling::ScalingPolicy": 5,
+    "AWS::AutoScaling::WarmPool": 120,
+    "AWS::CloudFront::CachePolicy": 5,
+    "AWS::CloudFront::Distribution": 600,
+    "AWS::CloudFront::OriginRequestPolicy": 5,
+    "AWS::CloudWatch::Alarm": 5,
+    "AWS::CloudWatch::Dashboard": 5,
+    "AWS::EC2::EIP": 10,
+    "AWS::EC2::InternetGateway": 15,
+    "AWS::EC2::LaunchTemplate": 5,
+    "AWS::EC2::NatGateway": 120,
+    "AWS::EC2::NetworkAcl": 5,
+    "AWS::EC2::NetworkAclEntry": 5,
+    "AWS::EC2::Route": 5,
+    "AWS::EC2::RouteTable": 5,
+    "AWS::EC2::SecurityGroup": 10,
+    "AWS::EC2::Subnet": 10,
+    "AWS::EC2::SubnetNetworkAclAssociation": 5,
+    "AWS::EC2::SubnetRouteTableAssociation": 5,
+    "AWS::EC2::VPC": 15,
+    "AWS::EC2::VPCEndpoint": 90,
+    "AWS::EC2::VPCGatewayAttachment": 20,
+    "AWS::ElastiCache::ReplicationGroup": 900,
+    "AWS::ElastiCache::SubnetGroup": 5,
+    "AWS::ElasticLoadBalancing::LoadBalancer": 60,
+    "AWS::ElasticLoadBalancingV2::Listener": 5,
+    "AWS::ElasticLoadBalancingV2::LoadBalancer": 180,
+    "AWS::ElasticLoadBalancingV2::TargetGroup": 10,
+    "AWS::Events::Rule": 10,
+    "AWS::GuardDuty::Detector": 10,
+    "AWS::GuardDuty::Master": 5,
+    "AWS::GuardDuty::Member": 5,
+    "AWS::IAM::InstanceProfile": 120,
+    "AWS::IAM::Policy": 20,
+    "AWS::IAM::Role": 20,
+    "AWS::Lambda::Alias": 5,
+    "AWS::Lambda::Function": 10,
+    "AWS::Lambda::Permission": 5,
+    "AWS::Lambda::Version": 5,
+    "AWS::Logs::LogGroup": 5,
+    "AWS::RDS::DBCluster": 600,
+    "AWS::RDS::DBClusterParameterGroup": 5,
+    "AWS::RDS::DBInstance": 600,
+    "AWS::RDS::DBParameterGroup": 5,
+    "AWS::RDS::DBProxy": 300,
+    "AWS::RDS::DBProxyTargetGroup": 120,
+    "AWS::RDS::DBSubnetGroup": 5,
+    "AWS::SecretsManager::Secret": 5,
+    "AWS::SNS::Topic": 10,
+    "AWS::SNS::TopicPolicy": 5,
+}
+DEFAULT_DURATION = 10
+# a Multi-AZ DBInstance also provisions and syncs the standby
+MULTI_AZ_DB_INSTANCE_DURATION = 1200
+# an alias with provisioned concurrency waits until its execution environments are initialized
+PROVISIONED_ALIAS_DURATION = 120
+
+Edge = namedtuple("Edge", ["source", "target", "explicit"])
+
+_SUB_VARIABLE = re.compile(r"\$\{([A-Za-z0-9]+)(?:\.[A-Za-z0-9.]+)?\}")
+
+
+def _references(value, found):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "Ref" and isinstance(item, str):
+                found.add(item)
+            elif key == "Fn::GetAtt":
+                found.add(item.split(".")[0] if isinstance(item, str) else item[0])
+            elif key == "Fn::Sub":
+                string = item if isinstance(item, str) else item[0]
+                found.update(_SUB_VARIABLE.findall(string))
+                if not isinstance(item, str):
+                    _references(item[1], found)
+            else:
+                _references(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            _references(item, found)
+    return found
+
+
+def duration(resource, durations=DURATIONS):
+    resource_type = resource.get("Type")
+    if resource_type == "AWS::RDS::DBInstance" and resource.get("Properties", {}).get("MultiAZ") in (True, "true"):
+        return durations.get("AWS::RDS::DBInstance::MultiAZ", MULTI_AZ_DB_INSTANCE_DURATION)
+    if resource_type == "AWS::Lambda::Alias" and "ProvisionedConcurrencyConfig" in resource.get("Properties", {}):
+        return durations.get("AWS::Lambda::Alias::ProvisionedConcurrency", PROVISIONED_ALIAS_DURATION)
+    return durations.get(resource_type, DEFAULT_DURATION)
+
+
+class Graph(object):
+    def __init__(self, resources, durations=DURATIONS):
+        """
+        :type resources dict the Resources section of a template
+        """
+        self.resources = resources
+        self.durations = OrderedDict((name, duration(resource, durations)) for name, resource in resources.items())
+        self.dependencies = OrderedDict((name, OrderedDict()) for name in resources)
+        self.referenced = OrderedDict()
+
+        for name, resource in resources.items():
+            self.referenced[name] = set(
+                target for target in _references(
+                    dict((key, value) for key, value in resource.items() if key not in ("DependsOn", "Type")), set()
+                ) if target in resources and target != name
+            )
+            for target in sorted(self.referenced[name]):
+                self.dependencies[name][target] = Edge(name, target, False)
+
+            depends_on = resource.get("DependsOn", [])
+            for target in [depends_on] if isinstance(depends_on, str) else depends_on:
+                # a DependsOn duplicating a Ref replaces the implicit edge and is reported as redundant
+                self.dependencies[name][target] = Edge(name, target, True)
+
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("dependency cycle: {}".format(" -> ".join(path + [name])))
+            state[name] = "visiting"
+            for target in self.dependencies[name]:
+                if target not in self.resources:
+                    raise ValueError("{} depends on unknown resource {}".format(name, target))
+                visit(target, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.resources:
+            visit(name, [])
+        return order
+
+    def schedule(self):
+        """
+        Earliest start and finish of every resource with unlimited parallelism.
+
+        :rtype OrderedDict[str, tuple[float, float]]
+        """
+        times = OrderedDict()
+        for name in self.order:
+            start = max([times[target][1] for target in self.dependencies[name]] + [0])
+            times[name] = (start, start + self.durations[name])
+        return times
+
+    def critical_path(self, times=None):
+        times = times or self.schedule()
+        if not times:
+            return []
+        name = max(times, key=lambda n: times[n][1])
+        path = [name]
+        while self.dependencies[name]:
+            name = max(self.dependencies[name], key=lambda target: times[target][1])
+            path.append(name)
+        return list(reversed(path))
+
+    def max_parallelism(self, times=None):
+        times = times or self.schedule()
+        events = sorted(
+            [(start, 1) for start, _ in times.values()] + [(finish, -1) for _, finish in times.values()]
+        )
+        running = widest = 0
+        for _, change in events:  # finishes sort before starts at the same instant
+            running += change
+            widest = max(widest, running)
+        return widest
+
+    def _reachable(self, source, target, skip):
+        stack, seen = [source], set()
+        while stack:
+            name = stack.pop()
+            for edge in self.dependencies[name].values():
+                if edge is skip or edge.target in seen:
+                    continue
+                if edge.target == target:
+                    return True
+                seen.add(edge.target)
+                stack.append(edge.target)
+        return False
+
+    def redundant_depends_on(self):
+        """
+        Explicit DependsOn edges whose target is already waited for through another path.
+
+        :rtype list[Edge]
+        """
+        redundant = []
+        for name in self.order:
+            for edge in self.dependencies[name].values():
+                if edge.explicit and (
+                    edge.target in self.referenced[name] or self._reachable(name, edge.target, skip=edge)
+                ):
+                    redundant.append(edge)
+        return redundant
+
+
+def analyze(data, durations=DURATIONS):
+    """
+    :type data dict rendered template
+    :rtype dict
+    """
+    graph = Graph(data.get("Resources", {}), durations)
+    times = graph.schedule()
+    path = graph.critical_path(times)
+    total = max([finish for _, finish in times.values()] + [0])
+    busy = sum(graph.durations.values())
+    return OrderedDict([
+        ("resources", len(graph.resources)),
+        ("estimated_seconds", total),
+        ("sequential_seconds", busy),
+        ("max_parallelism", graph.max_parallelism(times)),
+        ("average_parallelism", float(busy) / total if total else 0.0),
+        ("critical_path", [
+            OrderedDict([
+                ("resource", name),
+                ("type", graph.resources[name].get("Type")),
+                ("start", times[name][0]),
+                ("finish", times[name][1]),
+            ]) for name in path
+        ]),
+        ("redundant_depends_on", [
+            OrderedDict([
+                ("resource", edge.source),
+                ("depends_on", edge.target),
+                ("also_referenced", edge.target in graph.referenced[edge.source]),
+            ]) for edge in graph.redundant_depends_on()
+        ]),
+    ])
+
+
+def report(name, result, stream=sys.stdout):
+    stream.write("{}: {} resources\n".format(name, result["resources"]))
+    stream.write("  estimated create time: {:.0f}s ({:.1f} min), {:.0f}s if created one by one\n".format(
+        result["estimated_seconds"], result["estimated_seconds"] / 60.0, result["sequential_seconds"]
+    ))
+    stream.write("  parallelism: up to {} resources at once, {:.1f} on average\n".format(
+        result["max_parallelism"], result["average_parallelism"]
+    ))
+    stream.write("  critical path:\n")
+    for step in result["critical_path"]:
+        stream.write("    {:>6.0f}s - {:>6.0f}s  {} ({})\n".format(step["start"], step["finish"], step["resource"], step["type"]))
+    if result["redundant_depends_on"]:
+        stream.write("  redundant DependsOn:\n")
+        for edge in result["redundant_depends_on"]:
+            stream.write("    {} -> {}{}\n".format(
+                edge["resource"], edge["depends_on"],
+                " (already referenced)" if edge["also_referenced"] else " (implied by other dependencies)"
+            ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate stack create time and its critical path")
+    parser.add_argument("templates", nargs="+", help="Rendered templates (.json or .yaml)")
+    parser.add_argument("--durations", help="JSON file overriding typical create seconds per resource type")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    durations = dict(DURATIONS)
+    if args.durations:
+        with open(args.durations) as f:
+            durations.update(json.load(f))
+
+    results = OrderedDict()
+    for path in args.templates:
+        with open(path) as f:
+            data = limits.load(f.read(), "yaml" if path.endswith((".yaml", ".yml")) else "json")
+        try:
+            results[path] = analyze(data, durations)
+        except ValueError as e:
+            sys.stderr.write("{}: {}\n".format(path, e))
+            return 1
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        for path, result in results.items():
+            report(path, result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
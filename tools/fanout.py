@@ -0,0 +1,87 @@
+"""
+Renders one specialized template per (environment, region) pair of a matrix file.
+
+    {
+        "template": "vpc_with_ec2",
+        "regions": ["eu-west-1", "us-east-1"],
+        "environments": {
+            "staging": {"ec2_instance_type": "t2.micro"},
+            "production": {"ec2_instance_type": "m4.large"}
+        }
+    }
+
+Each environment's values and the region are passed to the template's
+build_template() as options, so values known up front are rendered as
+literals instead of parameters and FindInMap lookups. Variants are rendered
+across the build worker pool and written to
+templates/<template>/<environment>-<region>.json as each one finishes.
+
+    python -m tools.fanout matrix.json [--jobs N] [--output-dir DIR] [--format json|compact|yaml]
+"""
+import argparse
+import json
+import sys
+import time
+
+from tools import build, limits
+from tools.cache import CACHE_DIR, Cache
+
+
+def jobs(matrix, sources):
+    """
+    :type matrix dict parsed matrix file
+    :type sources dict[str, build.Job] templates by name
+    :rtype list[build.Job]
+    """
+    name = matrix["template"]
+    if name not in sources:
+        raise ValueError("unknown template {!r}".format(name))
+    result = []
+    for environment, options in sorted(matrix["environments"].items()):
+        for region in matrix["regions"]:
+            result.append(build.Job(
+                "{}/{}-{}".format(name, environment, region),
+                sources[name].source,
+                dict(options, region=region),
+            ))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a template for every environment and region of a matrix")
+    parser.add_argument("matrix", help="JSON matrix file")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("-o", "--output-dir", default=build.OUTPUT_DIR)
+    parser.add_argument("-f", "--format", choices=sorted(build.FORMATS), default="json")
+    parser.add_argument("--body-limit", choices=sorted(limits.BODY_LIMITS), default="inline")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    with open(args.matrix) as f:
+        matrix = json.load(f)
+    try:
+        variants = jobs(matrix, dict((job.name, job) for job in build.discover()))
+    except (KeyError, ValueError) as e:
+        parser.error("invalid matrix {}: {}".format(args.matrix, e))
+
+    cache = None if args.no_cache else Cache(CACHE_DIR)
+    start = time.time()
+    try:
+        results = build.build(variants, output_dir=args.output_dir, processes=args.jobs, cache=cache, fmt=args.format)
+    except RuntimeError as e:
+        sys.stderr.write("fan-out failed: {}\n".format(e))
+        return 1
+
+    if not args.quiet:
+        build.report(results, time.time() - start)
+
+    problems = build.check(results, args.body_limit)
+    for problem in problems:
+        sys.stderr.write("limit exceeded: {}\n".format(problem))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+CloudFormation quotas a generated template has to fit in.
+
+https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/cloudformation-limits.html
+"""
+import json
+from collections import namedtuple
+
+import cfn_flip
+
+# TemplateBody passed inline to CreateStack/UpdateStack vs. TemplateURL pointing to S3
+BODY_LIMITS = {
+    "inline": 51200,
+    "s3": 1000000,
+}
+RESOURCES_LIMIT = 500
+PARAMETERS_LIMIT = 200
+OUTPUTS_LIMIT = 200
+MAPPINGS_LIMIT = 200
+
+Usage = namedtuple("Usage", ["bytes", "resources", "parameters", "outputs", "mappings"])
+
+
+def load(body, fmt="json"):
+    if fmt == "yaml":
+        return cfn_flip.load_yaml(body)
+    return json.loads(body)
+
+
+def usage(body, fmt="json"):
+    """
+    :type body str rendered template as it will be sent to CloudFormation
+    :rtype Usage
+    """
+    data = load(body, fmt)
+    return Usage(
+        bytes=len(body.encode("utf-8")),
+        resources=len(data.get("Resources", {})),
+        parameters=len(data.get("Parameters", {})),
+        outputs=len(data.get("Outputs", {})),
+        mappings=len(data.get("Mappings", {})),
+    )
+
+
+def violations(used, body_limit="inline"):
+    """
+    :type used Usage
+    :rtype list[str]
+    """
+    limits = [
+        ("template body bytes", used.bytes, BODY_LIMITS[body_limit]),
+        ("resources", used.resources, RESOURCES_LIMIT),
+        ("parameters", used.parameters, PARAMETERS_LIMIT),
+        ("outputs", used.outputs, OUTPUTS_LIMIT),
+        ("mappings", used.mappings, MAPPINGS_LIMIT),
+    ]
+    return ["{} {} > {}".format(name, value, limit) for name, value, limit in limits if value > limit]